@@ -1,8 +1,6 @@
 # This Python file uses the following encoding: utf-8
 # -*- coding: utf-8 -*-
 # Copyright (C) 2016   CzT/Vladislav Ivanov
-import Queue
-import imp
 import logging
 import logging.config
 import os
@@ -10,10 +8,12 @@ from collections import OrderedDict
 from time import sleep
 import semantic_version
 import messaging
+from modules.helper.httpclient import http
 from modules.helper.module import BaseModule
 from modules.helper.parser import load_from_config_file
+from modules.helper.plugins import PluginRegistry, run_concurrently
 from modules.helper.system import load_translations_keys, PYTHON_FOLDER, CONF_FOLDER, MAIN_CONF_FILE, MODULE_FOLDER, \
-    LOG_FOLDER, GUI_TAG, TRANSLATION_FOLDER, LOG_FILE, LOG_FORMAT, get_language, get_update, ModuleLoadException
+    LOG_FOLDER, GUI_TAG, TRANSLATION_FOLDER, LOG_FILE, LOG_FORMAT, get_language, get_update_async, ModuleLoadException
 
 VERSION = '0.3.6'
 SEM_VERSION = semantic_version.Version(VERSION)
@@ -67,6 +67,9 @@ def init():
     main_config_dict['system'] = OrderedDict()
     main_config_dict['system']['log_level'] = 'INFO'
     main_config_dict['system']['testing_mode'] = False
+    main_config_dict['system']['queue_size'] = messaging.QUEUE_SIZE
+    main_config_dict['system']['queue_policy'] = messaging.QUEUE_DROP_OLDEST
+    main_config_dict['system']['queue_high_water'] = messaging.QUEUE_HIGH_WATER
     main_config_dict['gui'] = OrderedDict()
     main_config_dict['gui']['cli'] = False
     main_config_dict['gui']['show_icons'] = False
@@ -87,7 +90,11 @@ def init():
             'check': 'translations'
         },
         'system': {
-            'hidden': ['log_level', 'testing_mode'],
+            'hidden': ['log_level', 'testing_mode', 'queue_size', 'queue_policy', 'queue_high_water'],
+            'queue_policy': {
+                'view': 'dropdown',
+                'choices': messaging.QUEUE_POLICIES
+            }
         },
         'gui': {
             'hidden': ['cli'],
@@ -111,6 +118,8 @@ def init():
         conf_file_name='config.cfg'
     )
     loaded_modules['main'] = main_class.conf_params()
+    loaded_modules['main']['update'] = False
+    loaded_modules['main']['update_url'] = None
     root_logger.setLevel(level=logging.getLevelName(main_config_dict['system'].get('log_level', 'INFO')))
 
     gui_settings['gui'] = main_config_dict[GUI_TAG].get('gui')
@@ -125,11 +134,14 @@ def init():
                                 int(main_config_dict['gui_information'].get('pos_y')))
     gui_settings['show_browser'] = main_config_dict['gui'].get('show_browser')
 
-    # Checking updates
-    log.info("Checking for updates")
-    loaded_modules['main']['update'], loaded_modules['main']['update_url'] = get_update(SEM_VERSION)
-    if loaded_modules['main']['update']:
-        log.info("There is new update, please update!")
+    # Checking updates in background, so startup doesn't wait for network
+    def update_found(update, update_url):
+        loaded_modules['main']['update_url'] = update_url
+        loaded_modules['main']['update'] = update
+        if update:
+            log.info("There is new update, please update!")
+            if 'gui' in loaded_modules:
+                loaded_modules['gui']['class'].show_update()
 
     # Starting modules
     log.info("Loading Messaging Handler")
@@ -142,12 +154,17 @@ def init():
         log.exception("Failed loading translations")
 
     # Creating queues for messaging transfer between chat threads
-    queue = Queue.Queue()
+    queue = messaging.MessageQueue(max_size=main_config_dict['system']['queue_size'],
+                                   policy=main_config_dict['system']['queue_policy'],
+                                   high_water=main_config_dict['system']['queue_high_water'])
     # Loading module for message processing...
     msg = messaging.Message(queue)
     loaded_modules.update(msg.load_modules(main_config, loaded_modules['main']))
     msg.start()
 
+    log.info("Checking for updates")
+    get_update_async(SEM_VERSION, update_found)
+
     log.info("Loading Chats")
     # Trying to dynamically load chats that are in config file.
     chat_modules = os.path.join(CONF_FOLDER, "chat_modules.cfg")
@@ -171,38 +188,50 @@ def init():
         },
         conf_file_name='chat_modules.cfg'
     )
+    chat_module.rest_add('GET', 'http', http.rest_get_stats)
+    chat_module.rest_add('DELETE', 'http', http.rest_reset_stats)
     loaded_modules['chat'] = chat_module.conf_params()
 
-    for chat_module in chat_conf_dict['chats']:
-        log.info("Loading chat module: {0}".format(chat_module))
-        module_location = os.path.join(chat_location, chat_module + ".py")
-        if os.path.isfile(module_location):
-            log.info("found {0}".format(chat_module))
-            # After module is find, we are initializing it.
-            # Class should be named as in config
-            # Also passing core folder to module so it can load it's own
-            #  configuration correctly
-
-            tmp = imp.load_source(chat_module, module_location)
-            chat_init = getattr(tmp, chat_module)
-            class_module = chat_init(queue=queue,
-                                     conf_folder=CONF_FOLDER,
-                                     conf_file=os.path.join(CONF_FOLDER, '{0}.cfg'.format(chat_module)),
-                                     testing=main_config_dict['system']['testing_mode'])
-            loaded_modules[chat_module] = class_module.conf_params()
-        else:
-            log.error("Unable to find {0} module")
+    # Chat modules are imported only when enabled and constructed concurrently,
+    #  class should be named as in config
+    # Also passing core folder to module so it can load it's own
+    #  configuration correctly
+    def construct_chat(chat_name, chat_init):
+        log.info("Loading chat module: {0}".format(chat_name))
+        return chat_init(queue=queue,
+                         conf_folder=CONF_FOLDER,
+                         conf_file=os.path.join(CONF_FOLDER, '{0}.cfg'.format(chat_name)),
+                         testing=main_config_dict['system']['testing_mode'])
+
+    chat_registry = PluginRegistry('modules.chat', chat_location)
+    for chat_name, class_module in chat_registry.construct(chat_conf_dict['chats'], construct_chat).items():
+        loaded_modules[chat_name] = class_module.conf_params()
 
     # Actually loading modules
-    for f_module, f_config in loaded_modules.iteritems():
-        if 'class' in f_config:
+    def load_module(f_module):
+        loaded_modules[f_module]['class'].load_module(main_settings=main_config, loaded_modules=loaded_modules,
+                                                      queue=queue)
+        log.debug('loaded module {}'.format(f_module))
+
+    def unload_module(f_module):
+        if loaded_modules[f_module]['class'] in msg.modules:
+            msg.modules.remove(loaded_modules[f_module]['class'])
+        loaded_modules.pop(f_module)
+
+    # Messaging modules are loaded one by one as they depend on each other,
+    #  chat modules only need them, so they are connecting concurrently
+    chat_names = [name for name in chat_conf_dict['chats'] if name in loaded_modules]
+    for f_module, f_config in loaded_modules.items():
+        if 'class' in f_config and f_module not in chat_names:
             try:
-                f_config['class'].load_module(main_settings=main_config, loaded_modules=loaded_modules,
-                                              queue=queue)
-                log.debug('loaded module {}'.format(f_module))
+                load_module(f_module)
             except ModuleLoadException:
-                msg.modules.remove(loaded_modules[f_module]['class'])
-                loaded_modules.pop(f_module)
+                unload_module(f_module)
+    for f_module, (_, exc) in run_concurrently([(name, name) for name in chat_names], load_module).items():
+        if isinstance(exc, ModuleLoadException):
+            unload_module(f_module)
+        elif exc is not None:
+            raise exc
     log.info('LalkaChat loaded successfully')
 
     if gui_settings['gui']:
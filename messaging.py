@@ -3,29 +3,338 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import os
 import threading
-import imp
+import json
 import operator
 import logging
+import multiprocessing
+import Queue
+import random
+import time
 from collections import OrderedDict
 
+from modules.helper.message import SystemMessage, TextMessage, CommandMessage
 from modules.helper.module import BaseModule, MessagingModule
-from modules.helper.system import ModuleLoadException, THREADS, CONF_FOLDER
-from modules.helper.parser import load_from_config_file
+from modules.helper.system import ModuleLoadException, RestApiException, THREADS, CONF_FOLDER
+from modules.helper.parser import load_from_config_file, save_settings
+from modules.helper.plugins import PluginRegistry
+from modules.helper.stats import TimingStat, Histogram, timer
 
 
 log = logging.getLogger('messaging')
-MODULE_PRI_DEFAULT = '100'
+MAX_THREADS = 32
+BATCH_SIZE = 20
+BATCH_TIMEOUT = 10
+HANDLER_QUEUE_SIZE = 200
+STOP_HANDLER = object()
+
+QUEUE_SIZE = 5000
+QUEUE_HIGH_WATER = 80
+QUEUE_DROP_OLDEST = 'drop_oldest'
+QUEUE_SAMPLE = 'sample'
+QUEUE_POLICIES = [QUEUE_DROP_OLDEST, QUEUE_SAMPLE]
+
+
+def shard_key(message):
+    """
+        Messages from the same chat and channel always share a key,
+          so they are handled by the same thread and keep their order,
+          commands that name their channel share its key
+    :param message: Message from main queue
+    :return: hashable key
+    """
+    return getattr(message, 'source', None), getattr(message, 'channel_name', None)
+
+
+def is_barrier(message):
+    """
+        Commands that don't name their channel can act on messages of any channel,
+          so they are processed after everything that was queued before them
+    :param message: Message from main queue
+    """
+    return isinstance(message, CommandMessage) and message.source is None
+
+
+def is_protected(message):
+    """
+        Commands and system messages (connection events etc.)
+          are never dropped from the queue
+    :param message: Message from main queue
+    """
+    return isinstance(message, SystemMessage) or not isinstance(message, TextMessage)
+
+
+# Pure transform modules, filled in before offload pool is forked
+_OFFLOAD_MODULES = {}
+
+
+def pack_message(message):
+    """
+        Compact form of text message for offload workers,
+          only fields that transform modules work with
+    :param message: TextMessage
+    :return: tuple
+    """
+    return isinstance(message, SystemMessage), message.source, message.user, message.text, message.pm
+
+
+def unpack_message(packed):
+    is_system, source, user, text, pm = packed
+    if is_system:
+        return SystemMessage(text, source=source, user=user)
+    return TextMessage(source, None, user, text, pm=pm)
+
+
+def pack_result(message):
+    """
+        Collects changes that transform modules made to the message
+    :param message: processed message, could be None if message is "cleared"
+    :return: tuple or None
+    """
+    if message is None:
+        return None
+    return message.text, message.pm, list(message.iter_extensions())
+
+
+def merge_result(message, result):
+    if result is None:
+        return None
+    text, pm, extensions = result
+    message.text = text
+    message.pm = pm
+    for name, value, jsonable in extensions:
+        message.set_extension(name, value, jsonable=jsonable)
+    return message
+
+
+def offload_batch(module_names, packed_messages, configs):
+    """
+        Runs inside offload worker process
+    :param module_names: names of pure transform modules to run, in order
+    :param packed_messages: messages in compact form
+    :param configs: current configs of modules, so runtime changes reach workers
+    :return: list of results and time spent in each module
+    """
+    modules = [_OFFLOAD_MODULES[name] for name in module_names]
+    for m_module, config in zip(modules, configs):
+        m_module.conf_params()['config'] = config
+
+    timings = [0.0] * len(modules)
+    results = []
+    for packed in packed_messages:
+        message = unpack_message(packed)
+        for index, m_module in enumerate(modules):
+            start = timer()
+            message = m_module.process_message(message)
+            timings[index] += timer() - start
+        results.append(pack_result(message))
+    return results, timings
+
+
+class MessageQueue(Queue.Queue):
+    def __init__(self, max_size=QUEUE_SIZE, policy=QUEUE_DROP_OLDEST, high_water=QUEUE_HIGH_WATER):
+        """
+            Main queue with load shedding
+              Queue itself is unbounded, limit is enforced on put,
+              so protected messages are never blocked or refused
+        :param max_size: maximum amount of text messages in queue, 0 to disable
+        :param policy: drop_oldest - drops oldest text message when queue is full
+                       sample - drops part of new text messages over high water mark
+        :param high_water: high water mark in percents of max_size
+        """
+        Queue.Queue.__init__(self)
+        if policy not in QUEUE_POLICIES:
+            log.warning("Unknown queue policy %s, using %s", policy, QUEUE_DROP_OLDEST)
+            policy = QUEUE_DROP_OLDEST
+        self.max_size = int(max_size)
+        self.policy = policy
+        self.high_water_percent = int(high_water)
+        self.high_water = self.max_size * self.high_water_percent / 100
+        self.dropped = {}
+
+    def put(self, item, block=True, timeout=None):
+        with self.mutex:
+            if self.max_size and not is_protected(self._message(item)) and not self._admit():
+                self._count_drop(item)
+                return
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _admit(self):
+        size = self._qsize()
+        if self.policy == QUEUE_SAMPLE:
+            if size < self.high_water:
+                return True
+            if size >= self.max_size:
+                return False
+            return random.random() < (self.max_size - size) / float(self.max_size - self.high_water)
+
+        if size < self.max_size:
+            return True
+        for index, queued in enumerate(self.queue):
+            if not is_protected(self._message(queued)):
+                del self.queue[index]
+                self.unfinished_tasks -= 1
+                self._count_drop(queued)
+                return True
+        return False
+
+    @staticmethod
+    def _message(item):
+        return item
+
+    def pending(self):
+        """
+            Messages that are queued or not yet processed by handlers,
+              handlers mark processed messages with task_done
+        """
+        with self.mutex:
+            return self.unfinished_tasks
+
+    def _count_drop(self, item):
+        source = getattr(self._message(item), 'source', None)
+        self.dropped[source] = self.dropped.get(source, 0) + 1
+
+    def json(self):
+        with self.mutex:
+            return {
+                'size': self._qsize(),
+                'max_size': self.max_size,
+                'policy': self.policy,
+                'dropped': dict(self.dropped)
+            }
+
+
+class ShardQueue(MessageQueue):
+    def __init__(self, max_size=HANDLER_QUEUE_SIZE, policy=QUEUE_DROP_OLDEST, high_water=QUEUE_HIGH_WATER,
+                 drop=None):
+        """
+            Handler queue, same load shedding as main queue,
+              so one busy channel can't block dispatching to other handlers
+        :param drop: function(message), called for every dropped message
+        """
+        MessageQueue.__init__(self, max_size, policy, high_water)
+        self.drop = drop or (lambda message: None)
+
+    @staticmethod
+    def _message(item):
+        # Messages are queued with time, barriers and stop marker are not
+        return item[1] if isinstance(item, tuple) else item
+
+    def _count_drop(self, item):
+        MessageQueue._count_drop(self, item)
+        self.drop(self._message(item))
+
+
+class ShardBarrier(object):
+    def __init__(self, message, parties):
+        """
+            Command queued to every handler, handlers stop at it
+              and the last one to reach it processes the command
+        :param message: command
+        :param parties: amount of handlers barrier is queued to
+        """
+        self.message = message
+        self._remaining = parties
+        self._done = False
+        self._condition = threading.Condition()
+
+    def wait(self, process):
+        """
+            Blocks until command is processed
+        :param process: function(list of messages), called by the last handler
+        :return: True for the handler that processed the command
+        """
+        with self._condition:
+            self._remaining -= 1
+            if self._remaining:
+                while not self._done:
+                    self._condition.wait()
+                return False
+        try:
+            process([self.message])
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+        return True
 
 
 class MessageHandler(threading.Thread):
-    def __init__(self, queue, process):
-        self.queue = queue
-        self.process = process
+    def __init__(self, process, batch_size=1, batch_timeout=0, wait_stats=None, queue=None, done=None):
+        """
+            Message handler thread, processes messages in micro-batches
+        :param process: function that receives list of messages
+        :param batch_size: maximum amount of messages in one batch
+        :param batch_timeout: how long (in seconds) to wait for batch to fill up
+        :param wait_stats: histogram for time messages spent in queue
+        :param queue: handler queue (ShardQueue), default one is created if not set
+        :param done: function(count), called after messages are processed
+        """
         threading.Thread.__init__(self)
+        self.daemon = True
+        self.done = done or (lambda count: None)
+        self.queue = queue if queue is not None else ShardQueue()
+        self.process = process
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.wait_stats = wait_stats if wait_stats is not None else Histogram()
+
+    def put(self, message):
+        self.queue.put((timer(), message))
+
+    def put_barrier(self, barrier):
+        self.queue.put(barrier)
+
+    def oldest_age(self):
+        with self.queue.mutex:
+            if not self.queue.queue or not isinstance(self.queue.queue[0], tuple):
+                return 0.0
+            enqueued = self.queue.queue[0][0]
+        return timer() - enqueued
+
+    def _get_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.time() + self.batch_timeout
+        while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
 
     def run(self):
-        while True:
-            self.process(self.queue.get())
+        running = True
+        while running:
+            batch = self._get_batch()
+            barrier = None
+            if batch[-1] is STOP_HANDLER:
+                batch.pop()
+                running = False
+            elif isinstance(batch[-1], ShardBarrier):
+                barrier = batch.pop()
+
+            if batch:
+                now = timer()
+                for enqueued, _ in batch:
+                    self.wait_stats.add(now - enqueued)
+                self._process([message for _, message in batch])
+                self.done(len(batch))
+            if barrier and barrier.wait(self._process):
+                self.done(1)
+
+    def _process(self, messages):
+        try:
+            self.process(messages)
+        except Exception as exc:
+            log.exception(exc)
+
+    def stop(self):
+        self.queue.put(STOP_HANDLER)
 
 
 class Message(threading.Thread):
@@ -37,6 +346,21 @@ class Message(threading.Thread):
         self.queue = queue
         self.module_tag = "modules.messaging"
         self.threads = []
+        self.threads_count = THREADS
+        self.batch_size = BATCH_SIZE
+        self.batch_timeout = BATCH_TIMEOUT
+        self.settings = None
+        self._shard_lock = threading.Lock()
+        # Messages dropped by handler queues, they are replaced on resize so count is kept here
+        self.shard_dropped = {}
+        self._drop_lock = threading.Lock()
+
+        self.module_stats = OrderedDict()
+        self.wait_stats = Histogram()
+
+        self.offload = False
+        self.offload_processes = None
+        self.offload_pool = None
 
     def load_modules(self, main_config, settings):
         log.info("Loading configuration file for messaging")
@@ -46,6 +370,12 @@ class Message(threading.Thread):
         conf_dict = OrderedDict()
         conf_dict['gui_information'] = {'category': 'messaging'}
         conf_dict['messaging'] = {'webchat': None}
+        conf_dict['system'] = OrderedDict()
+        conf_dict['system']['threads'] = THREADS
+        conf_dict['system']['batch_size'] = BATCH_SIZE
+        conf_dict['system']['batch_timeout'] = BATCH_TIMEOUT
+        conf_dict['system']['offload'] = False
+        conf_dict['system']['offload_processes'] = 0
 
         conf_gui = {
             'messaging': {'check': 'modules/messaging',
@@ -53,7 +383,10 @@ class Message(threading.Thread):
                           'file_extension': False,
                           'view': 'choose_multiple',
                           'description': True},
-            'non_dynamic': ['messaging.*']}
+            'system': {
+                'hidden': ['threads', 'batch_size', 'batch_timeout', 'offload', 'offload_processes']
+            },
+            'non_dynamic': ['messaging.*', 'system.*']}
         config = load_from_config_file(conf_file, conf_dict)
         messaging_module = BaseModule(
             conf_params={
@@ -65,57 +398,231 @@ class Message(threading.Thread):
             conf_file_name='messaging_modules.cfg'
         )
 
+        messaging_module.rest_add('GET', 'threads', self.rest_get_threads)
+        messaging_module.rest_add('POST', 'threads', self.rest_set_threads)
+        messaging_module.rest_add('GET', 'stats', self.rest_get_stats)
+        messaging_module.rest_add('DELETE', 'stats', self.rest_reset_stats)
         modules_list['messaging'] = messaging_module.conf_params()
+        self.settings = modules_list['messaging']
+        try:
+            self.threads_count = self._valid_threads(conf_dict['system'].get('threads', THREADS))
+        except ValueError as exc:
+            log.warning("Wrong messaging threads setting: %s", exc)
+        self.batch_size = max(int(conf_dict['system'].get('batch_size', BATCH_SIZE)), 1)
+        self.batch_timeout = max(int(conf_dict['system'].get('batch_timeout', BATCH_TIMEOUT)), 0)
+        self.offload = conf_dict['system'].get('offload', False)
+        self.offload_processes = int(conf_dict['system'].get('offload_processes', 0)) or None
 
         modules = {}
         # Loading modules from cfg.
-        if len(conf_dict['messaging']) > 0:
-            for m_module in conf_dict['messaging']:
-                log.info("Loading %s" % m_module)
-                # We load the module, and then we initalize it.
-                # When writing your modules you should have class with the
-                #  same name as module name
-                join_path = [main_config['root_folder']] + self.module_tag.split('.') + ['{0}.py'.format(m_module)]
-                file_path = os.path.join(*join_path)
-
-                try:
-                    tmp = imp.load_source(m_module, file_path)
-                    class_init = getattr(tmp, m_module)
-                    class_module = class_init(main_config['conf_folder'],
-                                              root_folder=main_config['root_folder'],
-                                              main_settings=settings,
-                                              conf_file=os.path.join(CONF_FOLDER, '{0}.cfg'.format(m_module)))
-
-                    params = class_module.conf_params()
-                    if 'id' in params:
-                        priority = params['id']
-                    else:
-                        priority = MODULE_PRI_DEFAULT
-
-                    if int(priority) in modules:
-                        modules[int(priority)].append(class_module)
-                    else:
-                        modules[int(priority)] = [class_module]
-
-                    modules_list[m_module] = params
-                except ModuleLoadException:
-                    log.error("Unable to load module {0}".format(m_module))
+        # When writing your modules you should have class with the
+        #  same name as module name
+        registry = PluginRegistry(self.module_tag, os.path.join(main_config['root_folder'], *self.module_tag.split('.')))
+
+        def construct(m_module, class_init):
+            log.info("Loading %s" % m_module)
+            return class_init(main_config['conf_folder'],
+                              root_folder=main_config['root_folder'],
+                              main_settings=settings,
+                              conf_file=os.path.join(CONF_FOLDER, '{0}.cfg'.format(m_module)))
+
+        for m_module, class_module in registry.construct(list(conf_dict['messaging']), construct).items():
+            params = class_module.conf_params()
+            if 'id' in params:
+                priority = params['id']
+            else:
+                priority = registry.priority(m_module)
+
+            if int(priority) in modules:
+                modules[int(priority)].append(class_module)
+            else:
+                modules[int(priority)] = [class_module]
+
+            modules_list[m_module] = params
         sorted_module = sorted(modules.items(), key=operator.itemgetter(0))
         for sorted_priority, sorted_list in sorted_module:
             for sorted_list_item in sorted_list:
                 self.modules.append(sorted_list_item)
+                self.module_stats[sorted_list_item] = TimingStat()
 
+        # Python 2 pool can only fork, so it's created before any thread is started
+        self.start_offload()
         return modules_list
 
-    def msg_process(self, message):
-        # When we receive message we pass it via all loaded modules
-        # All modules should return the message with modified/not modified
+    def msg_process(self, messages):
+        # When we receive batch of messages we pass it via all loaded modules
+        # All modules should return the messages with modified/not modified
         #  content so it can be passed to new module, or to pass to CLI
-        for m_module in self.modules:  # type: MessagingModule
-            message = m_module.process_message(message, queue=self.queue)
+        index = 0
+        modules = list(self.modules)
+        while index < len(modules):
+            m_module = modules[index]  # type: MessagingModule
+            if self.offload_pool and m_module.pure_transform:
+                # Running all consecutive pure modules in one worker call
+                run = []
+                while index < len(modules) and modules[index].pure_transform:
+                    run.append(modules[index])
+                    index += 1
+                messages = self._offload(run, messages)
+                continue
+
+            start = timer()
+            messages = m_module.process_batch(messages, queue=self.queue)
+            self.module_stats[m_module].add(timer() - start, len(messages))
+            index += 1
+
+    def _offload(self, modules, messages):
+        indexes = [index for index, message in enumerate(messages) if isinstance(message, TextMessage)]
+        if not indexes:
+            return messages
+
+        results, timings = self.offload_pool.apply(offload_batch, (
+            [m_module.__class__.__name__ for m_module in modules],
+            [pack_message(messages[index]) for index in indexes],
+            [m_module.conf_params()['config'] for m_module in modules]
+        ))
+        for m_module, elapsed in zip(modules, timings):
+            self.module_stats[m_module].add(elapsed, len(indexes))
+
+        messages = list(messages)
+        for index, result in zip(indexes, results):
+            messages[index] = merge_result(messages[index], result)
+        return messages
+
+    def start_offload(self):
+        pure_modules = [m_module for m_module in self.modules if m_module.pure_transform]
+        if not self.offload or not pure_modules:
+            return
+        if not hasattr(os, 'fork'):
+            log.warning("Offloading messaging modules requires fork support, running them in-process")
+            return
+
+        _OFFLOAD_MODULES.clear()
+        _OFFLOAD_MODULES.update((m_module.__class__.__name__, m_module) for m_module in pure_modules)
+        try:
+            self.offload_pool = multiprocessing.Pool(self.offload_processes)
+        except Exception as exc:
+            log.exception("Unable to start offload pool, running modules in-process: %s", exc)
+            return
+        log.info("Offloading %s to %s processes",
+                 ', '.join(_OFFLOAD_MODULES.keys()), self.offload_processes or multiprocessing.cpu_count())
+
+    @staticmethod
+    def _valid_threads(threads):
+        threads = int(threads)
+        if not 0 < threads <= MAX_THREADS:
+            raise ValueError('Threads count should be between 1 and {}'.format(MAX_THREADS))
+        return threads
+
+    def _shard_queue(self, threads):
+        """
+            Handler queues share limits of the main queue,
+              so configured queue size and high water mark apply to the whole pipeline
+        """
+        if not isinstance(self.queue, MessageQueue):
+            return ShardQueue(drop=self._shard_drop)
+        max_size = self.queue.max_size and max(self.queue.max_size // threads, 1)
+        return ShardQueue(max_size, self.queue.policy, self.queue.high_water_percent, self._shard_drop)
+
+    def _start_handlers(self, threads):
+        handlers = [MessageHandler(self.msg_process, self.batch_size, self.batch_timeout / 1000.0,
+                                   wait_stats=self.wait_stats, queue=self._shard_queue(threads),
+                                   done=self._task_done)
+                    for _ in range(threads)]
+        for handler in handlers:
+            handler.start()
+        self.threads = handlers
+
+    def _task_done(self, count):
+        # Main queue counts messages until they are processed, see MessageQueue.pending
+        for _ in range(count):
+            self.queue.task_done()
+
+    def _shard_drop(self, message):
+        source = getattr(message, 'source', None)
+        with self._drop_lock:
+            self.shard_dropped[source] = self.shard_dropped.get(source, 0) + 1
+        self._task_done(1)
+
+    def dropped(self):
+        """
+        :return: messages dropped by main and handler queues, per source
+        """
+        dropped = dict(self.queue.dropped) if isinstance(self.queue, MessageQueue) else {}
+        with self._drop_lock:
+            for source, count in self.shard_dropped.items():
+                dropped[source] = dropped.get(source, 0) + count
+        return dropped
+
+    def _stop_handlers(self):
+        # Old handlers have to finish their queues before new ones
+        #  start working, otherwise channel could get reordered
+        for handler in self.threads:
+            handler.stop()
+        for handler in self.threads:
+            handler.join()
+
+    def resize(self, threads):
+        """
+            Changes amount of message handlers without restart
+        :param threads: new amount of handler threads
+        """
+        threads = self._valid_threads(threads)
+        with self._shard_lock:
+            if threads == len(self.threads):
+                return
+            log.info("Resizing messaging pool from %s to %s threads", len(self.threads), threads)
+            self._stop_handlers()
+            self._start_handlers(threads)
+            self.threads_count = threads
+
+    def rest_get_threads(self, *args, **kwargs):
+        return json.dumps({'threads': self.threads_count})
+
+    def rest_set_threads(self, *args, **kwargs):
+        if 'threads' not in kwargs:
+            raise RestApiException('Missing threads parameter')
+        try:
+            self.resize(kwargs['threads'])
+        except ValueError as exc:
+            raise RestApiException(str(exc))
+        self.settings['config']['system']['threads'] = self.threads_count
+        save_settings(self.settings)
+        return self.rest_get_threads()
+
+    def rest_get_stats(self, *args, **kwargs):
+        handlers = self.threads
+        return json.dumps({
+            'modules': OrderedDict(
+                (m_module.__class__.__name__, stats.json()) for m_module, stats in self.module_stats.items()
+                if m_module in self.modules),
+            'queue': {
+                'size': self.queue.qsize(),
+                'main': self.queue.json() if isinstance(self.queue, MessageQueue) else {},
+                'handlers': [handler.queue.qsize() for handler in handlers],
+                'dropped': self.dropped(),
+                'oldest_age': max([handler.oldest_age() for handler in handlers] or [0.0]),
+                'wait': self.wait_stats.json()
+            }
+        })
+
+    def rest_reset_stats(self, *args, **kwargs):
+        for stats in self.module_stats.values():
+            stats.reset()
+        self.wait_stats.reset()
+        return self.rest_get_stats()
 
     def run(self):
-        for thread in range(THREADS):
-            self.threads.append(MessageHandler(self.queue, self.msg_process))
-            self.threads[thread].start()
+        with self._shard_lock:
+            if not self.threads:
+                self._start_handlers(self.threads_count)
+        while True:
+            message = self.queue.get()
+            with self._shard_lock:
+                if is_barrier(message) and len(self.threads) > 1:
+                    barrier = ShardBarrier(message, len(self.threads))
+                    for handler in self.threads:
+                        handler.put_barrier(barrier)
+                else:
+                    self.threads[hash(shard_key(message)) % len(self.threads)].put(message)
 
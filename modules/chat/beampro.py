@@ -5,7 +5,6 @@ import json
 import random
 import threading
 import os
-import requests
 import Queue
 import logging
 from collections import OrderedDict
@@ -13,6 +12,8 @@ from collections import OrderedDict
 import time
 
 from modules.helper.message import TextMessage, SystemMessage, RemoveMessageByUser, RemoveMessageByID
+from modules.helper.bulk import push_bulk
+from modules.helper.httpclient import http
 from modules.helper.module import ChatModule
 from ws4py.client.threadedclient import WebSocketClient
 
@@ -49,12 +50,16 @@ class BeamProAPIException(Exception):
 
 
 class BeamProTextMessage(TextMessage):
+    __slots__ = ()
+
     def __init__(self, user, text, mid):
         TextMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON,
                              user=user, text=text, mid=mid)
 
 
 class BeamProSystemMessage(SystemMessage):
+    __slots__ = ()
+
     def __init__(self, text, category='system'):
         SystemMessage.__init__(self, text, source=SOURCE, source_icon=SOURCE_ICON,
                                user=SYSTEM_USER, category=category)
@@ -114,7 +119,7 @@ class BeamProMessageHandler(threading.Thread):
 
     def _process_purge_event(self, message):
         user_id = message['data']['user_id']
-        nickname_req = requests.get(API_URL.format('/channels/{}'.format(user_id)))
+        nickname_req = http.get(API_URL.format('/channels/{}'.format(user_id)))
         if not nickname_req.ok:
             raise BeamProAPIException("Unable to get user nickname")
         nickname = nickname_req.json()
@@ -248,7 +253,7 @@ class BeamProInitThread(threading.Thread):
             time.sleep(5)
 
     def get_connection_info(self):
-        channel_id_req = requests.get(API_URL.format('/channels/{}'.format(self.channel)))
+        channel_id_req = http.get(API_URL.format('/channels/{}'.format(self.channel)))
         if not channel_id_req.ok:
             raise BeamProAPIException("Unable to get channel information")
         channel_data = channel_id_req.json()
@@ -256,7 +261,7 @@ class BeamProInitThread(threading.Thread):
         self.channel_id = channel_data['id']
         self.channel_nick = channel_data['token']
 
-        chat_info_req = requests.get(API_URL.format('/chats/{}'.format(self.channel_id)), headers={
+        chat_info_req = http.get(API_URL.format('/chats/{}'.format(self.channel_id)), headers={
             'X-CSRF-Token': csrf_token
         })
         if not chat_info_req.ok:
@@ -290,6 +295,7 @@ class TestBeamPro(threading.Thread):
         super(TestBeamPro, self).__init__()
         self.main_class = main_class  # type: beampro
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.beampro = None
 
     def run(self):
@@ -304,8 +310,14 @@ class TestBeamPro(threading.Thread):
         log.info("BeamPro Testing mode online")
 
     def send_message(self, *args, **kwargs):
-        nickname = kwargs.get('nickname', 'super_tester')
-        text = kwargs.get('text', 'Kappa 123')
+        self.push_message(kwargs)
+
+    def send_messages(self, *args, **kwargs):
+        return push_bulk(self.push_message, [self.main_class.queue], **kwargs)
+
+    def push_message(self, data):
+        nickname = data.get('nickname', 'super_tester')
+        text = data.get('text', 'Kappa 123')
 
         self.beampro.process_message(TestBeamProMessage(nickname, text).data)
 
@@ -332,7 +344,7 @@ class beampro(ChatModule):
 
     @staticmethod
     def get_viewers(channel_id):
-        viewers_req = requests.get(API_URL.format('/chats/{}/users'.format(channel_id)))
+        viewers_req = http.get(API_URL.format('/chats/{}/users'.format(channel_id)))
         if not viewers_req.ok:
             return NA_MESSAGE
         return viewers_req.headers['x-total-count']
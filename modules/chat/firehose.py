@@ -0,0 +1,257 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from modules.helper.message import TextMessage, SystemMessage, Emote, RemoveMessageByUser, RemoveMessageByID
+from modules.helper.module import ChatModule
+from modules.helper.system import EMOTE_FORMAT, RestApiException
+
+log = logging.getLogger('firehose')
+SOURCE = 'fh'
+SOURCE_ICON = '/img/sources/lalka_cup.png'
+FILE_ICON = os.path.join('img', 'lalka_cup.png')
+SYSTEM_USER = 'Firehose'
+ID_PREFIX = 'fh_{0}'
+# Shared between generator restarts, so message ids stay unique
+MESSAGE_COUNTER = itertools.count(1)
+
+# Generator wakes up at least this often, messages that are due are sent in bursts
+TICK = 0.005
+# Maximum burst per tick, generator falls behind instead of flooding when pipeline can't keep up
+MAX_BURST = 1000
+# Window of recently sent messages, used for moderation commands
+RECENT_SIZE = 200
+COMMANDS = ('remove_by_user', 'replace_by_user', 'remove_by_id', 'replace_by_id')
+REMOVE_TEXT = 'message removed'
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'stream', 'chat', 'gg', 'wp', 'nice', 'play',
+         'what', 'is', 'this', 'lol', 'no', 'way', 'hello', 'there', 'again', 'when', 'next', 'game')
+EMOTES = ('Kappa', 'PogChamp', 'LUL', 'FeelsGoodMan', 'FeelsBadMan', 'BibleThump', '4Head', 'Kreygasm')
+COLOURS = ('#FF0000', '#0000FF', '#008000', '#B22222', '#FF7F50', '#9ACD32', '#FF4500', '#2E8B57')
+
+CONF_DICT = OrderedDict()
+CONF_DICT['gui_information'] = {'category': 'chat'}
+CONF_DICT['config'] = OrderedDict()
+CONF_DICT['config']['running'] = True
+# Messages per second
+CONF_DICT['config']['rate'] = 100
+CONF_DICT['config']['channels'] = 3
+CONF_DICT['config']['users'] = 500
+# Chance of every word to be an emote, in percents
+CONF_DICT['config']['emote_density'] = 10
+# Part of moderation commands in generated traffic, in percents
+CONF_DICT['config']['command_percent'] = 1
+# Message length in words, length is exponentially distributed around the average
+CONF_DICT['config']['words_average'] = 8
+CONF_DICT['config']['words_max'] = 80
+
+CONF_GUI = {
+    'config': {
+        'hidden': ['channels_list', 'show_channel_names'],
+        'rate': {'view': 'spin', 'min': 1, 'max': 100000},
+        'channels': {'view': 'spin', 'min': 1, 'max': 1000},
+        'users': {'view': 'spin', 'min': 1, 'max': 1000000},
+        'emote_density': {'view': 'slider', 'min': 0, 'max': 100},
+        'command_percent': {'view': 'slider', 'min': 0, 'max': 100},
+        'words_average': {'view': 'spin', 'min': 1, 'max': 1000},
+        'words_max': {'view': 'spin', 'min': 1, 'max': 1000}
+    },
+    'icon': FILE_ICON}
+
+GENERATOR_KEYS = ('rate', 'channels', 'users', 'emote_density', 'command_percent', 'words_average', 'words_max')
+
+
+class FirehoseTextMessage(TextMessage):
+    __slots__ = ()
+
+    def __init__(self, user, text, mid, emotes, nick_colour):
+        TextMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON, user=user, text=text,
+                             mid=mid, emotes=emotes, nick_colour=nick_colour)
+
+
+class FirehoseSystemMessage(SystemMessage):
+    __slots__ = ()
+
+    def __init__(self, text, category='system'):
+        SystemMessage.__init__(self, text, source=SOURCE, source_icon=SOURCE_ICON,
+                               user=SYSTEM_USER, category=category)
+
+
+class FirehoseThread(threading.Thread):
+    def __init__(self, queue, settings):
+        """
+            Generates synthetic chat traffic into main queue with steady rate
+        :param queue: main queue
+        :param settings: generator settings, see GENERATOR_KEYS
+        """
+        super(FirehoseThread, self).__init__()
+        self.daemon = True
+        self.queue = queue
+        self.settings = {key: int(settings[key]) for key in GENERATOR_KEYS}
+        self.running = True
+        self.random = random.Random()
+        self.recent = deque(maxlen=RECENT_SIZE)
+
+        self._lock = threading.Lock()
+        self.started = None
+        self.stopped = None
+        self.sent = dict.fromkeys(('message',) + COMMANDS, 0)
+        self.behind = 0
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        rate = max(self.settings['rate'], 1)
+        self.started = time.time()
+        generated = 0
+        while self.running:
+            due = int((time.time() - self.started) * rate) - generated
+            burst = min(due, MAX_BURST)
+            for _ in range(burst):
+                self.queue.put(self.generate())
+            generated += burst
+            with self._lock:
+                self.behind = due - burst
+            time.sleep(TICK if burst else min(TICK, 1.0 / rate))
+        self.stopped = time.time()
+
+    def generate(self):
+        settings = self.settings
+        if self.recent and self.random.randint(1, 100) <= settings['command_percent']:
+            return self._command()
+
+        user_id = self.random.randint(1, settings['users'])
+        user = 'user_{0}'.format(user_id)
+        words, emotes = self._words()
+        message = FirehoseTextMessage(user, u' '.join(words), ID_PREFIX.format(next(MESSAGE_COUNTER)), emotes,
+                                      COLOURS[user_id % len(COLOURS)])
+        message.channel_name = 'channel_{0}'.format(self.random.randint(1, settings['channels']))
+        self.recent.append(message)
+        self._count('message')
+        return message
+
+    def _words(self):
+        settings = self.settings
+        length = int(self.random.expovariate(1.0 / settings['words_average'])) + 1
+        length = min(length, settings['words_max'])
+        words = []
+        emotes = {}
+        for _ in range(length):
+            if self.random.randint(1, 100) <= settings['emote_density']:
+                emote = self.random.choice(EMOTES)
+                emotes[emote] = Emote(emote, SOURCE_ICON)
+                words.append(EMOTE_FORMAT.format(emote))
+            else:
+                words.append(self.random.choice(WORDS))
+        return words, emotes.values()
+
+    def _command(self):
+        target = self.random.choice(self.recent)
+        command_type = self.random.choice(COMMANDS)
+        # Commands are created with text to remove messages and without it to replace them
+        text = REMOVE_TEXT if command_type.startswith('remove') else None
+        if command_type.endswith('by_user'):
+            command = RemoveMessageByUser(target.user, text=text)
+        else:
+            command = RemoveMessageByID(target.id, text=text)
+        # Command is ordered against the channel of message it acts on
+        command.source = target.source
+        command.channel_name = target.channel_name
+        self._count(command_type)
+        return command
+
+    def _count(self, message_type):
+        with self._lock:
+            self.sent[message_type] += 1
+
+    def stats(self):
+        with self._lock:
+            sent = dict(self.sent)
+            behind = self.behind
+        end = self.stopped or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        total = sum(sent.values())
+        return {
+            'running': self.running and self.is_alive(),
+            'settings': self.settings,
+            'elapsed': elapsed,
+            'sent': sent,
+            'total': total,
+            'requested_rate': self.settings['rate'],
+            'achieved_rate': total / elapsed if elapsed else 0.0,
+            'behind': behind
+        }
+
+
+class firehose(ChatModule):
+    def __init__(self, *args, **kwargs):
+        log.info("Initializing firehose chat")
+        ChatModule.__init__(self, *args, **kwargs)
+        self.generator = None
+        self.rest_add('GET', 'stats', self.rest_get_stats)
+        self.rest_add('POST', 'start', self.rest_start)
+        self.rest_add('POST', 'stop', self.rest_stop)
+
+    def _conf_settings(self, *args, **kwargs):
+        return CONF_DICT
+
+    def _gui_settings(self, *args, **kwargs):
+        return CONF_GUI
+
+    def load_module(self, *args, **kwargs):
+        ChatModule.load_module(self, *args, **kwargs)
+        if self._conf_params['config']['config']['running']:
+            self.start_generator()
+
+    def apply_settings(self, **kwargs):
+        ChatModule.apply_settings(self, **kwargs)
+        if 'system_exit' in kwargs:
+            self.stop_generator()
+            return
+        if self._conf_params['config']['config']['running']:
+            self.start_generator()
+        else:
+            self.stop_generator()
+
+    def start_generator(self):
+        self.stop_generator()
+        self.generator = FirehoseThread(self.queue, self._conf_params['config']['config'])
+        self.generator.start()
+        self.queue.put(FirehoseSystemMessage(
+            'Firehose started: {rate} msg/s, {channels} channels, {users} users'.format(
+                **self.generator.settings)))
+
+    def stop_generator(self):
+        if self.generator:
+            self.generator.stop()
+            self.generator.join()
+
+    def rest_get_stats(self, *args, **kwargs):
+        if not self.generator:
+            return json.dumps({'running': False})
+        return json.dumps(self.generator.stats())
+
+    def rest_start(self, *args, **kwargs):
+        config = self._conf_params['config']['config']
+        for key in GENERATOR_KEYS:
+            if key in kwargs:
+                try:
+                    value = int(kwargs[key])
+                except (TypeError, ValueError):
+                    raise RestApiException('{0} should be integer'.format(key))
+                if value < 0 or (value == 0 and key not in ('emote_density', 'command_percent')):
+                    raise RestApiException('{0} is out of range'.format(key))
+                config[key] = value
+        self.start_generator()
+        return json.dumps(self.generator.stats())
+
+    def rest_stop(self, *args, **kwargs):
+        self.stop_generator()
+        return self.rest_get_stats()
@@ -12,11 +12,12 @@ import threading
 import time
 from collections import OrderedDict
 
-import requests
 from ws4py.client.threadedclient import WebSocketClient
 
 from modules.gui import MODULE_KEY
 from modules.helper.message import TextMessage, SystemMessage, Emote, RemoveMessageByID
+from modules.helper.bulk import push_bulk
+from modules.helper.httpclient import http
 from modules.helper.module import ChatModule
 from modules.helper.system import translate_key, EMOTE_FORMAT, NA_MESSAGE
 
@@ -52,6 +53,8 @@ CONF_GUI = {
 
 
 class GoodgameTextMessage(TextMessage):
+    __slots__ = ()
+
     def __init__(self, text, user, mid=None):
         TextMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON,
                              user=user, text=text, mid=mid)
@@ -96,6 +99,8 @@ class GoodgameTextMessage(TextMessage):
 
 
 class GoodgameSystemMessage(SystemMessage):
+    __slots__ = ()
+
     def __init__(self, text, category='system'):
         SystemMessage.__init__(self, text, source=SOURCE, source_icon=SOURCE_ICON,
                                user=SYSTEM_USER, category=category)
@@ -297,10 +302,10 @@ class GGThread(threading.Thread):
     def load_config(self):
         try:
             self.kwargs['smiles'] = {}
-            smile_request = requests.get("http://api2.goodgame.ru/smiles")
+            smile_request = http.get("http://api2.goodgame.ru/smiles")
             next_page = smile_request.json()['_links']['first']['href']
             while True:
-                req_smile = requests.get(next_page)
+                req_smile = http.get(next_page)
                 if req_smile.status_code == 200:
                     req_smile_answer = req_smile.json()
 
@@ -316,13 +321,13 @@ class GGThread(threading.Thread):
 
         try:
             if self.ch_id:
-                request = requests.get("http://api2.goodgame.ru/streams/{0}".format(self.ch_id))
+                request = http.get("http://api2.goodgame.ru/streams/{0}".format(self.ch_id))
                 if request.status_code == 200:
                     channel_name = request.json()['channel']['key']
                     if self.nick != channel_name:
                         self.nick = channel_name
             else:
-                request = requests.get("http://api2.goodgame.ru/streams/{0}".format(self.nick))
+                request = http.get("http://api2.goodgame.ru/streams/{0}".format(self.nick))
                 if request.status_code == 200:
                     self.ch_id = request.json()['channel']['id']
         except Exception as exc:
@@ -376,6 +381,7 @@ class TestGG(threading.Thread):
         super(TestGG, self).__init__()
         self.main_class = main_class  # type: goodgame
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.gg_handler = None
 
     def run(self):
@@ -390,8 +396,14 @@ class TestGG(threading.Thread):
         log.info("GG Testing mode online")
 
     def send_message(self, *args, **kwargs):
-        nickname = kwargs.get('nickname', 'super_tester')
-        text = kwargs.get('text', 'Kappa 123')
+        self.push_message(kwargs)
+
+    def send_messages(self, *args, **kwargs):
+        return push_bulk(self.push_message, [self.main_class.queue], **kwargs)
+
+    def push_message(self, data):
+        nickname = data.get('nickname', 'super_tester')
+        text = data.get('text', 'Kappa 123')
 
         self.gg_handler.process_message(gg_message(nickname, text))
 
@@ -423,7 +435,7 @@ class goodgame(ChatModule):
             return NA_MESSAGE
         streams_url = 'http://api2.goodgame.ru/streams/{0}'.format(channel)
         try:
-            request = requests.get(streams_url)
+            request = http.get(streams_url)
             if request.status_code == 200:
                 json_data = request.json()
                 if json_data['status'] == 'Live':
@@ -9,10 +9,11 @@ import logging
 from collections import OrderedDict
 import time
 
-import requests
 from ws4py.client.threadedclient import WebSocketClient
 
 from modules.helper.message import TextMessage, Emote, SystemMessage, RemoveMessageByUser
+from modules.helper.bulk import push_bulk
+from modules.helper.httpclient import http
 from modules.helper.module import ChatModule
 from modules.helper.system import translate_key, EMOTE_FORMAT
 
@@ -51,12 +52,16 @@ class HitboxAPIError(Exception):
 
 
 class HitboxTextMessage(TextMessage):
+    __slots__ = ()
+
     def __init__(self, user, text, mid, nick_colour):
         TextMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON,
                              user=user, text=text, mid=mid, nick_colour=nick_colour)
 
 
 class HitboxSystemMessage(SystemMessage):
+    __slots__ = ()
+
     def __init__(self, text, category='system'):
         SystemMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON,
                                user=SYSTEM_USER, text=text, category=category)
@@ -270,7 +275,7 @@ class HitboxClient(WebSocketClient):
 
     @staticmethod
     def get_connection_url(url):
-        user_id_req = requests.get('https://{}/socket.io/1/'.format(url))
+        user_id_req = http.get('https://{}/socket.io/1/'.format(url))
         if not user_id_req.ok:
             raise HitboxAPIError("Unable to get userid")
         user_id = user_id_req.text.split(':')[0]
@@ -317,12 +322,12 @@ class HitboxInitThread(threading.Thread):
             time.sleep(5)
 
     def get_connection_info(self):
-        servers_req = requests.get(API_URL.format('/chat/servers'))
+        servers_req = http.get(API_URL.format('/chat/servers'))
         if not servers_req.ok:
             raise HitboxAPIError("Unable to get server list")
         self.endpoints = [item['server_ip'] for item in servers_req.json()]
 
-        smiles_req = requests.get(API_URL.format('/chat/icons/{}'.format(self.channel)))
+        smiles_req = http.get(API_URL.format('/chat/icons/{}'.format(self.channel)))
         if not smiles_req.ok:
             raise HitboxAPIError("Unable to get smiles")
         self.smiles = {}
@@ -330,7 +335,7 @@ class HitboxInitThread(threading.Thread):
             self.smiles[smile['icon_short']] = smile['icon_path']
             self.smiles[smile['icon_short_alt']] = smile['icon_path']
 
-        viewers_req = requests.get(API_URL.format('/player/server'))
+        viewers_req = http.get(API_URL.format('/player/server'))
         if not servers_req.ok:
             raise HitboxAPIError("Unable to get viewer server settings")
         viewers = viewers_req.json()
@@ -360,6 +365,7 @@ class TestHitbox(threading.Thread):
         super(TestHitbox, self).__init__()
         self.main_class = main_class  # type: hitbox
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.chat = None
 
     def run(self):
@@ -374,8 +380,14 @@ class TestHitbox(threading.Thread):
         log.info("Hitbox Testing mode online")
 
     def send_message(self, *args, **kwargs):
-        nickname = kwargs.get('nickname', 'super_tester')
-        text = kwargs.get('text', 'Kappa 123')
+        self.push_message(kwargs)
+
+    def send_messages(self, *args, **kwargs):
+        return push_bulk(self.push_message, [self.main_class.queue], **kwargs)
+
+    def push_message(self, data):
+        nickname = data.get('nickname', 'super_tester')
+        text = data.get('text', 'Kappa 123')
 
         self.chat.process_message(HitboxMessage(nickname, text).data)
 
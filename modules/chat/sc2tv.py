@@ -14,6 +14,8 @@ from ws4py.client.threadedclient import WebSocketClient
 
 from modules.gui import MODULE_KEY
 from modules.helper.message import TextMessage, SystemMessage, Emote
+from modules.helper.bulk import push_bulk
+from modules.helper.httpclient import http
 from modules.helper.module import ChatModule
 from modules.helper.system import translate_key, EMOTE_FORMAT
 
@@ -57,7 +59,7 @@ def get_channel_name(channel_name):
     payload = {
         'slug': channel_name
     }
-    channel_req = requests.post(API_URL.format('/stream'), timeout=5, data=payload)
+    channel_req = http.post(API_URL.format('/stream'), timeout=5, data=payload)
     if channel_req.ok:
         return channel_req.json()['owner']['name']
     raise Peka2TVAPIError("Unable to get channel name")
@@ -75,6 +77,8 @@ def allow_smile(smile, subscriptions, allow=False):
 
 
 class FsChatMessage(TextMessage):
+    __slots__ = ('_subscriptions',)
+
     def __init__(self, user, text, subscr):
         self._user = user
         self._text = text
@@ -101,6 +105,8 @@ class FsChatMessage(TextMessage):
 
 
 class FsSystemMessage(SystemMessage):
+    __slots__ = ()
+
     def __init__(self, text, emotes=None, category='system'):
         if emotes is None:
             emotes = []
@@ -182,7 +188,7 @@ class FsChat(WebSocketClient):
             'name': self.channel_name
         }
         try:
-            request = requests.post(API_URL.format("/user"), data=payload, timeout=5)
+            request = http.post(API_URL.format("/user"), data=payload, timeout=5)
             if request.status_code == 200:
                 channel_id = json.loads(re.findall('{.*}', request.text)[0])['id']
                 return channel_id
@@ -348,7 +354,7 @@ class FsThread(threading.Thread):
     def _get_info(self):
         if not self.smiles:
             try:
-                smiles = requests.post(API_URL.format('/smile'), timeout=5)
+                smiles = http.post(API_URL.format('/smile'), timeout=5)
                 if smiles.status_code == 200:
                     smiles_answer = smiles.json()
                     for smile in smiles_answer:
@@ -379,6 +385,7 @@ class TestSc2tv(threading.Thread):
         super(TestSc2tv, self).__init__()
         self.main_class = main_class  # type: sc2tv
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.fs_thread = None
 
     def run(self):
@@ -393,8 +400,14 @@ class TestSc2tv(threading.Thread):
         log.info("sc2tv Testing mode online")
 
     def send_message(self, *args, **kwargs):
-        nickname = kwargs.get('nickname', 'super_tester')
-        text = kwargs.get('text', 'Kappa 123')
+        self.push_message(kwargs)
+
+    def send_messages(self, *args, **kwargs):
+        return push_bulk(self.push_message, [self.main_class.queue], **kwargs)
+
+    def push_message(self, data):
+        nickname = data.get('nickname', 'super_tester')
+        text = data.get('text', 'Kappa 123')
 
         self.fs_thread.received_message(Sc2tvMessage(nickname, text))
 
@@ -421,14 +434,14 @@ class sc2tv(ChatModule):
         request = ['/chat/channel/list', {'channel': 'stream/{0}'.format(str(ws.channel_id))}]
 
         try:
-            user_request = requests.post(API_URL.format('/user'), timeout=5, data=user_data)
+            user_request = http.post(API_URL.format('/user'), timeout=5, data=user_data)
             if user_request.status_code == 200:
                 status_data['slug'] = user_request.json()['slug']
         except requests.ConnectionError:
             log.error("Unable to get smiles")
 
         try:
-            status_request = requests.post(API_URL.format('/stream'), timeout=5, data=status_data)
+            status_request = http.post(API_URL.format('/stream'), timeout=5, data=status_data)
             if status_request.status_code == 200:
                 if status_request.json()['online']:
                     self.set_online(ws.channel_name)
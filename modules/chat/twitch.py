@@ -9,10 +9,11 @@ import time
 from collections import OrderedDict
 
 import irc.client
-import requests
 
 from modules.gui import MODULE_KEY
 from modules.helper.message import TextMessage, SystemMessage, Badge, Emote, RemoveMessageByUser
+from modules.helper.bulk import push_bulk
+from modules.helper.httpclient import http
 from modules.helper.module import ChatModule
 from modules.helper.system import translate_key, EMOTE_FORMAT, NA_MESSAGE
 
@@ -64,6 +65,8 @@ class TwitchNormalDisconnect(Exception):
 
 
 class TwitchTextMessage(TextMessage):
+    __slots__ = ('bttv_emotes',)
+
     def __init__(self, user, text, me):
         self.bttv_emotes = {}
         TextMessage.__init__(self, source=SOURCE, source_icon=SOURCE_ICON,
@@ -71,12 +74,16 @@ class TwitchTextMessage(TextMessage):
 
 
 class TwitchSystemMessage(SystemMessage):
+    __slots__ = ()
+
     def __init__(self, text, category='system', emotes=None):
         SystemMessage.__init__(self, text, source=SOURCE, source_icon=SOURCE_ICON,
                                user=SYSTEM_USER, emotes=emotes, category=category)
 
 
 class TwitchEmote(Emote):
+    __slots__ = ('positions',)
+
     def __init__(self, emote_id, emote_url, positions):
         Emote.__init__(self, emote_id=emote_id, emote_url=emote_url)
         self.positions = positions
@@ -143,8 +150,7 @@ class TwitchMessageHandler(threading.Thread):
 
     @staticmethod
     def _handle_display_name(message, name):
-        message.display_name = name if name else message.user
-        message.jsonable += ['display_name']
+        message.set_extension('display_name', name if name else message.user)
 
     @staticmethod
     def _handle_emotes(message, tag_value):
@@ -232,20 +238,19 @@ class TwitchMessageHandler(threading.Thread):
         else:
             color = 'gray'
 
-        message.bits = {
+        message.set_extension('bits', {
             'bits': emote_smile,
             'amount': amount,
             'theme': BITS_THEME,
             'type': BITS_TYPE,
             'color': color,
             'size': 4
-        }
+        }, jsonable=False)
         message.text = message.text.replace(emote_smile, EMOTE_FORMAT.format(emote_smile))
 
     @staticmethod
     def _handle_sub_message(message):
-        message.sub_message = True
-        message.jsonable += ['sub_message']
+        message.set_extension('sub_message', True)
 
     def _send_message(self, message):
         self._post_process_emotes(message)
@@ -256,10 +261,10 @@ class TwitchMessageHandler(threading.Thread):
 
     @staticmethod
     def _post_process_bits(message):
-        if not hasattr(message, 'bits'):
+        bits = message.get_extension('bits')
+        if not bits:
             return
-        bits = message.bits
-        message['emotes'].append(Emote(
+        message.emotes.append(Emote(
             bits['bits'],
             BITS_URL.format(
                 theme=bits['theme'],
@@ -472,7 +477,7 @@ class TWThread(threading.Thread):
 
     def load_config(self):
         try:
-            request = requests.get("https://api.twitch.tv/kraken/channels/{0}".format(self.channel), headers=headers)
+            request = http.get("https://api.twitch.tv/kraken/channels/{0}".format(self.channel), headers=headers)
             if request.status_code == 200:
                 log.info("Channel found, continuing")
                 data = request.json()
@@ -490,7 +495,7 @@ class TWThread(threading.Thread):
 
         try:
             # Getting random IRC server to connect to
-            request = requests.get("http://tmi.twitch.tv/servers?channel={0}".format(self.channel))
+            request = http.get("http://tmi.twitch.tv/servers?channel={0}".format(self.channel))
             if request.status_code == 200:
                 self.host = random.choice(request.json()['servers']).split(':')[0]
             else:
@@ -502,7 +507,7 @@ class TWThread(threading.Thread):
         try:
             # Getting Better Twitch TV smiles
             if self.bttv_smiles:
-                request = requests.get("https://api.betterttv.net/emotes")
+                request = http.get("https://api.betterttv.net/emotes")
                 if request.status_code == 200:
                     for smile in request.json()['emotes']:
                         self.kwargs['bttv_smiles_dict'][smile.get('regex')] = smile
@@ -513,7 +518,7 @@ class TWThread(threading.Thread):
 
         try:
             # Getting standard twitch badges
-            request = requests.get("https://api.twitch.tv/kraken/chat/{0}/badges".format(self.channel), headers=headers)
+            request = http.get("https://api.twitch.tv/kraken/chat/{0}/badges".format(self.channel), headers=headers)
             if request.status_code == 200:
                 self.kwargs['badges'] = request.json()
             else:
@@ -524,7 +529,7 @@ class TWThread(threading.Thread):
         try:
             # Warning, undocumented, can change a LOT
             # Getting CUSTOM twitch badges
-            request = requests.get("https://badges.twitch.tv/v1/badges/global/display")
+            request = http.get("https://badges.twitch.tv/v1/badges/global/display")
             if request.status_code == 200:
                 self.kwargs['custom_badges'] = request.json()['badge_sets']
             else:
@@ -537,7 +542,7 @@ class TWThread(threading.Thread):
             # Warning, undocumented, can change a LOT
             # Getting CUSTOM twitch badges
             badges_url = "https://badges.twitch.tv/v1/badges/channels/{0}/display"
-            request = requests.get(badges_url.format(self.channel_id))
+            request = http.get(badges_url.format(self.channel_id))
             if request.status_code == 200:
                 self.kwargs['custom_badges'].update(request.json()['badge_sets'])
             else:
@@ -573,6 +578,7 @@ class TestTwitch(threading.Thread):
         super(TestTwitch, self).__init__()
         self.main_class = main_class  # type: twitch
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.tw_queue = None
 
     def run(self):
@@ -587,10 +593,16 @@ class TestTwitch(threading.Thread):
         log.info("twitch Testing mode online")
 
     def send_message(self, *args, **kwargs):
-        emotes = kwargs.get('emotes', False)
-        bits = kwargs.get('bits', False)
-        nickname = kwargs.get('nickname', 'super_tester')
-        text = kwargs.get('text', 'Kappa 123')
+        self.push_message(kwargs)
+
+    def send_messages(self, *args, **kwargs):
+        return push_bulk(self.push_message, [self.tw_queue, self.main_class.queue], **kwargs)
+
+    def push_message(self, data):
+        emotes = data.get('emotes', False)
+        bits = data.get('bits', False)
+        nickname = data.get('nickname', 'super_tester')
+        text = data.get('text', 'Kappa 123')
 
         self.tw_queue.put(TwitchMessage(nickname, text, emotes, bits))
 
@@ -623,7 +635,7 @@ class twitch(ChatModule):
     def get_viewers(channel):
         streams_url = 'https://api.twitch.tv/kraken/streams/{0}'.format(channel)
         try:
-            request = requests.get(streams_url, headers=headers)
+            request = http.get(streams_url, headers=headers)
             if request.status_code == 200:
                 json_data = request.json()
                 if json_data['stream']:
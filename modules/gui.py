@@ -888,16 +888,23 @@ class ChatGui(wx.Frame):
             self.Fit()
 
         self.Show(True)
+        self.update_shown = False
 
         # Show update dialog if new version found
         if self.main_config['update']:
-            dialog = wx.MessageDialog(self, message="There is new version, do you want to update?",
-                                      caption="New Update Available",
-                                      style=wx.YES_NO | wx.YES_DEFAULT,
-                                      pos=wx.DefaultPosition)
-            response = dialog.ShowModal()
-            if response == wx.ID_YES:
-                webbrowser.open(self.main_config['update_url'])
+            self.show_update()
+
+    def show_update(self):
+        if self.update_shown:
+            return
+        self.update_shown = True
+        dialog = wx.MessageDialog(self, message="There is new version, do you want to update?",
+                                  caption="New Update Available",
+                                  style=wx.YES_NO | wx.YES_DEFAULT,
+                                  pos=wx.DefaultPosition)
+        response = dialog.ShowModal()
+        if response == wx.ID_YES:
+            webbrowser.open(self.main_config['update_url'])
 
     def on_close(self, event):
         log.info("Exiting...")
@@ -968,6 +975,9 @@ class GuiThread(threading.Thread, BaseModule):
         self.daemon = True
         self.gui = None
         self.kwargs = kwargs
+        # Update check result that arrived before window was created
+        self.update_pending = False
+        self._update_lock = threading.Lock()
         if 'webchat' in self.kwargs.get('loaded_modules'):
             self.port = self.kwargs['loaded_modules']['webchat']['port']
 
@@ -977,13 +987,25 @@ class GuiThread(threading.Thread, BaseModule):
         url = ':'.join([self.url, str(self.port)])
         url += '/gui'
         app = wx.App(False)  # Create a new app, don't redirect stdout/stderr to a window.
-        self.gui = ChatGui(None, "LalkaChat", url, **self.kwargs)  # A Frame is a top-level window.
+        gui = ChatGui(None, "LalkaChat", url, **self.kwargs)  # A Frame is a top-level window.
+        with self._update_lock:
+            self.gui = gui
+            if self.update_pending:
+                wx.CallAfter(gui.show_update)
         app.MainLoop()
         self.quit()
 
     def apply_settings(self, **kwargs):
         pass
 
+    def show_update(self):
+        # Update check result arrives from other thread, window may not be created yet
+        with self._update_lock:
+            if self.gui:
+                wx.CallAfter(self.gui.show_update)
+            else:
+                self.update_pending = True
+
     def quit(self):
         try:
             self.gui.on_close('event')
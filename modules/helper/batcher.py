@@ -0,0 +1,73 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import logging
+import threading
+import time
+
+from modules.helper.stats import Histogram, timer
+
+log = logging.getLogger('batcher')
+
+BATCH_TICK = 25
+BATCH_TICK_MIN = 16
+BATCH_TICK_MAX = 50
+# Batch size buckets, 1 to 4096 items
+SIZE_BUCKETS = [2 ** index for index in range(13)]
+
+
+class TickBatcher(threading.Thread):
+    def __init__(self, flush, tick=BATCH_TICK, name='batcher'):
+        """
+            Collects items per key and flushes them together once per tick
+        :param flush: function(key, items) called from batcher thread
+        :param tick: tick length in milliseconds
+        """
+        super(TickBatcher, self).__init__(name=name)
+        self.daemon = True
+        self._flush = flush
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.tick = tick
+        self.running = True
+
+        self.sizes = Histogram(SIZE_BUCKETS)
+        # Time from first item in batch to flush
+        self.latency = Histogram()
+
+    @property
+    def tick(self):
+        return self._tick
+
+    @tick.setter
+    def tick(self, value):
+        self._tick = min(max(int(value), BATCH_TICK_MIN), BATCH_TICK_MAX)
+
+    def add(self, key, item):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = (timer(), [item])
+            else:
+                pending[1].append(item)
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            time.sleep(self._tick / 1000.0)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for key, (first, items) in pending.items():
+                try:
+                    self._flush(key, items)
+                except Exception as exc:
+                    log.exception("Unable to flush batch %s: %s", key, exc)
+                self.sizes.add(len(items))
+                self.latency.add(timer() - first)
+
+    def json(self):
+        return {
+            'tick': self._tick,
+            'size': self.sizes.json(),
+            'latency': self.latency.json()
+        }
@@ -0,0 +1,124 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import logging
+import time
+
+from modules.helper.stats import Histogram, timer
+from modules.helper.system import RestApiException
+
+log = logging.getLogger('bulk')
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+# Pusher wakes up at least this often, messages that are due are fed in bursts
+TICK = 0.005
+# Seconds to wait for pipeline to process messages after the last one is fed
+DRAIN_TIMEOUT_MAX = 60
+# Errors returned in stats, rest are only counted
+ERRORS_SHOWN = 10
+
+
+def parse_body(body, content_type):
+    """
+        Parses REST request body, NDJSON streams are parsed line by line
+    :return: dict of arguments, array or NDJSON stream is returned as {'messages': [...]}
+    """
+    data = body.read()
+    if not data:
+        return {}
+    if content_type.split(';')[0].strip().lower() in NDJSON_TYPES:
+        messages = []
+        for number, line in enumerate(data.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                raise RestApiException('Line {0} is not valid json'.format(number))
+        return {'messages': messages}
+    try:
+        data = json.loads(data)
+    except ValueError:
+        raise RestApiException('Body is not valid json')
+    if isinstance(data, list):
+        return {'messages': data}
+    if not isinstance(data, dict):
+        raise RestApiException('Body should be json object or array')
+    return data
+
+
+def get_number(kwargs, key, default=0):
+    try:
+        value = float(kwargs.get(key, default))
+    except (TypeError, ValueError):
+        raise RestApiException('{0} should be number'.format(key))
+    if value < 0:
+        raise RestApiException('{0} is out of range'.format(key))
+    return value
+
+
+def push_bulk(push, queues=(), **kwargs):
+    """
+        Feeds messages to chat parser with requested rate and measures it,
+          used by POST /rest/<chat>/push_messages of chat test classes
+    :param push: function(dict) that feeds one message to the parser, same arguments as push_message
+    :param queues: parser and main queues, used to wait until pipeline has processed all messages,
+                   queues with pending() (MessageQueue) count messages until messaging modules are done with them
+    :param kwargs: messages - list of dicts, rate - messages per second (0 - as fast as possible),
+                   drain - seconds to wait for messages to be processed (0 - don't wait)
+    :return: json string with timing stats
+    """
+    messages = kwargs.get('messages', [])
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        raise RestApiException('messages should be array of objects')
+    rate = get_number(kwargs, 'rate')
+    drain_timeout = min(get_number(kwargs, 'drain'), DRAIN_TIMEOUT_MAX)
+
+    feed = Histogram()
+    errors = []
+    failed = 0
+    behind = 0.0
+    started = time.time()
+    for index, message in enumerate(messages):
+        if rate:
+            delay = started + index / rate - time.time()
+            if delay > TICK:
+                time.sleep(delay)
+            elif delay < 0:
+                behind = max(behind, -delay)
+        feed_start = timer()
+        try:
+            push(message)
+        except Exception as exc:
+            failed += 1
+            if len(errors) < ERRORS_SHOWN:
+                errors.append('{0}: {1}'.format(index, exc))
+            log.debug("Unable to push message %s: %s", index, exc)
+        feed.add(timer() - feed_start)
+    fed = time.time()
+    elapsed = fed - started
+
+    def idle():
+        return not any(getattr(queue, 'pending', queue.qsize)() for queue in queues)
+
+    processed = None
+    if queues and drain_timeout:
+        while not idle() and time.time() - fed < drain_timeout:
+            time.sleep(TICK)
+        if idle():
+            processed = time.time() - started
+
+    pushed = len(messages) - failed
+    return json.dumps({
+        'total': len(messages),
+        'pushed': pushed,
+        'failed': failed,
+        'errors': errors,
+        'elapsed': elapsed,
+        'requested_rate': rate,
+        'achieved_rate': pushed / elapsed if elapsed else 0.0,
+        'behind': behind,
+        'feed': feed.json(),
+        'queue_size': sum(queue.qsize() for queue in queues),
+        'processed': processed,
+        'pipeline_rate': pushed / processed if processed else None
+    })
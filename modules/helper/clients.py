@@ -0,0 +1,51 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+
+DEFAULT_SUBSCRIPTION = 'frames'
+EMPTY = frozenset()
+
+
+class ClientRegistry(object):
+    def __init__(self):
+        """
+            Connected clients grouped by chat type and subscription,
+              sets are replaced on change, so readers don't need a lock
+        """
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._clients = {}
+
+    def add(self, client, chat_type, subscription=DEFAULT_SUBSCRIPTION):
+        key = (chat_type, subscription)
+        with self._lock:
+            self._remove(client)
+            self._clients[client] = key
+            self._groups[key] = self._groups.get(key, EMPTY) | {client}
+
+    def remove(self, client):
+        with self._lock:
+            return self._remove(client)
+
+    def _remove(self, client):
+        key = self._clients.pop(client, None)
+        if key is None:
+            return False
+        self._groups[key] = self._groups[key] - {client}
+        return True
+
+    def get(self, chat_type, subscription=DEFAULT_SUBSCRIPTION):
+        """
+        :return: frozenset of clients, safe to iterate while clients connect and disconnect
+        """
+        return self._groups.get((chat_type, subscription), EMPTY)
+
+    def subscription(self, client):
+        key = self._clients.get(client)
+        return key[1] if key else None
+
+    def all(self):
+        with self._lock:
+            return list(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
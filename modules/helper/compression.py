@@ -0,0 +1,100 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import zlib
+
+from ws4py.framing import Frame, OPCODE_TEXT
+
+PERMESSAGE_DEFLATE = 'permessage-deflate'
+# Every message is compressed on its own, so one compressed frame can be shared by all clients,
+#  server may send this parameter even if client didn't offer it
+DEFLATE_RESPONSE = 'permessage-deflate; server_no_context_takeover'
+DEFLATE_FLAGS = ('server_no_context_takeover', 'client_no_context_takeover')
+DEFLATE_WINDOW_BITS = ('server_max_window_bits', 'client_max_window_bits')
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+COMPRESSION_LEVEL = 1
+# Bytes, smaller payloads are sent uncompressed
+COMPRESSION_THRESHOLD = 256
+
+
+def _window_bits(value):
+    try:
+        bits = int(value.strip('"'))
+    except ValueError:
+        return None
+    return bits if 8 <= bits <= zlib.MAX_WBITS else None
+
+
+def _deflate_params(offer):
+    """
+        Parses and validates parameters of one permessage-deflate offer (RFC 7692 section 7)
+    :return: dict name -> value (None for parameters without value) or None if offer is invalid
+    """
+    params = {}
+    for param in offer[1:]:
+        name, _, value = [part.strip() for part in param.partition('=')]
+        if name in params:
+            return None
+        if name in DEFLATE_FLAGS:
+            if value:
+                return None
+        elif name == 'server_max_window_bits':
+            if _window_bits(value) is None:
+                return None
+        elif name == 'client_max_window_bits':
+            if value and _window_bits(value) is None:
+                return None
+        else:
+            return None
+        params[name] = value or None
+    return params
+
+
+def negotiate_deflate(header):
+    """
+        Picks first acceptable permessage-deflate offer of Sec-WebSocket-Extensions header,
+          frames are compressed with full window, so offers that limit server window are declined.
+          Client parameters are not answered, messages from clients are not decompressed
+    :return: value of response header or None if there is nothing to accept
+    """
+    for offer in (header or '').split(','):
+        offer = [param.strip() for param in offer.split(';')]
+        if offer[0] != PERMESSAGE_DEFLATE:
+            continue
+        params = _deflate_params(offer)
+        if params is None:
+            continue
+        window_bits = params.get('server_max_window_bits')
+        if window_bits is None:
+            return DEFLATE_RESPONSE
+        if _window_bits(window_bits) == zlib.MAX_WBITS:
+            return '{0}; server_max_window_bits={1}'.format(DEFLATE_RESPONSE, zlib.MAX_WBITS)
+    return None
+
+
+def accepts_gzip(elements):
+    """
+    :param elements: parsed Accept-Encoding header, list of (value, qvalue)
+    """
+    return any(value in ('gzip', '*') and qvalue > 0 for value, qvalue in elements)
+
+
+def to_bytes(payload):
+    return payload.encode('utf-8') if isinstance(payload, unicode) else payload
+
+
+def deflate_frame(payload, level=COMPRESSION_LEVEL):
+    """
+        Builds compressed unmasked text frame (RFC 7692),
+          compressor is not reused so frame doesn't depend on previous ones
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(to_bytes(payload)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    if body.endswith(DEFLATE_TAIL):
+        body = body[:-len(DEFLATE_TAIL)]
+    return Frame(opcode=OPCODE_TEXT, body=body, fin=1, rsv1=1).build()
+
+
+def gzip_body(payload, level=COMPRESSION_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(to_bytes(payload)) + compressor.flush()
@@ -0,0 +1,695 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import base64
+import errno
+import hashlib
+import logging
+import select
+import socket
+import struct
+import sys
+import threading
+import urllib
+from collections import deque
+from cStringIO import StringIO
+
+from ws4py.framing import Frame, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+
+from modules.helper.executor import Executor
+from modules.helper.sender import SEND_QUEUE_SIZE, POLICY_DROP_OLDEST, SEND_POLICIES
+from modules.helper.stats import Histogram, timer
+
+log = logging.getLogger('evented')
+
+WS_KEY = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_VERSION = '13'
+READ_SIZE = 65536
+MAX_HEADER_SIZE = 65536
+# Clients only send control frames, anything bigger is closed
+MAX_FRAME_SIZE = 65536
+HTTP_WORKERS = 4
+POLL_TIMEOUT = 1.0
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+CLOSE_NORMAL = 1000
+CLOSE_TOO_BIG = 1009
+
+
+def wake_pair():
+    """
+        Connected pair of sockets used to wake up poll loop,
+          socketpair is not available on windows
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    writer.connect(listener.getsockname())
+    reader, _ = listener.accept()
+    listener.close()
+    reader.setblocking(False)
+    writer.setblocking(False)
+    return reader, writer
+
+
+if hasattr(select, 'epoll'):
+    class Poller(object):
+        def __init__(self):
+            self._epoll = select.epoll()
+
+        @staticmethod
+        def _mask(write):
+            return select.EPOLLIN | (select.EPOLLOUT if write else 0)
+
+        def register(self, fd, write=False):
+            self._epoll.register(fd, self._mask(write))
+
+        def modify(self, fd, write):
+            self._epoll.modify(fd, self._mask(write))
+
+        def unregister(self, fd):
+            self._epoll.unregister(fd)
+
+        def poll(self, timeout):
+            """
+            :return: list of (fd, readable, writable), errors are reported as readable
+            """
+            try:
+                events = self._epoll.poll(timeout)
+            except IOError as exc:
+                if exc.errno == errno.EINTR:
+                    return []
+                raise
+            return [(fd, bool(event & ~select.EPOLLOUT), bool(event & select.EPOLLOUT))
+                    for fd, event in events]
+
+        def close(self):
+            self._epoll.close()
+else:
+    class Poller(object):
+        def __init__(self):
+            self._read = set()
+            self._write = set()
+
+        def register(self, fd, write=False):
+            self._read.add(fd)
+            self.modify(fd, write)
+
+        def modify(self, fd, write):
+            if write:
+                self._write.add(fd)
+            else:
+                self._write.discard(fd)
+
+        def unregister(self, fd):
+            self._read.discard(fd)
+            self._write.discard(fd)
+
+        def poll(self, timeout):
+            try:
+                readable, writable, failed = select.select(self._read, self._write, self._read, timeout)
+            except select.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    return []
+                raise
+            readable = set(readable) | set(failed)
+            writable = set(writable)
+            return [(fd, fd in readable, fd in writable) for fd in readable | writable]
+
+        def close(self):
+            pass
+
+
+def build_frame(opcode, payload=b''):
+    return Frame(opcode=opcode, body=payload, fin=1).build()
+
+
+def parse_frame(data):
+    """
+        Parses one client frame from the buffer
+    :return: (opcode, payload, consumed bytes) or None if frame is not complete yet
+    """
+    if len(data) < 2:
+        return None
+    first, second = ord(data[0]), ord(data[1])
+    length = second & 0x7f
+    offset = 2
+    if length == 126:
+        if len(data) < 4:
+            return None
+        length = struct.unpack('!H', data[2:4])[0]
+        offset = 4
+    elif length == 127:
+        if len(data) < 10:
+            return None
+        length = struct.unpack('!Q', data[2:10])[0]
+        offset = 10
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('Frame is too big')
+    key = None
+    if second & 0x80:
+        key = bytearray(data[offset:offset + 4])
+        offset += 4
+    if len(data) < offset + length:
+        return None
+    payload = bytearray(data[offset:offset + length])
+    if key:
+        for index in range(length):
+            payload[index] ^= key[index % 4]
+    return first & 0x0f, bytes(payload), offset + length
+
+
+def build_environ(head, server, peer_address):
+    """
+        Builds WSGI environ from request line and headers
+    """
+    lines = head.split(b'\r\n')
+    method, target, protocol = lines[0].split(b' ', 2)
+    path, _, query = target.partition(b'?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': urllib.unquote(path),
+        'QUERY_STRING': query,
+        'SERVER_PROTOCOL': protocol,
+        'SERVER_NAME': server.host,
+        'SERVER_PORT': str(server.port),
+        'REMOTE_ADDR': peer_address[0],
+        'REMOTE_PORT': str(peer_address[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().upper().replace('-', '_')
+        value = value.strip()
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        elif name:
+            key = 'HTTP_' + name
+            environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+    return environ
+
+
+class FrameQueue(object):
+    def __init__(self, wake, disconnect, max_size=SEND_QUEUE_SIZE, policy=POLICY_DROP_OLDEST):
+        """
+            Bounded outbound queue of evented client, same interface and policies as ClientSender,
+              frames are written by server loop instead of own thread
+        :param wake: function() that tells server loop there is something to write
+        :param disconnect: function() that drops the client
+        """
+        self._wake = wake
+        self._disconnect = disconnect
+        self._frames = deque()
+        self._lock = threading.Lock()
+        self.max_size = max(int(max_size), 1)
+        self.policy = policy if policy in SEND_POLICIES else POLICY_DROP_OLDEST
+        self.running = True
+
+        self.sent = 0
+        self.dropped = 0
+        self.lag = Histogram()
+
+    def configure(self, max_size=None, policy=None):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max(int(max_size), 1)
+            if policy in SEND_POLICIES:
+                self.policy = policy
+
+    def put(self, frame):
+        """
+        :return: False if client was disconnected as slow consumer
+        """
+        with self._lock:
+            if not self.running:
+                return False
+            full = len(self._frames) >= self.max_size
+            accepted = not full or self.policy == POLICY_DROP_OLDEST
+            if accepted:
+                if full:
+                    self._frames.popleft()
+                    self.dropped += 1
+                self._frames.append((timer(), frame))
+            else:
+                self.running = False
+                self._frames.clear()
+        if accepted:
+            self._wake()
+            return True
+        log.warning("Disconnecting slow client")
+        self._disconnect()
+        return False
+
+    def put_raw(self, data):
+        """
+            Queues data bypassing size limit, used for handshake and control frames
+        """
+        with self._lock:
+            self._frames.append((None, data))
+        self._wake()
+
+    def pop(self):
+        with self._lock:
+            return self._frames.popleft() if self._frames else None
+
+    def written(self, queued_at):
+        if queued_at is not None:
+            self.sent += 1
+            self.lag.add(timer() - queued_at)
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            self._frames.clear()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def json(self):
+        with self._lock:
+            queued = len(self._frames)
+            oldest = self._frames[0][0] if self._frames else None
+        return {
+            'policy': self.policy,
+            'max_size': self.max_size,
+            'queued': queued,
+            'oldest_age': timer() - oldest if oldest else 0.0,
+            'writing_for': 0.0,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'lag': self.lag.json()
+        }
+
+
+class Channel(object):
+    def __init__(self, server, sock, peer_address):
+        """
+            Non-blocking client socket, read and written only from server loop
+        """
+        self.server = server  # type: EventedServer
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.peer_address = peer_address
+        self.queue = FrameQueue(lambda: server.wake(self), self.drop)
+        self.closing = False
+        self.closed = False
+        self._chunk = None
+        self._queued_at = None
+        self._offset = 0
+        self._data = b''
+
+    def write_first(self, data):
+        self._chunk = data
+        self._queued_at = None
+        self._offset = 0
+        self.server.wake(self)
+
+    def wants_write(self):
+        return self._chunk is not None or len(self.queue) > 0
+
+    def recv(self):
+        try:
+            data = self.sock.recv(READ_SIZE)
+        except socket.error as exc:
+            if exc.args[0] in WOULD_BLOCK:
+                return None
+            data = b''
+        if not data:
+            self.close()
+            return None
+        self._data += data
+        return data
+
+    def handle_read(self):
+        self.recv()
+
+    def handle_write(self):
+        while True:
+            if self._chunk is None:
+                item = self.queue.pop()
+                if item is None:
+                    break
+                self._queued_at, self._chunk = item
+                self._offset = 0
+            try:
+                sent = self.sock.send(buffer(self._chunk, self._offset))
+            except socket.error as exc:
+                if exc.args[0] in WOULD_BLOCK:
+                    break
+                self.close()
+                return
+            self._offset += sent
+            if self._offset < len(self._chunk):
+                break
+            self._chunk = None
+            self.queue.written(self._queued_at)
+        if self.closing and not self.wants_write():
+            self.close()
+            return
+        self.server.update(self)
+
+    def drop(self):
+        """
+            Closes connection without flushing queued data, can be called from any thread
+        """
+        self.queue.stop()
+        self.server.call_soon(self.close)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.stop()
+        self.server.remove(self)
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+        try:
+            self.on_close()
+        except Exception as exc:
+            log.exception("Unable to close client: %s", exc)
+
+    def on_close(self):
+        pass
+
+
+class HttpChannel(Channel):
+    def __init__(self, server, sock, peer_address):
+        """
+            Reads HTTP requests one by one, websocket upgrades are handled by server loop,
+              other requests are passed to WSGI application in worker thread
+        """
+        Channel.__init__(self, server, sock, peer_address)
+        self.environ = None
+        self._length = 0
+        self._submitted = False
+
+    def handle_read(self):
+        if self.recv() and not self._submitted and not self.closing:
+            self.parse()
+
+    def parse(self):
+        if self.environ is None:
+            end = self._data.find(b'\r\n\r\n')
+            if end < 0:
+                if len(self._data) > MAX_HEADER_SIZE:
+                    self.respond('431 Request Header Fields Too Large')
+                return
+            try:
+                self.environ = build_environ(self._data[:end], self.server, self.peer_address)
+                self._length = int(self.environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                self.environ = None
+                self.respond('400 Bad Request')
+                return
+            self._data = self._data[end + 4:]
+            factory = self.server.ws_routes.get(self.environ['PATH_INFO'])
+            if factory and 'websocket' in self.environ.get('HTTP_UPGRADE', '').lower():
+                self.server.upgrade(self, factory)
+                return
+        if len(self._data) >= self._length:
+            self._submitted = True
+            self.environ['wsgi.input'] = StringIO(self._data[:self._length])
+            # Pipelined requests are kept until response is written
+            self._data = self._data[self._length:]
+            self.server.executor.submit(self.server.run_app, self, self.environ)
+
+    def keep_alive(self):
+        environ = self.environ
+        if environ is None:
+            return False
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+    def next_request(self):
+        """
+            Resets channel for next request on kept alive connection, called from server loop
+        """
+        if self.closed:
+            return
+        self.environ = None
+        self._length = 0
+        self._submitted = False
+        if self._data:
+            self.parse()
+
+    def respond(self, status, headers=(), body=b''):
+        """
+            Queues whole response, can be called from any thread,
+              connection is closed after it is written unless client keeps it alive
+        """
+        keep_alive = self.keep_alive()
+        head = ['HTTP/1.1 {}'.format(status)]
+        names = set()
+        for name, value in headers:
+            names.add(name.lower())
+            head.append('{}: {}'.format(name, value))
+        if 'content-length' not in names:
+            head.append('Content-Length: {}'.format(len(body)))
+        head.append('Connection: {}'.format('keep-alive' if keep_alive else 'close'))
+        self.queue.put_raw('\r\n'.join(head) + '\r\n\r\n' + body)
+        if keep_alive:
+            self.server.call_soon(self.next_request)
+        else:
+            self.closing = True
+        self.server.wake(self)
+
+
+class EventedWebSocket(Channel):
+    def __init__(self, server, sock, peer_address, environ):
+        """
+            Websocket client served by server loop,
+              frames are already built, so sending is only queueing bytes
+        """
+        Channel.__init__(self, server, sock, peer_address)
+        self.environ = environ
+
+    @property
+    def terminated(self):
+        return self.closed or self.closing
+
+    def handshake_headers(self):
+        """
+        :return: list of additional handshake response headers
+        """
+        return []
+
+    def opened(self):
+        pass
+
+    def received(self, opcode, payload):
+        pass
+
+    def send_frame(self, frame):
+        return self.queue.put(frame)
+
+    def close_with(self, code=CLOSE_NORMAL, reason=b''):
+        self.queue.put_raw(build_frame(OPCODE_CLOSE, struct.pack('!H', code) + reason))
+        self.closing = True
+        self.server.wake(self)
+
+    def handle_read(self):
+        if not self.recv():
+            return
+        while not self.closing:
+            try:
+                frame = parse_frame(self._data)
+            except ValueError:
+                self.close_with(CLOSE_TOO_BIG)
+                return
+            if frame is None:
+                return
+            opcode, payload, consumed = frame
+            self._data = self._data[consumed:]
+            if opcode == OPCODE_CLOSE:
+                code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                self.close_with(code)
+            elif opcode == OPCODE_PING:
+                self.queue.put_raw(build_frame(OPCODE_PONG, payload))
+            elif opcode != OPCODE_PONG:
+                self.received(opcode, payload)
+
+
+class EventedServer(object):
+    def __init__(self, host, port, app, ws_routes, workers=HTTP_WORKERS):
+        """
+            Serves all sockets from one poll loop instead of thread per connection,
+              HTTP requests that are not websocket upgrades go to WSGI application in small thread pool
+        :param app: WSGI application
+        :param ws_routes: path -> function(server, sock, peer_address, environ) returning EventedWebSocket
+        """
+        self.host = host
+        self.port = int(port)
+        self.app = app
+        self.ws_routes = ws_routes
+        self.executor = Executor(workers, 'evented-http')
+        self.poller = Poller()
+        self.channels = {}
+        self.running = False
+
+        self._writing = set()
+        self._lock = threading.Lock()
+        self._woken = False
+        self._dirty = set()
+        self._callbacks = deque()
+        self._wake_reader, self._wake_writer = wake_pair()
+        self._listener = None
+
+    def wake(self, channel=None):
+        """
+            Wakes up server loop, can be called from any thread
+        :param channel: channel that has something to write
+        """
+        with self._lock:
+            if channel is not None:
+                self._dirty.add(channel)
+            if self._woken:
+                return
+            self._woken = True
+        try:
+            self._wake_writer.send(b'x')
+        except socket.error:
+            pass
+
+    def call_soon(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        self.wake()
+
+    def update(self, channel):
+        write = channel.wants_write()
+        if write != (channel.fd in self._writing):
+            if write:
+                self._writing.add(channel.fd)
+            else:
+                self._writing.discard(channel.fd)
+            self.poller.modify(channel.fd, write)
+
+    def remove(self, channel):
+        if self.channels.get(channel.fd) is channel:
+            del self.channels[channel.fd]
+            self._writing.discard(channel.fd)
+            self.poller.unregister(channel.fd)
+
+    def serve_forever(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        # Port 0 binds to any free port
+        self.port = self._listener.getsockname()[1]
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        listener_fd = self._listener.fileno()
+        wake_fd = self._wake_reader.fileno()
+        self.poller.register(listener_fd)
+        self.poller.register(wake_fd)
+        self.running = True
+
+        while self.running:
+            for fd, readable, writable in self.poller.poll(POLL_TIMEOUT):
+                if fd == listener_fd:
+                    self._accept()
+                elif fd == wake_fd:
+                    self._drain_wake()
+                else:
+                    channel = self.channels.get(fd)
+                    if channel and readable:
+                        channel.handle_read()
+                    if channel and writable and not channel.closed:
+                        channel.handle_write()
+            self._process_wakeups()
+        self._shutdown()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, peer_address = self._listener.accept()
+            except socket.error as exc:
+                if exc.args[0] not in WOULD_BLOCK:
+                    log.warning("Unable to accept connection: %s", exc)
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            channel = HttpChannel(self, sock, peer_address)
+            self.channels[channel.fd] = channel
+            self.poller.register(channel.fd)
+
+    def _drain_wake(self):
+        try:
+            while self._wake_reader.recv(READ_SIZE):
+                pass
+        except socket.error:
+            pass
+
+    def _process_wakeups(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            callbacks, self._callbacks = self._callbacks, deque()
+            self._woken = False
+        for callback in callbacks:
+            callback()
+        for channel in dirty:
+            if not channel.closed:
+                channel.handle_write()
+
+    def _shutdown(self):
+        for channel in self.channels.values():
+            channel.close()
+        self.poller.close()
+        self._listener.close()
+        self.executor.stop()
+
+    def upgrade(self, http_channel, factory):
+        environ = http_channel.environ
+        key = environ.get('HTTP_SEC_WEBSOCKET_KEY', '')
+        if environ.get('HTTP_SEC_WEBSOCKET_VERSION') != WS_VERSION or not key:
+            http_channel.respond('400 Bad Request', [('Sec-WebSocket-Version', WS_VERSION)])
+            return
+        websocket = factory(self, http_channel.sock, http_channel.peer_address, environ)
+        websocket._data = http_channel._data
+        self.channels[websocket.fd] = websocket
+
+        headers = [('Upgrade', 'websocket'),
+                   ('Connection', 'Upgrade'),
+                   ('Sec-WebSocket-Accept', base64.b64encode(hashlib.sha1(key + WS_KEY).digest()))]
+        headers.extend(websocket.handshake_headers())
+        # Handshake is written before anything queued, so it can't be dropped as oldest frame
+        websocket.write_first('HTTP/1.1 101 Switching Protocols\r\n{}\r\n\r\n'.format(
+            '\r\n'.join('{}: {}'.format(name, value) for name, value in headers)))
+        websocket.opened()
+
+    def run_app(self, channel, environ):
+        chunks = []
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                for chunk in result:
+                    chunks.append(chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as exc:
+            log.exception("Unable to process %s: %s", environ.get('PATH_INFO'), exc)
+            response = {'status': '500 Internal Server Error', 'headers': [('Content-Type', 'text/plain')]}
+            chunks = [b'Internal Server Error']
+        headers = [(name, value) for name, value in response['headers'] if name.lower() != 'connection']
+        body = b''.join(chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk for chunk in chunks)
+        channel.respond(response['status'], headers, body)
@@ -0,0 +1,80 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import heapq
+import itertools
+import logging
+import Queue
+import threading
+import time
+
+log = logging.getLogger('executor')
+STOP_WORKER = object()
+
+
+class Executor(object):
+    def __init__(self, workers=2, name='executor'):
+        """
+            Small shared thread pool with delayed tasks,
+              used instead of starting thread (or Timer) for every short task
+        :param workers: amount of worker threads
+        :param name: thread name prefix
+        """
+        self.name = name
+        self._tasks = Queue.Queue()
+        self._delayed = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self.running = True
+
+        self._threads = []
+        for index in range(max(int(workers), 1)):
+            self._start_thread(self._work, '{}-{}'.format(name, index))
+        self._start_thread(self._schedule, '{}-scheduler'.format(name))
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, function, *args, **kwargs):
+        self._tasks.put((function, args, kwargs))
+
+    def schedule(self, delay, function, *args, **kwargs):
+        """
+            Runs function in worker thread after delay seconds
+        """
+        with self._condition:
+            heapq.heappush(self._delayed, (time.time() + delay, next(self._counter), (function, args, kwargs)))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        for _ in self._threads:
+            self._tasks.put(STOP_WORKER)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is STOP_WORKER:
+                break
+            function, args, kwargs = task
+            try:
+                function(*args, **kwargs)
+            except Exception as exc:
+                log.exception("Task failed in %s: %s", self.name, exc)
+
+    def _schedule(self):
+        with self._condition:
+            while self.running:
+                if not self._delayed:
+                    self._condition.wait()
+                    continue
+                due, _, task = self._delayed[0]
+                wait = due - time.time()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                heapq.heappop(self._delayed)
+                self._tasks.put(task)
@@ -0,0 +1,161 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+import time
+from collections import deque
+
+HISTORY_SIZE = 40
+INFINITY = float('inf')
+
+
+class MessageHistory(object):
+    def __init__(self, size=HISTORY_SIZE, max_age=0):
+        """
+            Ring buffer of last chat messages, ordered by arrival,
+              creation time can be out of order (relays, restored or delayed messages)
+        :param size: maximum amount of messages
+        :param max_age: messages older than max_age seconds are evicted on insert, 0 to disable
+        """
+        self._lock = threading.Lock()
+        self._messages = deque(maxlen=max(int(size), 1))
+        self.max_age = max(int(max_age), 0)
+        # Creation time of oldest message, lower bound, so eviction scans history only when something expired
+        self._oldest = INFINITY
+        # Changed on every modification, used as cache key for encoded history
+        self.version = 0
+        # Persistent copy of history (HistoryStore), changes are passed to it
+        self.store = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def size(self):
+        return self._messages.maxlen
+
+    def resize(self, size, max_age=None):
+        with self._lock:
+            size = max(int(size), 1)
+            if size != self._messages.maxlen:
+                self._messages = deque(self._messages, maxlen=size)
+            if max_age is not None:
+                self.max_age = max(int(max_age), 0)
+            self._evict(time.time())
+            self.version += 1
+        if self.store:
+            self.store.configure(self.size, self.max_age)
+
+    def _evict(self, now):
+        if self.max_age and self._oldest < now - self.max_age:
+            cutoff = now - self.max_age
+            messages = [message for message in self._messages if message.created >= cutoff]
+            self._messages = deque(messages, maxlen=self._messages.maxlen)
+            self._oldest = min(message.created for message in messages) if messages else INFINITY
+
+    def _extend(self, messages):
+        for message in messages:
+            self._messages.append(message)
+            self._oldest = min(self._oldest, message.created)
+
+    def add(self, message):
+        with self._lock:
+            self._extend([message])
+            self._evict(time.time())
+            self.version += 1
+        if self.store:
+            self.store.add(message)
+
+    def restore(self, messages):
+        """
+            Adds messages loaded from the store, they are not written back
+        """
+        with self._lock:
+            self._extend(messages)
+            self._evict(time.time())
+            self.version += 1
+
+    def replace(self, messages):
+        """
+            Replaces whole history, store gets the same messages
+        """
+        with self._lock:
+            self._messages.clear()
+            self._oldest = INFINITY
+            self._extend(messages)
+            self._evict(time.time())
+            self.version += 1
+            messages = list(self._messages)
+        if self.store:
+            self.store.clear()
+            for message in messages:
+                self.store.add(message)
+
+    def touch(self, messages=()):
+        """
+            Marks history as changed after messages were modified in place
+        """
+        with self._lock:
+            self.version += 1
+        if self.store:
+            self.store.update(messages)
+
+    def snapshot(self, max_age=0):
+        """
+        :param max_age: only messages younger than max_age seconds, 0 for all
+        :return: list of messages, oldest first
+        """
+        with self._lock:
+            messages = list(self._messages)
+        if max_age > 0:
+            cutoff = time.time() - max_age
+            return [message for message in messages if message.created >= cutoff]
+        return messages
+
+    def after(self, message_id=None, limit=0):
+        """
+            Cursor for polling clients
+        :param message_id: only messages newer than this one, None returns whole history
+        :param limit: maximum amount of messages, oldest after cursor are returned,
+                      without cursor newest are returned
+        :return: list of messages, oldest first,
+                 None if message_id is unknown (already evicted or removed),
+                 client can't tell what it missed then and should reload history without cursor
+        """
+        messages = self.snapshot()
+        if message_id is None:
+            return messages[-limit:] if limit else messages
+        for index in range(len(messages) - 1, -1, -1):
+            if str(messages[index].id) == message_id:
+                messages = messages[index + 1:]
+                return messages[:limit] if limit else messages
+        return None
+
+    def remove(self, predicate):
+        """
+        :return: list of removed messages
+        """
+        removed = []
+        kept = deque(maxlen=self._messages.maxlen)
+        with self._lock:
+            for message in self._messages:
+                if predicate(message):
+                    removed.append(message)
+                else:
+                    kept.append(message)
+            if removed:
+                self._messages = kept
+                self.version += 1
+        if removed and self.store:
+            self.store.remove(removed)
+        return removed
+
+    def find(self, predicate):
+        with self._lock:
+            return [message for message in self._messages if predicate(message)]
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._oldest = INFINITY
+            self.version += 1
+        if self.store:
+            self.store.clear()
@@ -0,0 +1,139 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import cookielib
+import json
+import logging
+import threading
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules.helper.stats import Histogram, TimingStat, timer
+
+log = logging.getLogger('httpclient')
+
+# (connect, read) seconds, used when call doesn't set its own timeout
+DEFAULT_TIMEOUT = (5, 15)
+# Requests in flight to one host, also size of its connection pool
+HOST_CONCURRENCY = 4
+
+
+class HostPool(object):
+    def __init__(self, host, concurrency=HOST_CONCURRENCY):
+        """
+            Keep-alive session for one host, requests over the limit wait for a free connection
+        :param host: netloc of the url, e.g. api.twitch.tv
+        """
+        self.host = host
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Calls were sessionless before, so cookies are still not kept between them
+        self.session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        self.limit = threading.BoundedSemaphore(concurrency)
+
+        self._lock = threading.Lock()
+        self.requests = TimingStat()
+        self.wait = Histogram()
+        self.statuses = {}
+        self.errors = 0
+        self.active = 0
+
+    def request(self, method, url, **kwargs):
+        wait_start = timer()
+        with self.limit:
+            start = timer()
+            self.wait.add(start - wait_start)
+            with self._lock:
+                self.active += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                self.requests.add(timer() - start)
+                with self._lock:
+                    self.active -= 1
+        status = '{0}xx'.format(response.status_code // 100)
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return response
+
+    def reset(self):
+        self.requests.reset()
+        self.wait.reset()
+        with self._lock:
+            self.statuses = {}
+            self.errors = 0
+
+    def json(self):
+        with self._lock:
+            data = {'active': self.active, 'concurrency': self.concurrency,
+                    'errors': self.errors, 'statuses': dict(self.statuses)}
+        data['requests'] = self.requests.json()
+        data['wait'] = self.wait.json()
+        return data
+
+
+class HttpClient(object):
+    def __init__(self, timeout=DEFAULT_TIMEOUT, concurrency=HOST_CONCURRENCY):
+        """
+            Shared HTTP client for chat modules, same interface as requests.get/post,
+              connections are pooled and kept alive per host
+        :param timeout: default timeout, see requests timeout argument
+        :param concurrency: default limit of requests in flight per host
+        """
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._limits = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def set_limit(self, host, concurrency):
+        """
+            Overrides concurrency of one host, applied when host is requested first time
+        """
+        with self._lock:
+            self._limits[host] = max(int(concurrency), 1)
+
+    def pool(self, url):
+        host = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._pools:
+                self._pools[host] = HostPool(host, self._limits.get(host, self.concurrency))
+            return self._pools[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.pool(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def reset(self):
+        with self._lock:
+            pools = self._pools.values()
+        for pool in pools:
+            pool.reset()
+
+    def json(self):
+        with self._lock:
+            pools = dict(self._pools)
+        return {host: pool.json() for host, pool in sorted(pools.items())}
+
+    def rest_get_stats(self, *args, **kwargs):
+        return json.dumps(self.json())
+
+    def rest_reset_stats(self, *args, **kwargs):
+        self.reset()
+        return self.rest_get_stats()
+
+
+http = HttpClient()
@@ -1,11 +1,17 @@
 import uuid
+import json
 import logging
 import datetime
+import operator
+import time
 from modules.helper.system import SOURCE, SOURCE_ICON, SOURCE_USER
 
 log = logging.getLogger('helper.message')
 
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 AVAILABLE_COMMANDS = ['remove_by_user', 'remove_by_id', 'replace_by_user', 'replace_by_id', 'reload']
+# Compiled field serializers, one per message class
+_SERIALIZERS = {}
 
 
 def _validate_command(command):
@@ -41,32 +47,144 @@ class NonExistentCommand(Exception):
     pass
 
 
+def _compile_serializer(fields):
+    """
+        Builds function that reads all fields in one C-level call
+    :param fields: tuple of attribute names
+    :return: function(message) -> dict
+    """
+    if not fields:
+        return lambda message: {}
+    getter = operator.attrgetter(*fields)
+    if len(fields) == 1:
+        field = fields[0]
+        return lambda message: {field: getter(message)}
+    return lambda message: dict(zip(fields, getter(message)))
+
+
+def get_serializer(message_class):
+    serializer = _SERIALIZERS.get(message_class)
+    if serializer is None:
+        serializer = _SERIALIZERS[message_class] = _compile_serializer(message_class._fields)
+    return serializer
+
+
 class Message(object):
+    # Class level field schema, attributes that are sent to the clients
+    _fields = ()
+    __slots__ = ('_created', '_timestamp', '_extensions', '_json_extensions', '_json', '_frames')
+
     def __init__(self):
         """
             Basic Message class
         """
-        self._jsonable = []
-        self._timestamp = datetime.datetime.now().isoformat()
+        self._created = time.time()
+        self._timestamp = None
+        self._extensions = None
+        self._json_extensions = None
+        self._json = None
+        self._frames = None
+
+    def __getattr__(self, name):
+        # Only called when attribute is not found,
+        #  so dynamic attributes are read from extensions
+        if not name.startswith('_') and self._extensions and name in self._extensions:
+            return self._extensions[name]
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
 
     def json(self):
-        return {attr: getattr(self, attr) for attr in self._jsonable}
+        """
+            Payload is built once and cached until message is changed,
+              it is shared between callers so it should not be modified
+        :return: dict
+        """
+        data = self._json
+        if data is None:
+            data = get_serializer(type(self))(self)
+            if self._json_extensions:
+                for name in self._json_extensions:
+                    data[name] = self._extensions[name]
+            self._json = data
+        return data
+
+    def frame(self, key, encode):
+        """
+            Caches encoded representation of the message,
+              e.g. websocket frame for every chat style
+        :param key: cache key, should change when encode result would change
+        :param encode: function(message) -> encoded payload
+        """
+        # Local reference, invalidate() may reset cache from another thread
+        frames = self._frames
+        if frames is None:
+            frames = self._frames = {}
+        frame = frames.get(key)
+        if frame is None:
+            frame = frames[key] = encode(self)
+        return frame
+
+    def invalidate(self):
+        """
+            Drops cached payloads, called from every setter
+        """
+        self._json = None
+        self._frames = None
+
+    def set_extension(self, name, value, jsonable=True):
+        """
+            Sets dynamic attribute of the message (levels, mention, hidden etc.)
+        :param name: attribute name
+        :param value: attribute value
+        :param jsonable: if attribute should be sent to the clients
+        """
+        if self._extensions is None:
+            self._extensions = {}
+        self._extensions[name] = value
+        self.invalidate()
+        if jsonable:
+            if self._json_extensions is None:
+                self._json_extensions = []
+            if name not in self._json_extensions:
+                self._json_extensions.append(name)
+
+    def get_extension(self, name, default=None):
+        if self._extensions is None:
+            return default
+        return self._extensions.get(name, default)
+
+    def iter_extensions(self):
+        """
+        :return: (name, value, jsonable) for every dynamic attribute
+        """
+        if not self._extensions:
+            return
+        for name, value in self._extensions.items():
+            yield name, value, name in self._json_extensions if self._json_extensions else False
+
+    @property
+    def created(self):
+        """
+        :return: Creation time as unix timestamp
+        """
+        return self._created
 
     @property
     def timestamp(self):
+        if self._timestamp is None:
+            self._timestamp = datetime.datetime.fromtimestamp(self._created).strftime(TIMESTAMP_FORMAT)
         return self._timestamp
 
     @property
     def jsonable(self):
-        return self._jsonable
-
-    @jsonable.setter
-    def jsonable(self, value):
-        if isinstance(value, list):
-            self._jsonable = value
+        if self._json_extensions:
+            return list(self._fields) + self._json_extensions
+        return list(self._fields)
 
 
 class CommandMessage(Message):
+    _fields = ('command',)
+    __slots__ = ('_command', 'source', 'channel_name')
+
     def __init__(self, command=''):
         """
             Command Message class
@@ -75,7 +193,10 @@ class CommandMessage(Message):
         """
         Message.__init__(self)
         self._command = _validate_command(command)
-        self._jsonable += ['command']
+        # Chat and channel command acts on, same as in its text messages,
+        #  commands without source are ordered against all channels
+        self.source = None
+        self.channel_name = None
 
     @property
     def command(self):
@@ -83,6 +204,9 @@ class CommandMessage(Message):
 
 
 class RemoveMessageByUser(CommandMessage):
+    _fields = CommandMessage._fields + ('user',)
+    __slots__ = ('_user', 'text')
+
     def __init__(self, user, text=None):
         if text:
             CommandMessage.__init__(self, command='remove_by_user')
@@ -90,7 +214,6 @@ class RemoveMessageByUser(CommandMessage):
         else:
             CommandMessage.__init__(self, command='replace_by_user')
         self._user = user if isinstance(user, list) else [user]
-        self._jsonable += ['user']
 
     @property
     def user(self):
@@ -98,14 +221,16 @@ class RemoveMessageByUser(CommandMessage):
 
 
 class RemoveMessageByID(CommandMessage):
+    _fields = CommandMessage._fields + ('message_ids',)
+    __slots__ = ('_message_ids', 'text')
+
     def __init__(self, message_id, text=None):
         if text:
-            CommandMessage.__init__(self, command='remove_by_user')
+            CommandMessage.__init__(self, command='remove_by_id')
             self.text = text
         else:
-            CommandMessage.__init__(self, command='replace_by_user')
+            CommandMessage.__init__(self, command='replace_by_id')
         self._message_ids = message_id if isinstance(message_id, list) else [message_id]
-        self._jsonable += ['message_ids']
 
     @property
     def message_ids(self):
@@ -113,6 +238,12 @@ class RemoveMessageByID(CommandMessage):
 
 
 class TextMessage(Message):
+    _fields = ('user', 'text', 'emotes', 'badges',
+               'id', 'source', 'source_icon', 'pm',
+               'nick_colour', 'channel_name', 'me')
+    __slots__ = ('_source', '_source_icon', '_user', '_text', '_emotes', '_badges',
+                 '_pm', '_me', '_nick_colour', '_channel_name', '_id')
+
     def __init__(self, source, source_icon, user, text,
                  emotes=None, badges=None, pm=False,
                  nick_colour=None, mid=None, me=False):
@@ -120,7 +251,7 @@ class TextMessage(Message):
             Text message used by main chat logic
         :param badges: Badges to display
         :param nick_colour: Nick colour
-        :param mid: Message ID
+        :param mid: Message ID, generated on first access if not provided
         :param me: /me notation
         :param source: Chat source (gg/twitch/beampro etc.)
         :param source_icon: Chat icon (as url)
@@ -141,11 +272,7 @@ class TextMessage(Message):
         self._me = me
         self._nick_colour = nick_colour
         self._channel_name = None
-        self._id = str(mid) if mid else str(uuid.uuid1())
-
-        self._jsonable += ['user', 'text', 'emotes', 'badges',
-                           'id', 'source', 'source_icon', 'pm',
-                           'nick_colour', 'channel_name', 'me']
+        self._id = str(mid) if mid else None
 
     @property
     def source(self):
@@ -169,6 +296,7 @@ class TextMessage(Message):
     @text.setter
     def text(self, value):
         self._text = value
+        self.invalidate()
 
     @property
     def emotes(self):
@@ -177,6 +305,7 @@ class TextMessage(Message):
     @emotes.setter
     def emotes(self, value):
         self._emotes = value
+        self.invalidate()
 
     @property
     def badges(self):
@@ -185,6 +314,7 @@ class TextMessage(Message):
     @badges.setter
     def badges(self, value):
         self._badges = value
+        self.invalidate()
 
     @property
     def pm(self):
@@ -193,6 +323,7 @@ class TextMessage(Message):
     @pm.setter
     def pm(self, value):
         self._pm = value
+        self.invalidate()
 
     @property
     def nick_colour(self):
@@ -201,6 +332,7 @@ class TextMessage(Message):
     @nick_colour.setter
     def nick_colour(self, value):
         self._nick_colour = value
+        self.invalidate()
 
     @property
     def channel_name(self):
@@ -209,9 +341,12 @@ class TextMessage(Message):
     @channel_name.setter
     def channel_name(self, value):
         self._channel_name = value
+        self.invalidate()
 
     @property
     def id(self):
+        if self._id is None:
+            self._id = str(uuid.uuid1())
         return self._id
 
     @property
@@ -221,9 +356,12 @@ class TextMessage(Message):
     @me.setter
     def me(self, value):
         self._me = value
+        self.invalidate()
 
 
 class SystemMessage(TextMessage):
+    __slots__ = ('_category',)
+
     def __init__(self, text, source=SOURCE, source_icon=SOURCE_ICON, user=SOURCE_USER, emotes=None, category='system'):
         """
             Text message used by main chat logic
@@ -248,7 +386,57 @@ class SystemMessage(TextMessage):
         return self._user
 
 
+class RelayedMessage(Message):
+    __slots__ = ('_payload', '_data')
+
+    def __init__(self, payload, data=None):
+        """
+            Message received from upstream webchat,
+              payload is already prepared for the clients and is sent as is
+        :param payload: json string
+        :param data: decoded payload, decoded from payload if not provided
+        """
+        Message.__init__(self)
+        self._payload = payload
+        self._data = json.loads(payload) if data is None else data
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def id(self):
+        return self._data.get('id')
+
+    @property
+    def user(self):
+        return self._data.get('user')
+
+    @property
+    def command(self):
+        return self._data.get('command')
+
+    @property
+    def message_ids(self):
+        return self._data.get('message_ids', [])
+
+    @property
+    def users(self):
+        user = self._data.get('user', [])
+        return user if isinstance(user, list) else [user]
+
+    def replace(self, text):
+        self._data = dict(self._data, text=text, emotes=[])
+        self._payload = json.dumps(self._data)
+        self.invalidate()
+
+    def json(self):
+        return self._data
+
+
 class Emote(object):
+    __slots__ = ('_id', '_url')
+
     def __init__(self, emote_id, emote_url):
         self._id = emote_id
         self._url = emote_url
@@ -263,5 +451,54 @@ class Emote(object):
 
 
 class Badge(Emote):
+    __slots__ = ()
+
     def __init__(self, badge_id, badge_url):
         Emote.__init__(self, badge_id, badge_url)
+
+
+def dump_message(message):
+    """
+        Converts text message to plain dict, so it can be stored and restored with load_message
+    :type message: TextMessage
+    """
+    if isinstance(message, RelayedMessage):
+        return {'relayed': message.payload, 'created': message.created}
+    data = dict(message.json())
+    data['emotes'] = [[emote.id, emote.url] for emote in message.emotes]
+    data['badges'] = [[badge.id, badge.url] for badge in message.badges]
+    data['created'] = message.created
+    if isinstance(message, SystemMessage):
+        data['category'] = message.category
+    return data
+
+
+def load_message(data):
+    """
+        Restores message saved with dump_message,
+          original chat class is not restored, fields that TextMessage doesn't have become extensions
+    :rtype: TextMessage
+    """
+    data = dict(data)
+    if 'relayed' in data:
+        message = RelayedMessage(data['relayed'])
+        message._created = data['created']
+        return message
+    emotes = [Emote(*emote) for emote in data.pop('emotes', [])]
+    badges = [Badge(*badge) for badge in data.pop('badges', [])]
+    created = data.pop('created')
+    if 'category' in data:
+        message = SystemMessage(data.pop('text'), data.pop('source'), data.pop('source_icon'), data.pop('user'),
+                                emotes, data.pop('category'))
+        message._badges = badges
+        message._id = data.pop('id')
+    else:
+        message = TextMessage(data.pop('source'), data.pop('source_icon'), data.pop('user'), data.pop('text'),
+                              emotes, badges, mid=data.pop('id'))
+    for name, default in (('pm', False), ('nick_colour', None), ('channel_name', None), ('me', False)):
+        setattr(message, '_' + name, data.pop(name, default))
+    message._created = created
+    for name, value in data.items():
+        message.set_extension(name, value)
+    message.invalidate()
+    return message
@@ -128,6 +128,10 @@ class BaseModule:
 
 
 class MessagingModule(BaseModule):
+    # Set to True if module only changes message text/flags based on its config
+    #  and has no other side effects, so it can run in offload worker process
+    pure_transform = False
+
     def __init__(self, *args, **kwargs):
         BaseModule.__init__(self, *args, **kwargs)
 
@@ -143,6 +147,19 @@ class MessagingModule(BaseModule):
         """
         return message
 
+    def process_batch(self, messages, queue=None):
+        """
+            Override this method if module can process
+              multiple messages cheaper than one by one
+        :param messages: List of received Message classes
+        :type messages: list
+        :param queue: Main queue
+        :type queue: Queue.Queue
+        :return: List of processed messages, same order as received
+        :rtype: list
+        """
+        return [self.process_message(message, queue=queue) for message in messages]
+
 
 class ChatModule(BaseModule):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,249 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import ast
+import importlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from modules.helper.system import CONF_FOLDER, ModuleLoadException
+
+log = logging.getLogger('plugins')
+
+METADATA_CACHE = os.path.join(CONF_FOLDER, 'plugins_cache.json')
+DEFAULT_PRIORITY = 100
+# Module level constant where plugin lists modules it should be constructed after
+DEPENDENCIES_TAG = 'DEPENDENCIES'
+PRIORITY_SECTION = 'gui_information'
+PRIORITY_KEY = 'id'
+_cache_lock = threading.Lock()
+
+
+def _literal(node, constants):
+    """
+        Evaluates constant expression, resolving module level names
+    :return: value or None if expression is not constant
+    """
+    if isinstance(node, ast.Name):
+        if node.id in constants:
+            return _literal(constants.pop(node.id), constants)
+        return None
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def _subscript_key(node):
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Index):
+        return _literal(node.slice.value, {})
+    return None
+
+
+def read_metadata(name, path):
+    """
+        Reads plugin metadata from source without importing it
+    :param name: module name, plugin class should have the same name
+    :param path: path to module source
+    :return: dict with name, priority and dependencies
+    """
+    with open(path, 'r') as source_file:
+        tree = ast.parse(source_file.read(), path)
+
+    constants = {}
+    priority_node = None
+    dependencies_node = None
+    has_class = False
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == name:
+            has_class = True
+        if not isinstance(node, ast.Assign):
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                constants[target.id] = node.value
+                if target.id == DEPENDENCIES_TAG:
+                    dependencies_node = node.value
+            elif _subscript_key(target) == PRIORITY_SECTION and isinstance(node.value, ast.Dict):
+                # CONF_DICT['gui_information'] = {'id': PRIORITY}
+                for key, value in zip(node.value.keys, node.value.values):
+                    if _literal(key, {}) == PRIORITY_KEY:
+                        priority_node = value
+            elif _subscript_key(target) == PRIORITY_KEY and _subscript_key(target.value) == PRIORITY_SECTION:
+                # CONF_DICT['gui_information']['id'] = PRIORITY
+                priority_node = node.value
+
+    priority = _literal(priority_node, dict(constants)) if priority_node is not None else None
+    dependencies = _literal(dependencies_node, dict(constants)) if dependencies_node is not None else None
+    return {
+        'name': name,
+        'priority': int(priority) if priority is not None else DEFAULT_PRIORITY,
+        'dependencies': list(dependencies or []),
+        'has_class': has_class
+    }
+
+
+def _load_cache(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as cache:
+            return json.load(cache)
+    except (IOError, ValueError) as exc:
+        log.debug("Unable to read plugin cache: %s", exc)
+        return {}
+
+
+def _save_cache(cache_file, data):
+    try:
+        with open(cache_file, 'w') as cache:
+            json.dump(data, cache, indent=2, sort_keys=True)
+    except IOError as exc:
+        log.debug("Unable to save plugin cache: %s", exc)
+
+
+def run_concurrently(items, function):
+    """
+        Calls function for every item in separate thread
+    :param items: list of (name, argument)
+    :param function: function(argument)
+    :return: OrderedDict name -> (result, exception), same order as items
+    """
+    results = OrderedDict((name, (None, None)) for name, _ in items)
+    lock = threading.Lock()
+
+    def worker(name, argument):
+        try:
+            result = function(argument), None
+        except Exception as exc:
+            result = None, exc
+        with lock:
+            results[name] = result
+
+    threads = [threading.Thread(target=worker, args=item, name='plugin-{}'.format(item[0])) for item in items]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class PluginRegistry(object):
+    def __init__(self, package, folder, cache_file=METADATA_CACHE):
+        """
+            Registry of modules located in one package (modules.chat, modules.messaging),
+              metadata is read from source and cached, modules are imported on first use
+        :param package: python package name
+        :param folder: package folder
+        :param cache_file: json file to keep metadata between launches
+        """
+        self.package = package
+        self.folder = folder
+        self.cache_file = cache_file
+        self._metadata = None
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    def discover(self):
+        """
+        :return: OrderedDict name -> metadata for every module in the package
+        """
+        if self._metadata is not None:
+            return self._metadata
+
+        with _cache_lock:
+            cache = _load_cache(self.cache_file)
+            changed = False
+            metadata = OrderedDict()
+            for file_name in sorted(os.listdir(self.folder)):
+                name, extension = os.path.splitext(file_name)
+                if extension != '.py' or name.startswith('_'):
+                    continue
+                path = os.path.join(self.folder, file_name)
+                stat = os.stat(path)
+                key = '{}.{}'.format(self.package, name)
+                cached = cache.get(key)
+                if not cached or cached.get('mtime') != stat.st_mtime or cached.get('size') != stat.st_size:
+                    try:
+                        cached = read_metadata(name, path)
+                    except (SyntaxError, IOError) as exc:
+                        log.warning("Unable to read metadata of %s: %s", key, exc)
+                        continue
+                    cached.update({'mtime': stat.st_mtime, 'size': stat.st_size})
+                    cache[key] = cached
+                    changed = True
+                metadata[name] = cached
+            if changed and self.cache_file:
+                _save_cache(self.cache_file, cache)
+        self._metadata = metadata
+        return metadata
+
+    def metadata(self, name):
+        return self.discover().get(name)
+
+    def priority(self, name):
+        module_info = self.metadata(name)
+        return module_info['priority'] if module_info else DEFAULT_PRIORITY
+
+    def load_class(self, name):
+        """
+            Imports module on first use,
+              plugin class should be named same as module
+        """
+        with self._lock:
+            if name not in self._classes:
+                module = importlib.import_module('{}.{}'.format(self.package, name))
+                self._classes[name] = getattr(module, name)
+            return self._classes[name]
+
+    def _waves(self, names):
+        """
+            Splits modules into groups that can be constructed at the same time,
+              module goes to group after all its enabled dependencies
+        """
+        pending = list(names)
+        done = set()
+        waves = []
+        while pending:
+            wave = [name for name in pending
+                    if all(depend in done or depend not in pending
+                           for depend in (self.metadata(name) or {}).get('dependencies', []))]
+            if not wave:
+                log.warning("Circular module dependencies: %s", ', '.join(pending))
+                wave = pending
+            waves.append(wave)
+            done.update(wave)
+            pending = [name for name in pending if name not in done]
+        return waves
+
+    def construct(self, names, factory):
+        """
+            Imports and constructs modules, independent ones are constructed concurrently
+        :param names: list of module names, order is kept in result
+        :param factory: function(name, plugin_class) -> module instance
+        :return: OrderedDict name -> instance, modules that failed are left out
+        """
+        unknown = [name for name in names if not (self.metadata(name) or {}).get('has_class')]
+        for name in unknown:
+            log.error("Unable to find %s module", name)
+
+        def build(name):
+            try:
+                return factory(name, self.load_class(name))
+            except ModuleLoadException:
+                raise
+            except Exception:
+                log.exception("Exception while loading module %s", name)
+                raise
+
+        instances = {}
+        for wave in self._waves([name for name in names if name not in unknown]):
+            results = run_concurrently([(name, name) for name in wave], build)
+            for name, (instance, exc) in results.items():
+                if exc is not None:
+                    log.error("Unable to load module %s: %s", name, exc)
+                else:
+                    instances[name] = instance
+        return OrderedDict((name, instances[name]) for name in names if name in instances)
@@ -0,0 +1,233 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import logging
+import threading
+import time
+import urllib
+from collections import deque
+
+from ws4py.client.threadedclient import WebSocketClient
+from ws4py.messaging import TextMessage as WsTextMessage
+
+from modules.helper.message import TextMessage, RelayedMessage
+
+log = logging.getLogger('relay')
+
+RELAY_LOG_SIZE = 1000
+RECONNECT_DELAY = 1
+RECONNECT_DELAY_MAX = 30
+
+
+def relay_frame(data):
+    return WsTextMessage(data).single(mask=False)
+
+
+def parse_cursor(cursor):
+    """
+    :param cursor: "<epoch>:<seq>" sent by relay
+    :return: (epoch, seq), (None, 0) if cursor is invalid
+    """
+    epoch, _, seq = (cursor or '').partition(':')
+    try:
+        return epoch or None, int(seq)
+    except ValueError:
+        return None, 0
+
+
+def apply_relayed_command(history, command):
+    """
+        Applies command received from upstream to local history,
+          it can have local messages too (system messages, history restored from store)
+    :type history: modules.helper.history.MessageHistory
+    :type command: RelayedMessage
+    """
+    ids = set(command.message_ids)
+    users = set(command.users)
+    found = lambda item: item.id in ids if ids else item.user in users
+    text = command.json().get('text')
+    # REST deletion is broadcast without text and removes message, same as del-history
+    if command.command.startswith('remove') or text is None:
+        history.remove(found)
+    elif command.command.startswith('replace'):
+        replaced = history.find(found)
+        for item in replaced:
+            if isinstance(item, RelayedMessage):
+                item.replace(text)
+            elif isinstance(item, TextMessage):
+                item.text = text
+                item.emotes = []
+        history.touch(replaced)
+
+
+class RelayHub(object):
+    def __init__(self, size=RELAY_LOG_SIZE):
+        """
+            Numbers every message sent to relays and keeps the last ones,
+              so reconnected relay gets only what it missed
+        :param size: amount of messages kept for resume, 0 disables relays
+        """
+        # Sequence starts from 1 on every start, relays compare epoch to detect restart
+        self.epoch = '{:x}'.format(int(time.time() * 1000))
+        self.seq = 0
+        self._log = deque(maxlen=max(int(size), 1))
+        self._clients = set()
+        self._lock = threading.Lock()
+        self.enabled = size > 0
+
+    def resize(self, size):
+        with self._lock:
+            self.enabled = size > 0
+            if size > 0 and size != self._log.maxlen:
+                self._log = deque(self._log, maxlen=int(size))
+
+    def publish(self, payload, apply=None):
+        """
+            Called from one thread in message order
+        :param payload: message json, as sent to the clients
+        :param apply: function() that adds message to history, called under the same lock
+                      as history snapshot for new relays, so relay doesn't get message twice
+        """
+        with self._lock:
+            if apply:
+                apply()
+            self.seq += 1
+            self._log.append((self.seq, payload))
+            if self._clients:
+                frame = relay_frame('{{"seq":{},"message":{}}}'.format(self.seq, payload))
+                for client in self._clients:
+                    client.send_frame(frame)
+
+    def attach(self, client, cursor, snapshot):
+        """
+            Sends missed messages and subscribes relay,
+              if they are not in the log anymore relay gets whole history instead
+        :param cursor: last epoch and seq received by relay
+        :param snapshot: function() -> list of history payloads
+        """
+        epoch, seq = parse_cursor(cursor)
+        with self._lock:
+            first = self._log[0][0] if self._log else self.seq + 1
+            if epoch == self.epoch and first - 1 <= seq <= self.seq:
+                client.send_frame(relay_frame(json.dumps({'epoch': self.epoch, 'seq': seq, 'reset': False})))
+                for item_seq, payload in self._log:
+                    if item_seq > seq:
+                        client.send_frame(relay_frame('{{"seq":{},"message":{}}}'.format(item_seq, payload)))
+            else:
+                client.send_frame(relay_frame('{{"epoch":"{}","seq":{},"reset":true,"history":[{}]}}'.format(
+                    self.epoch, self.seq, ','.join(snapshot()))))
+            self._clients.add(client)
+
+    def reset(self, snapshot):
+        """
+            History was replaced, relays get new epoch and whole history
+        """
+        with self._lock:
+            self.epoch = '{:x}'.format(int(time.time() * 1000))
+            self.seq = 0
+            self._log.clear()
+            if self._clients:
+                frame = relay_frame('{{"epoch":"{}","seq":0,"reset":true,"history":[{}]}}'.format(
+                    self.epoch, ','.join(snapshot())))
+                for client in self._clients:
+                    client.send_frame(frame)
+
+    def detach(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def json(self):
+        return {'epoch': self.epoch, 'seq': self.seq, 'relays': len(self._clients), 'log_size': len(self._log)}
+
+
+class RelayConnection(WebSocketClient):
+    def __init__(self, url, relay):
+        super(RelayConnection, self).__init__(url)
+        self.relay = relay  # type: RelayClient
+
+    def received_message(self, message):
+        self.relay.process(message.data)
+
+    def closed(self, code, reason=None):
+        log.info("Relay connection closed: %s %s", code, reason)
+
+
+class RelayClient(threading.Thread):
+    def __init__(self, upstream, on_reset, on_message):
+        """
+            Subscribes to upstream webchat relay stream and reconnects with last received sequence
+        :param upstream: websocket url of upstream webchat, e.g. ws://127.0.0.1:8080/ws
+        :param on_reset: function(list of payloads) - history was replaced
+        :param on_message: function(payload) - next message
+        """
+        super(RelayClient, self).__init__(name='relay-client')
+        self.daemon = True
+        self.upstream = upstream
+        self.on_reset = on_reset
+        self.on_message = on_message
+        self.epoch = None
+        self.seq = 0
+        self.running = True
+        self.connection = None
+        self.received = 0
+        self.resets = 0
+        self.reconnects = 0
+
+    def url(self):
+        separator = '&' if '?' in self.upstream else '?'
+        cursor = '{}:{}'.format(self.epoch or '', self.seq)
+        return '{}{}relay={}'.format(self.upstream, separator, urllib.quote(cursor))
+
+    def run(self):
+        delay = RECONNECT_DELAY
+        while self.running:
+            try:
+                self.connection = RelayConnection(self.url(), self)
+                self.connection.connect()
+                delay = RECONNECT_DELAY
+                self.connection.run_forever()
+            except Exception as exc:
+                log.warning("Unable to connect to upstream %s: %s", self.upstream, exc)
+            if not self.running:
+                break
+            self.reconnects += 1
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+    def stop(self):
+        self.running = False
+        if self.connection:
+            self.connection.close()
+
+    def process(self, data):
+        try:
+            envelope = json.loads(data)
+            if 'epoch' in envelope:
+                epoch, seq, reset = envelope['epoch'], int(envelope['seq']), envelope['reset']
+                history = [json.dumps(message) for message in envelope['history']] if reset else None
+            else:
+                seq, message = int(envelope['seq']), envelope['message']
+        except (ValueError, KeyError, TypeError) as exc:
+            log.warning("Ignoring invalid relay envelope: %s", exc)
+            return
+
+        if 'epoch' in envelope:
+            self.epoch = epoch
+            self.seq = seq
+            if reset:
+                self.resets += 1
+                self.on_reset(history)
+            return
+        if seq <= self.seq:
+            return
+        if seq != self.seq + 1:
+            log.warning("Relay stream gap %s -> %s, reconnecting", self.seq, seq)
+            if self.connection:
+                self.connection.close()
+            return
+        self.seq = seq
+        self.received += 1
+        self.on_message(json.dumps(message))
+
+    def json(self):
+        return {'upstream': self.upstream, 'epoch': self.epoch, 'seq': self.seq,
+                'received': self.received, 'resets': self.resets, 'reconnects': self.reconnects}
@@ -0,0 +1,117 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import logging
+import threading
+from collections import deque
+
+from modules.helper.stats import Histogram, timer
+
+log = logging.getLogger('sender')
+
+SEND_QUEUE_SIZE = 500
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_DISCONNECT = 'disconnect'
+SEND_POLICIES = [POLICY_DROP_OLDEST, POLICY_DISCONNECT]
+STOP_SENDER = object()
+
+
+class ClientSender(threading.Thread):
+    def __init__(self, write, disconnect, max_size=SEND_QUEUE_SIZE, policy=POLICY_DROP_OLDEST, name=None):
+        """
+            Bounded outbound queue with own writer thread,
+              so one stalled client doesn't delay others
+        :param write: function(frame) that writes to client socket, may block
+        :param disconnect: function() that drops the client
+        :param max_size: maximum amount of queued frames
+        :param policy: drop_oldest - oldest queued frame is dropped when queue is full
+                       disconnect - client is disconnected when queue is full
+        """
+        super(ClientSender, self).__init__(name=name)
+        self.daemon = True
+        self._write = write
+        self._disconnect = disconnect
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self.max_size = max(int(max_size), 1)
+        self.policy = policy if policy in SEND_POLICIES else POLICY_DROP_OLDEST
+        self.running = True
+
+        self.sent = 0
+        self.dropped = 0
+        self.lag = Histogram()
+        self._write_started = None
+
+    def configure(self, max_size=None, policy=None):
+        with self._condition:
+            if max_size is not None:
+                self.max_size = max(int(max_size), 1)
+            if policy in SEND_POLICIES:
+                self.policy = policy
+
+    def put(self, frame):
+        """
+        :return: False if client was disconnected as slow consumer
+        """
+        with self._condition:
+            if not self.running:
+                return False
+            full = len(self._frames) >= self.max_size
+            if not full or self.policy == POLICY_DROP_OLDEST:
+                if full:
+                    self._frames.popleft()
+                    self.dropped += 1
+                self._frames.append((timer(), frame))
+                self._condition.notify()
+                return True
+            self.running = False
+            self._frames.clear()
+            self._condition.notify()
+        log.warning("Disconnecting slow client %s", self.name)
+        self._disconnect()
+        return False
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._frames.clear()
+            self._frames.append((None, STOP_SENDER))
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._frames and self.running:
+                    self._condition.wait()
+                if not self._frames:
+                    break
+                queued_at, frame = self._frames.popleft()
+            if frame is STOP_SENDER:
+                break
+            self._write_started = timer()
+            try:
+                self._write(frame)
+            except Exception as exc:
+                log.debug("Unable to send to %s: %s", self.name, exc)
+                self.stop()
+                break
+            finally:
+                now = timer()
+                self._write_started = None
+            self.sent += 1
+            self.lag.add(now - queued_at)
+
+    def json(self):
+        with self._condition:
+            queued = len(self._frames)
+            oldest = self._frames[0][0] if self._frames and self._frames[0][0] is not None else None
+        write_started = self._write_started
+        now = timer()
+        return {
+            'policy': self.policy,
+            'max_size': self.max_size,
+            'queued': queued,
+            'oldest_age': now - oldest if oldest else 0.0,
+            'writing_for': now - write_started if write_started else 0.0,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'lag': self.lag.json()
+        }
@@ -0,0 +1,99 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import bisect
+import threading
+from timeit import default_timer as timer
+
+# Bucket bounds in seconds, from 1 microsecond up to ~67 seconds,
+#  each bucket is ~19% wider than previous one
+LATENCY_BUCKETS = [0.000001 * 2 ** (index / 4.0) for index in range(105)]
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+            Fixed bucket histogram, cheap enough to be always on
+        :param bounds: sorted upper bounds of buckets
+        """
+        self._bounds = bounds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self._bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def add(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        :param percent: percentile to calculate (0-100)
+        :return: upper bound of bucket where percentile lies
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            max_value = self.max
+        if not count:
+            return 0.0
+        rank = count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index < len(self._bounds):
+                    return min(self._bounds[index], max_value)
+                break
+        return max_value
+
+    def json(self):
+        data = {
+            'count': self.count,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max
+        }
+        for percent in PERCENTILES:
+            data['p{}'.format(percent)] = self.percentile(percent)
+        return data
+
+
+class TimingStat(object):
+    def __init__(self):
+        """
+            Call counter with latency histogram,
+              items are counted separately as one call can handle many of them
+        """
+        self.items = 0
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+
+    def add(self, elapsed, items=1):
+        self.latency.add(elapsed)
+        with self._lock:
+            self.items += items
+
+    def reset(self):
+        with self._lock:
+            self.items = 0
+        self.latency.reset()
+
+    def json(self):
+        latency = self.latency.json()
+        return {
+            'calls': latency['count'],
+            'items': self.items,
+            'time': latency['total'],
+            'per_item': latency['total'] / self.items if self.items else 0.0,
+            'latency': latency
+        }
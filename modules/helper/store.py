@@ -0,0 +1,158 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from modules.helper.history import HISTORY_SIZE
+from modules.helper.message import dump_message, load_message
+
+log = logging.getLogger('store')
+
+# Seconds between writes, all queued changes are written in one transaction
+FLUSH_INTERVAL = 0.5
+# Queued changes that trigger write before interval ends
+FLUSH_SIZE = 500
+STOP_TIMEOUT = 2
+
+OP_ADD = 'add'
+OP_UPDATE = 'update'
+OP_REMOVE = 'remove'
+OP_CLEAR = 'clear'
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS messages ('
+                       'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'id TEXT UNIQUE, '
+                       'created REAL, '
+                       'data TEXT)')
+    connection.execute('CREATE INDEX IF NOT EXISTS messages_created ON messages (created)')
+    return connection
+
+
+class HistoryStore(threading.Thread):
+    def __init__(self, path, keep=HISTORY_SIZE, max_age=0, flush_interval=FLUSH_INTERVAL):
+        """
+            Persistent copy of chat history in SQLite (WAL mode),
+              changes are queued and written from own thread, so messaging threads never wait for disk
+        :param path: database file
+        :param keep: amount of messages kept in the database
+        :param max_age: messages older than max_age seconds are deleted, 0 to disable
+        """
+        super(HistoryStore, self).__init__(name='history-store')
+        self.daemon = True
+        self.path = path
+        self.keep = max(int(keep), 1)
+        self.max_age = max(int(max_age), 0)
+        self.flush_interval = flush_interval
+        self.running = True
+        self._ops = deque()
+        self._condition = threading.Condition()
+
+    def load(self, limit, max_age=0):
+        """
+            Reads last messages, called before store is started
+        :param limit: maximum amount of messages
+        :param max_age: only messages younger than max_age seconds, 0 for all
+        :return: list of messages, oldest first
+        """
+        cutoff = time.time() - max_age if max_age else 0
+        connection = connect(self.path)
+        try:
+            rows = connection.execute('SELECT data FROM messages WHERE created >= ? ORDER BY seq DESC LIMIT ?',
+                                      (cutoff, int(limit))).fetchall()
+        finally:
+            connection.close()
+        messages = []
+        for row in reversed(rows):
+            try:
+                messages.append(load_message(json.loads(row[0])))
+            except (ValueError, KeyError, TypeError) as exc:
+                log.warning("Unable to load stored message: %s", exc)
+        return messages
+
+    def configure(self, keep, max_age=0):
+        self.keep = max(int(keep), 1)
+        self.max_age = max(int(max_age), 0)
+
+    def _queue(self, op):
+        with self._condition:
+            self._ops.append(op)
+            if len(self._ops) >= FLUSH_SIZE:
+                self._condition.notify()
+
+    def add(self, message):
+        self._queue((OP_ADD, message))
+
+    def update(self, messages):
+        """
+            Stores new state of messages that were changed in place (replace commands)
+        """
+        for message in messages:
+            self._queue((OP_UPDATE, message))
+
+    def remove(self, messages):
+        for message in messages:
+            self._queue((OP_REMOVE, message))
+
+    def clear(self):
+        self._queue((OP_CLEAR, None))
+
+    def stop(self):
+        """
+            Writes queued changes and stops the thread
+        """
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self.is_alive():
+            self.join(STOP_TIMEOUT)
+
+    def run(self):
+        connection = connect(self.path)
+        while True:
+            with self._condition:
+                if self.running and len(self._ops) < FLUSH_SIZE:
+                    self._condition.wait(self.flush_interval)
+                ops, self._ops = self._ops, deque()
+                running = self.running
+            if ops:
+                try:
+                    self._write(connection, ops)
+                except sqlite3.Error as exc:
+                    log.exception("Unable to write history: %s", exc)
+            if not running:
+                break
+        connection.close()
+
+    def _write(self, connection, ops):
+        added = []
+        with connection:
+            for op, message in ops:
+                if op == OP_ADD:
+                    # Serialized in store thread, so message is stored with changes made after it was queued
+                    added.append((str(message.id), message.created, json.dumps(dump_message(message))))
+                    continue
+                if added:
+                    connection.executemany('INSERT OR IGNORE INTO messages (id, created, data) VALUES (?, ?, ?)', added)
+                    added = []
+                if op == OP_UPDATE:
+                    connection.execute('UPDATE messages SET data = ? WHERE id = ?',
+                                       (json.dumps(dump_message(message)), str(message.id)))
+                elif op == OP_REMOVE:
+                    connection.execute('DELETE FROM messages WHERE id = ?', (str(message.id),))
+                elif op == OP_CLEAR:
+                    connection.execute('DELETE FROM messages')
+            if added:
+                connection.executemany('INSERT OR IGNORE INTO messages (id, created, data) VALUES (?, ?, ?)', added)
+            # Removed messages leave gaps in seq, so newest rows are counted
+            connection.execute('DELETE FROM messages WHERE seq NOT IN '
+                               '(SELECT seq FROM messages ORDER BY seq DESC LIMIT ?)', (self.keep,))
+            if self.max_age:
+                connection.execute('DELETE FROM messages WHERE created < ?', (time.time() - self.max_age,))
@@ -1,4 +1,5 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
 import locale
 import logging
 import random
@@ -6,6 +7,8 @@ import re
 import os
 import string
 import sys
+import threading
+import time
 import requests
 import semantic_version
 
@@ -17,6 +20,11 @@ TRANSLATION_FOLDER = os.path.join(PYTHON_FOLDER, "translations")
 CONF_FOLDER = os.path.join(PYTHON_FOLDER, "conf")
 MODULE_FOLDER = os.path.join(PYTHON_FOLDER, "modules")
 MAIN_CONF_FILE = os.path.join(CONF_FOLDER, "config.cfg")
+UPDATE_CACHE_FILE = os.path.join(CONF_FOLDER, "update.json")
+UPDATE_URL = "https://api.github.com/repos/DeForce/LalkaChat/releases"
+# Seconds before cached releases list is checked again
+UPDATE_TTL = 6 * 60 * 60
+UPDATE_TIMEOUT = 5
 GUI_TAG = 'gui'
 
 LOG_FOLDER = os.path.join(PYTHON_FOLDER, "logs")
@@ -142,22 +150,78 @@ def random_string(length):
     return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(length))
 
 
-def get_update(sem_version):
-    github_url = "https://api.github.com/repos/DeForce/LalkaChat/releases"
+def _find_update(releases, sem_version):
+    update = False
+    update_url = None
+    for tag_name, html_url in releases:
+        try:
+            if semantic_version.Version.coerce(tag_name.lstrip('v')) > sem_version:
+                update = True
+                update_url = html_url
+        except ValueError:
+            log.debug("Unable to parse release version %s", tag_name)
+    return update, update_url
+
+
+def _load_update_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as cache:
+            return json.load(cache)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_update_cache(cache_file, cache):
+    try:
+        with open(cache_file, 'w') as cache_fd:
+            json.dump(cache, cache_fd)
+    except IOError as exc:
+        log.debug("Unable to save update cache: %s", exc)
+
+
+def get_update(sem_version, cache_file=UPDATE_CACHE_FILE, ttl=UPDATE_TTL):
+    """
+        Checks github releases for new version,
+          releases list is cached on disk and revalidated with ETag after ttl
+    :return: (update, update_url)
+    """
+    cache = _load_update_cache(cache_file)
+    releases = cache.get('releases')
+    if releases is not None and time.time() - cache.get('checked', 0) < ttl:
+        return _find_update(releases, sem_version)
+
+    headers = {}
+    if releases is not None and cache.get('etag'):
+        headers['If-None-Match'] = cache['etag']
     try:
-        update_json = requests.get(github_url, timeout=1)
-        if update_json.status_code == 200:
-            update = False
-            update_url = None
-            update_list = update_json.json()
-            for update_item in update_list:
-                if semantic_version.Version.coerce(update_item['tag_name'].lstrip('v')) > sem_version:
-                    update = True
-                    update_url = update_item['html_url']
-            return update, update_url
+        update_json = requests.get(UPDATE_URL, headers=headers, timeout=UPDATE_TIMEOUT)
+        if update_json.status_code == 304:
+            cache['checked'] = time.time()
+            _save_update_cache(cache_file, cache)
+        elif update_json.status_code == 200:
+            releases = [(item['tag_name'], item['html_url']) for item in update_json.json()]
+            _save_update_cache(cache_file, {'checked': time.time(),
+                                            'etag': update_json.headers.get('ETag'),
+                                            'releases': releases})
     except Exception as exc:
         log.info("Got exception: {0}".format(exc))
-    return False, None
+    if releases is None:
+        return False, None
+    return _find_update(releases, sem_version)
+
+
+def get_update_async(sem_version, callback, **kwargs):
+    """
+        Runs get_update in background thread
+    :param callback: function(update, update_url) called when result is ready
+    """
+    def check():
+        callback(*get_update(sem_version, **kwargs))
+
+    thread = threading.Thread(target=check, name='update-check')
+    thread.daemon = True
+    thread.start()
+    return thread
 
 
 def get_language():
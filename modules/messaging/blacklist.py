@@ -24,6 +24,8 @@ log = logging.getLogger('blacklist')
 
 
 class blacklist(MessagingModule):
+    pure_transform = True
+
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
 
@@ -52,7 +54,7 @@ class blacklist(MessagingModule):
     def process_message(self, message, **kwargs):
         self._blocked(message)
         if self._hidden(message):
-            message.hidden = True
+            message.set_extension('hidden', True, jsonable=False)
         return message
 
     def _hidden(self, message):
@@ -47,6 +47,8 @@ def twitch_replace_indexes(filter_name, text, filter_size, replace_size, emotes_
 
 
 class c2b(MessagingModule):
+    pure_transform = True
+
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
 
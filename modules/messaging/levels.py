@@ -16,6 +16,8 @@ from modules.helper.system import ModuleLoadException
 from modules.helper.module import MessagingModule
 
 log = logging.getLogger('levels')
+# Levels are shown using webchat style, so it is constructed after webchat
+DEPENDENCIES = ('webchat',)
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {'category': 'messaging'}
@@ -152,10 +154,7 @@ class levels(MessagingModule):
         if 'webchat' in kwargs.get('from_depend', []):
             self.load_levels()
 
-    def set_level(self, user, queue):
-        db = sqlite3.connect(self.db_location)
-
-        cursor = db.cursor()
+    def set_level(self, user, queue, cursor):
         user_select = cursor.execute('SELECT User, Experience FROM UserLevels WHERE User = ?', [user])
         user_select = user_select.fetchall()
 
@@ -169,7 +168,6 @@ class levels(MessagingModule):
             log.error("Select yielded more than one User")
         else:
             cursor.execute('INSERT INTO UserLevels VALUES (?, ?)', [user, experience])
-        db.commit()
 
         max_level = 0
         for level in self.levels:
@@ -183,7 +181,6 @@ class levels(MessagingModule):
                 max_level = random.randint(0, len(self.levels) - 1)
                 experience = self.levels[max_level]['exp'] - self.exp_for_level
                 cursor.execute('UPDATE UserLevels SET Experience = ? WHERE User = ? ', [experience, user])
-                db.commit()
             else:
                 max_level += 1
             queue.put(
@@ -194,24 +191,34 @@ class levels(MessagingModule):
                     category='module'
                 )
             )
-        cursor.close()
         return self.levels[max_level].copy()
 
     @process_text_messages
     @ignore_system_messages
-    def process_message(self, message, queue=None, **kwargs):
+    def process_message(self, message, queue=None, cursor=None, **kwargs):
+        if cursor is None:
+            return self.process_batch([message], queue=queue)[0]
+
         if message.user in self.special_levels:
             level_info = self.special_levels[message.user]
-            try:
-                message.s_levels.append(level_info.copy())
-            except AttributeError:
-                message.s_levels = [level_info.copy()]
-                message.jsonable.append('s_levels')
-
-        message.levels = self.set_level(message.user, queue)
-        message.jsonable.append('levels')
+            s_levels = message.get_extension('s_levels', [])
+            message.set_extension('s_levels', s_levels + [level_info.copy()])
+
+        message.set_extension('levels', self.set_level(message.user, queue, cursor))
         return message
 
+    def process_batch(self, messages, queue=None):
+        # Whole batch shares one connection and one commit
+        db = sqlite3.connect(self.db_location)
+        try:
+            cursor = db.cursor()
+            messages = [self.process_message(message, queue=queue, cursor=cursor) for message in messages]
+            cursor.close()
+            db.commit()
+        finally:
+            db.close()
+        return messages
+
     def calculate_experience(self, user):
         exp_to_add = self.exp_for_message
         if user in self.threshold_users:
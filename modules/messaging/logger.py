@@ -5,7 +5,7 @@ import os
 import datetime
 from collections import OrderedDict
 
-from modules.helper.message import process_text_messages
+from modules.helper.message import process_text_messages, TextMessage
 from modules.helper.module import MessagingModule
 from modules.helper.system import CONF_FOLDER
 
@@ -48,11 +48,20 @@ class logger(MessagingModule):
 
     @process_text_messages
     def process_message(self, message, **kwargs):
-        with open('{0}.txt'.format(
-                os.path.join(self.destination, datetime.datetime.now().strftime(self.format))), 'a') as f:
-            f.write('[{3}] [{0}] {1}: {2}\n'.format(
-                message.source.encode('utf-8'),
-                message.user.encode('utf-8'),
-                message.text.encode('utf-8'),
-                datetime.datetime.now().strftime(self.ts_format).encode('utf-8')))
-        return message
+        return self.process_batch([message])[0]
+
+    def process_batch(self, messages, queue=None):
+        lines = [self._format_line(message) for message in messages
+                 if message and isinstance(message, TextMessage)]
+        if lines:
+            with open('{0}.txt'.format(
+                    os.path.join(self.destination, datetime.datetime.now().strftime(self.format))), 'a') as f:
+                f.writelines(lines)
+        return messages
+
+    def _format_line(self, message):
+        return '[{3}] [{0}] {1}: {2}\n'.format(
+            message.source.encode('utf-8'),
+            message.user.encode('utf-8'),
+            message.text.encode('utf-8'),
+            datetime.datetime.now().strftime(self.ts_format).encode('utf-8'))
@@ -23,6 +23,8 @@ CONF_GUI = {
 
 
 class mentions(MessagingModule):
+    pure_transform = True
+
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
         # Creating filter and replace strings.
@@ -46,8 +48,7 @@ class mentions(MessagingModule):
     def _check_mentions(self, message):
         for mention in self._conf_params['config']['mentions']:
             if re.search(mention, message.text.lower()):
-                message.mention = True
-                message.jsonable += ['mention']
+                message.set_extension('mention', True)
                 break
 
     def _check_addressed(self, message):
@@ -1,12 +1,14 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import Queue
-import copy
-import datetime
+import hashlib
 import json
 import logging
 import os
 import socket
+import sqlite3
 import threading
+import time
+import urlparse
 from collections import OrderedDict
 
 import cherrypy
@@ -14,25 +16,50 @@ from cherrypy.lib.static import serve_file
 from scss import Compiler
 from scss.namespace import Namespace
 from scss.types import Color, Boolean, String, Number
+from ws4py.messaging import TextMessage as WsTextMessage
+from ws4py import WS_VERSION
 from ws4py.server.cherrypyserver import WebSocketPlugin, WebSocketTool
 from ws4py.websocket import WebSocket
 
-from modules.gui import MODULE_KEY
-from modules.helper.message import TextMessage, CommandMessage, SystemMessage, RemoveMessageByID
+from modules.helper.bulk import parse_body
+from modules.helper.batcher import TickBatcher, BATCH_TICK, BATCH_TICK_MIN, BATCH_TICK_MAX
+from modules.helper.clients import ClientRegistry, DEFAULT_SUBSCRIPTION
+from modules.helper.compression import (negotiate_deflate, accepts_gzip, deflate_frame, gzip_body,
+                                        COMPRESSION_LEVEL, COMPRESSION_THRESHOLD)
+from modules.helper.evented import EventedServer, EventedWebSocket
+from modules.helper.executor import Executor
+from modules.helper.history import MessageHistory, HISTORY_SIZE
+from modules.helper.message import TextMessage, CommandMessage, SystemMessage, RemoveMessageByID, RelayedMessage
 from modules.helper.module import MessagingModule
 from modules.helper.parser import save_settings
-from modules.helper.system import THREADS, PYTHON_FOLDER, CONF_FOLDER
+from modules.helper.relay import RelayHub, RelayClient, RELAY_LOG_SIZE, apply_relayed_command
+from modules.helper.sender import ClientSender, SEND_QUEUE_SIZE, POLICY_DROP_OLDEST, SEND_POLICIES
+from modules.helper.store import HistoryStore
+from modules.helper.system import PYTHON_FOLDER, CONF_FOLDER, MODULE_KEY, RestApiException
 
 logging.getLogger('ws4py').setLevel(logging.ERROR)
 DEFAULT_STYLE = 'default'
 DEFAULT_PRIORITY = 9001
-HISTORY_SIZE = 40
 HTTP_FOLDER = os.path.join(PYTHON_FOLDER, "http")
 s_queue = Queue.Queue()
 log = logging.getLogger('webchat')
 REMOVED_TRIGGER = '%%REMOVED%%'
+# History is sent to new client after delay, from small shared pool
+HISTORY_DELAY = 0.3
+HISTORY_THREADS = 2
+HISTORY_STORE_FILE = os.path.join(CONF_FOLDER, 'webchat_history.db')
+# Clients connected with ?batch=1 get JSON array of messages once per tick
+BATCH_SUBSCRIPTION = 'batch'
+# Relays connect with ?relay=<epoch>:<seq> and get numbered messages, see RelayHub
+RELAY_SUBSCRIPTION = 'relay'
+
+# cherrypy - thread per connection, evented - one poll loop for all websocket clients
+BACKEND_CHERRYPY = 'cherrypy'
+BACKEND_EVENTED = 'evented'
+BACKENDS = [BACKEND_CHERRYPY, BACKEND_EVENTED]
+# Encoded history responses kept for one history version
+HISTORY_CACHE_SIZE = 64
 
-WS_THREADS = THREADS + 3
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {
@@ -42,6 +69,32 @@ CONF_DICT['gui_information'] = {
 CONF_DICT['server'] = OrderedDict()
 CONF_DICT['server']['host'] = '127.0.0.1'
 CONF_DICT['server']['port'] = '8080'
+CONF_DICT['server']['backend'] = BACKEND_CHERRYPY
+CONF_DICT['history'] = OrderedDict()
+CONF_DICT['history']['size'] = HISTORY_SIZE
+# Seconds, messages older than that are dropped from history, 0 to keep them
+CONF_DICT['history']['max_age'] = 0
+# History is saved to disk and loaded on start
+CONF_DICT['history']['persist'] = False
+CONF_DICT['clients'] = OrderedDict()
+# Frames queued for one client before slow client policy is applied
+CONF_DICT['clients']['queue_size'] = SEND_QUEUE_SIZE
+CONF_DICT['clients']['slow_policy'] = POLICY_DROP_OLDEST
+# Milliseconds between frames for clients in batch mode
+CONF_DICT['clients']['batch_tick'] = BATCH_TICK
+CONF_DICT['compression'] = OrderedDict()
+# permessage-deflate for websocket clients that offer it
+CONF_DICT['compression']['deflate'] = True
+# gzip for REST history, if client accepts it
+CONF_DICT['compression']['gzip'] = True
+CONF_DICT['compression']['level'] = COMPRESSION_LEVEL
+# Bytes, smaller payloads are sent uncompressed
+CONF_DICT['compression']['threshold'] = COMPRESSION_THRESHOLD
+CONF_DICT['relay'] = OrderedDict()
+# Messages kept for relays to resume after reconnect, 0 disables relays
+CONF_DICT['relay']['log_size'] = RELAY_LOG_SIZE
+# Websocket url of upstream webchat (ws://host:port/ws), messages are relayed from it
+CONF_DICT['relay']['upstream'] = ''
 CONF_DICT['style_gui'] = DEFAULT_STYLE
 CONF_DICT['style_gui_settings'] = OrderedDict()
 CONF_DICT['style'] = DEFAULT_STYLE
@@ -52,6 +105,8 @@ TYPE_DICT = {
     TextMessage: 'message',
     CommandMessage: 'command'
 }
+# Message class -> type, filled on first use
+MESSAGE_TYPES = {}
 
 
 def process_emotes(emotes):
@@ -62,19 +117,51 @@ def process_badges(badges):
     return [{'badge': badge.id, 'url': badge.url} for badge in badges]
 
 
+def get_message_type(msg_class):
+    if msg_class not in MESSAGE_TYPES:
+        MESSAGE_TYPES[msg_class] = None
+        for m_class, m_type in TYPE_DICT.items():
+            if issubclass(msg_class, m_class):
+                MESSAGE_TYPES[msg_class] = m_type
+    return MESSAGE_TYPES[msg_class]
+
+
+def get_style_values(style_settings):
+    """
+        Values that prepare_message needs from style,
+          calculated once per style settings revision
+    """
+    revision = style_settings.get('revision', 0)
+    values = style_settings.get('values')
+    if values is None or values['revision'] != revision:
+        values = style_settings['values'] = {
+            'revision': revision,
+            'levels_suffix': '?{}'.format(style_settings['style_name']),
+            'remove_text': style_settings['keys'].get('remove_text')
+        }
+    return values
+
+
 def prepare_message(msg, style_settings, msg_class):
-    message = copy.deepcopy(msg)
+    """
+        Builds message for the clients, only changed values are replaced,
+          everything else is shared with the message payload
+    :param msg: message payload, it is not modified
+    """
+    values = get_style_values(style_settings)
+    message = dict(msg)
 
     if 'levels' in message:
-        message['levels']['url'] = '{}?{}'.format(message['levels']['url'], style_settings['style_name'])
+        levels = message['levels']
+        message['levels'] = dict(levels, url=levels['url'] + values['levels_suffix'])
 
-    if 'text' in message and message['text'] == REMOVED_TRIGGER:
-        message['text'] = style_settings.get('remove_text')
+    if message.get('text') == REMOVED_TRIGGER:
+        message['text'] = values['remove_text']
 
     if 'type' not in message:
-        for m_class, m_type in TYPE_DICT.items():
-            if issubclass(msg_class, m_class):
-                message['type'] = m_type
+        m_type = get_message_type(msg_class)
+        if m_type:
+            message['type'] = m_type
 
     if 'emotes' in message:
         message['emotes'] = process_emotes(message['emotes'])
@@ -84,128 +171,296 @@ def prepare_message(msg, style_settings, msg_class):
 
     if 'command' in message:
         if message['command'].startswith('replace'):
-            message['text'] = style_settings['keys']['remove_text']
+            message['text'] = values['remove_text']
         return message
 
     message['id'] = str(message['id'])
     return message
 
 
-def add_to_history(message):
-    if isinstance(message, TextMessage):
-        cherrypy.engine.publish('add-history', message)
+def prepare_relayed(msg, style_settings):
+    """
+        Adapts message prepared by upstream chat style to local style of another chat type
+    :param msg: decoded relayed payload, it is not modified
+    """
+    values = get_style_values(style_settings)
+    message = dict(msg)
+
+    if 'levels' in message:
+        levels = message['levels']
+        message['levels'] = dict(levels, url=levels['url'].partition('?')[0] + values['levels_suffix'])
+
+    if (message.get('command') or '').startswith('replace'):
+        message['text'] = values['remove_text']
+    return message
 
 
-def process_command(message):
-    if isinstance(message, CommandMessage):
-        cherrypy.engine.publish('process-command', message.command, message)
+def encode_message(message, style_settings, chat_type):
+    """
+        Serializes message for the style once, result is cached in the message
+          until it is changed or style settings are applied again
+    :return: json string to send to the clients
+    """
+    if isinstance(message, RelayedMessage):
+        # Relayed payload is prepared for upstream chat style, gui clients get it for local gui style
+        if chat_type == 'chat':
+            return message.payload
+        return message.frame(
+            (chat_type, style_settings.get('revision', 0)),
+            lambda msg: json.dumps(prepare_relayed(msg.json(), style_settings)))
+    return message.frame(
+        (chat_type, style_settings.get('revision', 0)),
+        lambda msg: json.dumps(prepare_message(msg.json(), style_settings, type(msg))))
+
+
+def encode_frame(message, style_settings, chat_type, compression=None):
+    """
+        Builds websocket frame once per style,
+          server frames are not masked so every client gets the same bytes
+    :param compression: compression settings if client negotiated permessage-deflate
+    :return: bytes ready to be written to client socket
+    """
+    revision = style_settings.get('revision', 0)
+    if compression:
+        payload = encode_message(message, style_settings, chat_type)
+        if len(payload) >= compression['threshold']:
+            return message.frame(('deflate', chat_type, revision, compression['level']),
+                                 lambda msg: deflate_frame(payload, compression['level']))
+    return message.frame(
+        ('frame', chat_type, revision),
+        lambda msg: WsTextMessage(encode_message(msg, style_settings, chat_type)).single(mask=False))
+
+
+def encode_batch(encoded_messages, compression=None):
+    """
+        Builds single websocket frame with JSON array of already encoded messages
+    """
+    payload = '[{}]'.format(','.join(encoded_messages))
+    if compression and len(payload) >= compression['threshold']:
+        return deflate_frame(payload, compression['level'])
+    return WsTextMessage(payload).single(mask=False)
+
+
+def wants_gzip(body, compression):
+    """
+        Checks if REST response should be compressed, sets response headers
+    """
+    if not compression['gzip']:
+        return False
+    response = cherrypy.serving.response
+    response.headers['Vary'] = 'Accept-Encoding'
+    if len(body) < compression['threshold']:
+        return False
+    elements = cherrypy.serving.request.headers.elements('Accept-Encoding')
+    if not accepts_gzip([(element.value, element.qvalue) for element in elements]):
+        return False
+    response.headers['Content-Encoding'] = 'gzip'
+    return True
+
+
+def etag_matches(etag):
+    """
+        Sets ETag headers and checks If-None-Match, response status is set to 304 on match
+    """
+    cherrypy.serving.response.headers['ETag'] = etag
+    cherrypy.serving.response.headers['Cache-Control'] = 'no-cache'
+    if_none_match = cherrypy.serving.request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')]:
+        cherrypy.serving.response.status = 304
+        return True
+    return False
+
+
+def get_subscription(environ):
+    query = urlparse.parse_qs((environ or {}).get('QUERY_STRING', ''))
+    if 'relay' in query:
+        return RELAY_SUBSCRIPTION
+    if query.get('batch', ['0'])[0].lower() in ('1', 'true', 'yes'):
+        return BATCH_SUBSCRIPTION
+    return DEFAULT_SUBSCRIPTION
+
+
+def get_relay_cursor(environ):
+    return urlparse.parse_qs((environ or {}).get('QUERY_STRING', '')).get('relay', [''])[0]
 
 
 class MessagingThread(threading.Thread):
-    def __init__(self, settings):
+    def __init__(self, settings, plugin):
         super(self.__class__, self).__init__()
         self.daemon = True
         self.settings = settings
+        self.plugin = plugin  # type: WebChatPlugin
+        self.clients = plugin.clients
         self.running = True
 
     def run(self):
         while self.running:
-            message = s_queue.get()
+            messages = s_queue.get()
+            if not isinstance(messages, list):
+                messages = [messages]
 
-            if isinstance(message, dict):
-                raise Exception("Got dict message {}".format(message))
+            for message in messages:
+                self.process_message(message)
+        log.info("Messaging thread stopping")
 
-            add_to_history(message)
-            process_command(message)
+    def process_message(self, message):
+        if isinstance(message, dict):
+            raise Exception("Got dict message {}".format(message))
 
-            if isinstance(message, SystemMessage) and not self.settings['chat']['keys'].get('show_system_msg', True):
-                continue
+        if isinstance(message, SystemMessage) and not self.settings['chat']['keys'].get('show_system_msg', True):
+            return
 
-            log.debug("%s", message.json())
-            self.send_message(message, 'chat')
-            self.send_message(message, 'gui')
-        log.info("Messaging thread stopping")
+        log.debug("%s", message.json())
+        self.send_message(message, 'chat')
+        self.send_message(message, 'gui')
 
     def stop(self):
         self.running = False
 
     def send_message(self, message, chat_type):
-        send_message = prepare_message(message.json(), self.settings[chat_type], type(message))
-        ws_list = cherrypy.engine.publish('get-clients', chat_type)[0]
+        if self.clients.get(chat_type, BATCH_SUBSCRIPTION):
+            self.plugin.batcher.add(chat_type, encode_message(message, self.settings[chat_type], chat_type))
+
+        ws_list = self.clients.get(chat_type)
+        if not ws_list:
+            return
+        # Message is prepared and framed once, every client gets the same bytes
+        frame = encode_frame(message, self.settings[chat_type], chat_type)
+        deflated = None
         for ws in ws_list:
             try:
-                ws.send(json.dumps(send_message))
+                if ws.compression:
+                    if deflated is None:
+                        deflated = encode_frame(message, self.settings[chat_type], chat_type, ws.compression)
+                    ws.send_frame(deflated)
+                else:
+                    ws.send_frame(frame)
             except Exception as exc:
                 log.exception(exc)
-                log.info(send_message)
-
-
-class FireFirstMessages(threading.Thread):
-    def __init__(self, ws, history, settings):
-        super(self.__class__, self).__init__()
-        self.daemon = True
-        self.ws = ws  # type: WebChatSocketServer
-        self.history = history
-        self.settings = settings
-
-    def run(self):
-        show_system_msg = self.settings['keys'].get('show_system_msg', True)
-        if self.ws.stream:
-            for item in self.history:
-                if isinstance(item, SystemMessage) and not show_system_msg:
-                    continue
-                timestamp = datetime.datetime.strptime(item.timestamp, "%Y-%m-%dT%H:%M:%S.%f")
-                timedelta = datetime.datetime.now() - timestamp
-                timer = int(self.settings['keys'].get('timer', 0))
-                if timer > 0:
-                    if timedelta > datetime.timedelta(seconds=timer):
-                        continue
-
-                message = prepare_message(item.json(), self.settings, type(item))
-                self.ws.send(json.dumps(message))
+                log.info(message.json())
 
 
 class WebChatSocketServer(WebSocket):
     def __init__(self, sock, protocols=None, extensions=None, environ=None, heartbeat_freq=None):
-        WebSocket.__init__(self, sock)
+        WebSocket.__init__(self, sock, environ=environ)
         self.daemon = True
         self.clients = []
         self.settings = cherrypy.engine.publish('get-settings', 'chat')[0]
         self.type = 'chat'
+        self.subscription = get_subscription(environ)
+        # Set by DeflateWebSocketTool if permessage-deflate was negotiated
+        self.compression = None
+        self.sender = None  # type: ClientSender
 
     def opened(self):
         cherrypy.engine.publish('add-client', self.peer_address, self)
-        timer = threading.Timer(0.3, self.fire_history)
-        timer.start()
+        cherrypy.engine.publish('replay-history', self)
 
     def closed(self, code, reason=None):
         cherrypy.engine.publish('del-client', self.peer_address, self)
 
-    def fire_history(self):
-        send_history = FireFirstMessages(self, cherrypy.engine.publish('get-history')[0],
-                                         self.settings)
-        send_history.start()
+    def send_frame(self, frame):
+        """
+            Queues already built websocket frame, see encode_frame
+        """
+        if self.sender:
+            self.sender.put(frame)
+        else:
+            self._write(frame)
+
+    def drop(self):
+        """
+            Disconnects client without writing to it, used for slow clients
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError) as exc:
+            log.debug("Unable to shutdown client socket: %s", exc)
 
 
 class WebChatGUISocketServer(WebChatSocketServer):
     def __init__(self, sock, protocols=None, extensions=None, environ=None, heartbeat_freq=None):
-        WebSocket.__init__(self, sock)
+        WebSocket.__init__(self, sock, environ=environ)
         self.clients = []
         self.settings = cherrypy.engine.publish('get-settings', 'gui')[0]
         self.type = 'gui'
+        self.subscription = get_subscription(environ)
+        self.compression = None
+        self.sender = None
+
+
+class EventedChatSocket(EventedWebSocket):
+    def __init__(self, compression, chat_type, server, sock, peer_address, environ):
+        """
+            Webchat client of evented backend, same protocol as WebChatSocketServer
+        """
+        EventedWebSocket.__init__(self, server, sock, peer_address, environ)
+        self.settings = cherrypy.engine.publish('get-settings', chat_type)[0]
+        self.type = chat_type
+        self.subscription = get_subscription(environ)
+        self.compression = None
+        self._compression_settings = compression
+        # Frames are written by server loop, so client doesn't need sender thread
+        self.sender = self.queue
+
+    def handshake_headers(self):
+        if not self._compression_settings['deflate']:
+            return []
+        response = negotiate_deflate(self.environ.get('HTTP_SEC_WEBSOCKET_EXTENSIONS'))
+        if response:
+            self.compression = self._compression_settings
+            return [('Sec-WebSocket-Extensions', response)]
+        return []
+
+    def opened(self):
+        cherrypy.engine.publish('add-client', self.peer_address, self)
+        cherrypy.engine.publish('replay-history', self)
+
+    def on_close(self):
+        cherrypy.engine.publish('del-client', self.peer_address, self)
+
+
+class DeflateWebSocketTool(WebSocketTool):
+    def __init__(self, compression):
+        """
+            Websocket tool that also negotiates permessage-deflate, ws4py 0.4.2 matches
+              extensions only by exact token and doesn't compress itself.
+              Messages from clients are not decompressed, webchat clients only listen
+        :param compression: compression settings, checked on every handshake
+        """
+        WebSocketTool.__init__(self)
+        self.compression = compression
+
+    def upgrade(self, protocols=None, extensions=None, version=WS_VERSION,
+                handler_cls=WebSocket, heartbeat_freq=None):
+        WebSocketTool.upgrade(self, protocols, extensions, version, handler_cls, heartbeat_freq)
+        if not self.compression['deflate']:
+            return
+        request = cherrypy.serving.request
+        response = negotiate_deflate(request.headers.get('Sec-WebSocket-Extensions'))
+        if response:
+            cherrypy.serving.response.headers['Sec-WebSocket-Extensions'] = response
+            request.ws_handler.compression = self.compression
 
 
 class WebChatPlugin(WebSocketPlugin):
-    def __init__(self, bus, settings):
+    def __init__(self, bus, settings, history, client_settings, relay):
         WebSocketPlugin.__init__(self, bus)
         self.daemon = True
-        self.clients = []
+        self.clients = ClientRegistry()
         self.style_settings = settings
-        self.history = []
-        self.history_size = HISTORY_SIZE
+        self.history = history  # type: MessageHistory
+        self.client_settings = client_settings
+        self.relay = relay  # type: RelayHub
+        self.executor = None
+        self.batcher = None  # type: TickBatcher
 
     def start(self):
         WebSocketPlugin.start(self)
+        self.executor = Executor(HISTORY_THREADS, 'webchat-history')
+        self.batcher = TickBatcher(self.send_batch, self.client_settings['batch_tick'], 'webchat-batcher')
+        self.batcher.start()
+        self.bus.subscribe('replay-history', self.replay_history)
         self.bus.subscribe('get-settings', self.get_settings)
         self.bus.subscribe('add-client', self.add_client)
         self.bus.subscribe('del-client', self.del_client)
@@ -217,6 +472,11 @@ class WebChatPlugin(WebSocketPlugin):
 
     def stop(self):
         WebSocketPlugin.stop(self)
+        self.bus.unsubscribe('replay-history', self.replay_history)
+        if self.executor:
+            self.executor.stop()
+        if self.batcher:
+            self.batcher.stop()
         self.bus.unsubscribe('get-settings', self.get_settings)
         self.bus.unsubscribe('add-client', self.add_client)
         self.bus.unsubscribe('del-client', self.del_client)
@@ -226,41 +486,134 @@ class WebChatPlugin(WebSocketPlugin):
         self.bus.unsubscribe('process-command', self.process_command)
 
     def add_client(self, addr, websocket):
-        self.clients.append({'ip': addr[0], 'port': addr[1], 'websocket': websocket})
+        if websocket.sender is None:
+            websocket.sender = ClientSender(websocket._write, websocket.drop,
+                                            max_size=self.client_settings['queue_size'],
+                                            policy=self.client_settings['slow_policy'],
+                                            name='{}:{}'.format(*addr[:2]))
+            websocket.sender.start()
+        else:
+            websocket.sender.configure(self.client_settings['queue_size'], self.client_settings['slow_policy'])
+        self.clients.add(websocket, websocket.type, websocket.subscription)
 
     def del_client(self, addr, websocket):
-        try:
-            self.clients.remove({'ip': addr[0], 'port': addr[1], 'websocket': websocket})
-        except Exception as exc:
-            log.exception("Exception %s", exc)
+        if websocket.subscription == RELAY_SUBSCRIPTION:
+            self.relay.detach(websocket)
+        if websocket.sender:
+            websocket.sender.stop()
+        if not self.clients.remove(websocket):
             log.info('Unable to delete client %s', addr)
 
+    def configure_clients(self):
+        for websocket in self.clients.all():
+            if websocket.sender:
+                websocket.sender.configure(self.client_settings['queue_size'], self.client_settings['slow_policy'])
+        if self.batcher:
+            self.batcher.tick = self.client_settings['batch_tick']
+
+    def broadcast(self, message, binary=False):
+        # ws4py manager doesn't know clients of evented backend, so registry is used for both
+        frame = WsTextMessage(message).single(mask=False)
+        batch_frame = encode_batch([message])
+        for websocket in self.clients.all():
+            # Relays only get numbered stream from RelayHub
+            if websocket.subscription == RELAY_SUBSCRIPTION:
+                continue
+            websocket.send_frame(batch_frame if websocket.subscription == BATCH_SUBSCRIPTION else frame)
+
+    def send_batch(self, chat_type, encoded_messages):
+        frames = {}
+        for websocket in self.clients.get(chat_type, BATCH_SUBSCRIPTION):
+            compressed = bool(websocket.compression)
+            if compressed not in frames:
+                frames[compressed] = encode_batch(encoded_messages, websocket.compression)
+            websocket.send_frame(frames[compressed])
+
+    def client_stats(self):
+        stats = []
+        for websocket in self.clients.all():
+            client_stats = {'ip': websocket.peer_address[0], 'port': websocket.peer_address[1],
+                            'type': websocket.type, 'subscription': self.clients.subscription(websocket)}
+            if websocket.sender:
+                client_stats.update(websocket.sender.json())
+            stats.append(client_stats)
+        return stats
+
     def get_clients(self, client_type):
-        ws_list = []
-        for client in self.clients:
-            ws = client['websocket']
-            if ws.type == client_type:
-                ws_list.append(client['websocket'])
-        return ws_list
+        return list(self.clients.get(client_type))
 
     def add_history(self, message):
-        self.history.append(message)
-        if len(self.history) > self.history_size:
-            self.history.pop(0)
+        self.history.add(message)
 
     def del_history(self, msg_id):
         if len(msg_id) > 1:
             return
-
-        for index, item in enumerate(self.history):
-            if str(item.id) == msg_id[0]:
-                self.history.pop(index)
+        self.history.remove(lambda item: str(item.id) == msg_id[0])
 
     def get_settings(self, style_type):
         return self.style_settings[style_type]
 
-    def get_history(self):
-        return self.history
+    def get_history(self, max_age=0):
+        return self.history.snapshot(max_age)
+
+    def replay_history(self, websocket):
+        if websocket.subscription == RELAY_SUBSCRIPTION:
+            # Relay gets missed messages right away, before anything new is published
+            self.relay.attach(websocket, get_relay_cursor(websocket.environ), self.relay_snapshot)
+            return
+        self.executor.schedule(HISTORY_DELAY, self._send_history, websocket)
+
+    def _send_history(self, websocket):
+        if websocket.terminated:
+            return
+        settings = websocket.settings
+        show_system_msg = settings['keys'].get('show_system_msg', True)
+        messages = [message for message in self.history.snapshot(int(settings['keys'].get('timer', 0)))
+                    if show_system_msg or not isinstance(message, SystemMessage)]
+        if not messages:
+            return
+        if websocket.subscription == BATCH_SUBSCRIPTION:
+            websocket.send_frame(encode_batch([encode_message(message, settings, websocket.type)
+                                               for message in messages], websocket.compression))
+        else:
+            # Frames are cached in messages, so replay only joins them and writes once
+            websocket.send_frame(b''.join(encode_frame(message, settings, websocket.type, websocket.compression)
+                                          for message in messages))
+
+    def record(self, message):
+        """
+            Applies message to history and numbers it for relays,
+              called from pipeline thread, so history and relay stream keep message order
+        """
+        if self.relay.enabled and self.is_relayed(message):
+            self.relay.publish(encode_message(message, self.style_settings['chat'], 'chat'),
+                               lambda: self.apply_message(message))
+        else:
+            self.apply_message(message)
+
+    def is_relayed(self, message):
+        if isinstance(message, SystemMessage):
+            return self.style_settings['chat']['keys'].get('show_system_msg', True)
+        if isinstance(message, CommandMessage):
+            return message.command != 'reload'
+        return isinstance(message, (TextMessage, RelayedMessage))
+
+    def apply_message(self, message):
+        if isinstance(message, TextMessage):
+            self.add_history(message)
+        elif isinstance(message, CommandMessage):
+            self.process_command(message.command, message)
+        elif isinstance(message, RelayedMessage):
+            if message.command:
+                apply_relayed_command(self.history, message)
+            else:
+                self.add_history(message)
+
+    def relay_snapshot(self):
+        settings = self.style_settings['chat']
+        show_system_msg = settings['keys'].get('show_system_msg', True)
+        return [encode_message(message, settings, 'chat') for message in self.history.snapshot()
+                if show_system_msg or not isinstance(message, SystemMessage)]
 
     def process_command(self, command, values):
         if command == 'remove_by_id':
@@ -273,36 +626,28 @@ class WebChatPlugin(WebSocketPlugin):
             self._replace_by_user(values.user)
 
     def _remove_by_id(self, ids):
-        for item in ids:
-            for message in self.history:
-                if message.get('id') == item:
-                    self.history.remove(message)
+        ids = set(ids)
+        self.history.remove(lambda message: message.id in ids)
 
     def _remove_by_user(self, users):
-        for item in users:
-            for message in reversed(self.history):
-                if message.user == item:
-                    self.history.remove(message)
+        users = set(users)
+        self.history.remove(lambda message: message.user in users)
+
+    def _replace(self, messages):
+        messages = [message for message in messages if isinstance(message, TextMessage)]
+        for message in messages:
+            message.text = REMOVED_TRIGGER
+            message.emotes = []
+        if messages:
+            self.history.touch(messages)
 
     def _replace_by_id(self, ids):
-        for item in ids:
-            for index, message in enumerate(self.history):
-                if message.get('id') == item:
-                    self.history[index]['text'] = REMOVED_TRIGGER
-                    if 'emotes' in self.history[index]:
-                        del self.history[index]['emotes']
-                    if 'bttv_emotes' in self.history[index]:
-                        del self.history[index]['bttv_emotes']
+        ids = set(ids)
+        self._replace(self.history.find(lambda message: message.id in ids))
 
     def _replace_by_user(self, users):
-        for item in users:
-            for index, message in enumerate(self.history):
-                if message.get('user') == item:
-                    self.history[index]['text'] = REMOVED_TRIGGER
-                    if 'emotes' in self.history[index]:
-                        del self.history[index]['emotes']
-                    if 'bttv_emotes' in self.history[index]:
-                        del self.history[index]['bttv_emotes']
+        users = set(users)
+        self._replace(self.history.find(lambda message: message.user in users))
 
 
 class RestRoot(object):
@@ -323,10 +668,12 @@ class RestRoot(object):
         message = 'Incorrect api call'
         error_code = 400
 
-        body = cherrypy.request.body
         if cherrypy.request.method in cherrypy.request.methods_with_bodies:
-            data = json.load(body)
-            kwargs.update(data)
+            try:
+                kwargs.update(parse_body(cherrypy.request.body, cherrypy.request.headers.get('Content-Type', '')))
+            except RestApiException as exc:
+                args = ()
+                message = str(exc)
 
         if len(args) > 1:
             module_name = args[0]
@@ -337,7 +684,13 @@ class RestRoot(object):
                 api = self._rest_modules[module_name]
                 if method in api:
                     if rest_path in api[method]:
-                        return api[method][rest_path](query, **kwargs)
+                        try:
+                            return api[method][rest_path](query, **kwargs)
+                        except RestApiException as exc:
+                            cherrypy.response.status = error_code
+                            return json.dumps({'error': 'Bad Request',
+                                               'status': error_code,
+                                               'message': str(exc)})
                 error_code = 404
                 message = 'Method not found'
         cherrypy.response.status = error_code
@@ -353,6 +706,12 @@ class CssRoot(object):
             'scss': self.style_scss
         }
         self.settings = settings
+        # (path, mtime, keys hash) -> (etag, css), cleared when style settings are applied
+        self._cache = {}
+        self._cache_revision = None
+        self._lock = threading.Lock()
+        # key -> lock held while the key is built, so every file is compiled once
+        self._build_locks = {}
 
     @cherrypy.expose
     def default(self, *args):
@@ -364,12 +723,65 @@ class CssRoot(object):
             return self.css_map[file_type](*path)
         return
 
-    def style_css(self, *path):
+    @staticmethod
+    def send_cached(etag, content):
         cherrypy.response.headers['Content-Type'] = 'text/css'
-        with open(os.path.join(self.settings['location'], *path), 'r') as css:
-            return css.read()
+        if etag_matches(etag):
+            return ''
+        return content
+
+    def get_cached(self, key, build):
+        """
+            Returns (etag, content) for the key, content is built outside of cache lock,
+              so compiling one style doesn't block requests for other files
+        :param build: function() -> content, None is not cached
+        """
+        with self._lock:
+            revision = self.settings.get('revision', 0)
+            if revision != self._cache_revision:
+                self._cache.clear()
+                self._cache_revision = revision
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                cached = self._cache.get(key) if revision == self._cache_revision else None
+            if cached is not None:
+                return cached
+            content = build()
+            if content is not None:
+                encoded = content.encode('utf-8') if isinstance(content, unicode) else content
+                cached = '"{}"'.format(hashlib.sha1(encoded).hexdigest()), content
+            with self._lock:
+                # Content built for replaced settings is returned, but not cached
+                if cached is not None and revision == self._cache_revision:
+                    self._cache[key] = cached
+                if self._build_locks.get(key) is build_lock:
+                    del self._build_locks[key]
+            return cached
+
+    def style_css(self, *path):
+        file_path = os.path.join(self.settings['location'], *path)
+
+        def build():
+            with open(file_path, 'r') as css:
+                return css.read()
+        etag, content = self.get_cached((file_path, os.path.getmtime(file_path)), build)
+        return self.send_cached(etag, content)
 
     def style_scss(self, *path):
+        file_path = os.path.join(self.settings['location'], *path)
+        keys_hash = hashlib.sha1(json.dumps(self.settings['keys'], sort_keys=True)).hexdigest()
+        cached = self.get_cached((file_path, os.path.getmtime(file_path), keys_hash),
+                                 lambda: self.compile_scss(file_path))
+        if cached is None:
+            return
+        return self.send_cached(*cached)
+
+    def compile_scss(self, file_path):
         css_namespace = Namespace()
         for key, value in self.settings['keys'].items():
             if isinstance(value, basestring):
@@ -385,8 +797,7 @@ class CssRoot(object):
                 raise ValueError("Unable to find comparable values")
             css_namespace.set_variable('${}'.format(key), css_value)
 
-        cherrypy.response.headers['Content-Type'] = 'text/css'
-        with open(os.path.join(self.settings['location'], *path), 'r') as css:
+        with open(file_path, 'r') as css:
             css_content = css.read()
             compiler = Compiler(namespace=css_namespace, output_style='nested')
             # Something wrong with PyScss,
@@ -424,13 +835,17 @@ class HttpRoot(object):
 
 class SocketThread(threading.Thread):
     def __init__(self, host, port, root_folder, **kwargs):
-        super(self.__class__, self).__init__()
+        super(SocketThread, self).__init__()
         self.daemon = True
         self.host = host
         self.port = port
         self.root_folder = root_folder
         self.style_settings = kwargs['style_settings']
         self.modules = kwargs.pop('modules')
+        self.history = kwargs.pop('history')
+        self.client_settings = kwargs.pop('client_settings')
+        self.compression = kwargs.pop('compression')
+        self.relay = kwargs.pop('relay')
 
         self.root_config = None
         self.css_config = None
@@ -441,9 +856,10 @@ class SocketThread(threading.Thread):
 
         cherrypy.config.update({'server.socket_port': int(self.port), 'server.socket_host': self.host,
                                 'engine.autoreload.on': False})
-        self.websocket = WebChatPlugin(cherrypy.engine, self.style_settings)
+        self.websocket = WebChatPlugin(cherrypy.engine, self.style_settings, self.history, self.client_settings,
+                                       self.relay)
         self.websocket.subscribe()
-        cherrypy.tools.websocket = WebSocketTool()
+        cherrypy.tools.websocket = DeflateWebSocketTool(self.compression)
 
     def update_settings(self):
         self.root_config = {
@@ -498,6 +914,26 @@ class SocketThread(threading.Thread):
         cherrypy.tree.mount(RestRoot(self.style_settings, self.modules), '/rest', self.rest_config)
 
 
+class EventedSocketThread(SocketThread):
+    def __init__(self, host, port, root_folder, **kwargs):
+        """
+            Websocket clients are served by EventedServer,
+              everything else is passed to cherrypy applications through WSGI
+        """
+        SocketThread.__init__(self, host, port, root_folder, **kwargs)
+        self.server = None
+
+    def run(self):
+        # Engine is started for plugin and applications, but without cherrypy HTTP server
+        cherrypy.server.unsubscribe()
+        SocketThread.run(self)
+        self.server = EventedServer(self.host, self.port, cherrypy.tree, {
+            '/ws': lambda *args: EventedChatSocket(self.compression, 'chat', *args),
+            '/gui/ws': lambda *args: EventedChatSocket(self.compression, 'gui', *args)
+        })
+        self.server.serve_forever()
+
+
 def socket_open(host, port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(2)
@@ -531,33 +967,97 @@ class webchat(MessagingModule):
         self.s_thread = None
         self.queue = None
         self.message_threads = []
+        self._deliver_lock = threading.Lock()
+        self.history = MessageHistory(conf_params['history']['size'], conf_params['history']['max_age'])
+        self.relay_hub = RelayHub(conf_params['relay']['log_size'])
+        self.relay_client = None
+        # ETag -> {(since, limit[, 'gzip']): (reset, body)}, ETag changes with history version and style revision
+        self._history_cache = {}
+        self._history_cache_tag = None
+        self._history_cache_lock = threading.Lock()
+        # History version starts from 0 on every start, so ETag has to be unique for the process
+        self._history_epoch = '{:x}'.format(int(time.time()))
 
         # Rest Api Settings
         self.rest_add('GET', 'style', self.rest_get_style_settings)
         self.rest_add('GET', 'style_gui', self.rest_get_style_settings)
         self.rest_add('GET', 'history', self.rest_get_history)
         self.rest_add('DELETE', 'chat', self.rest_delete_history)
+        self.rest_add('GET', 'clients', self.rest_get_clients)
+        self.rest_add('GET', 'batching', self.rest_get_batching)
+        self.rest_add('GET', 'relay', self.rest_get_relay)
 
     def load_module(self, *args, **kwargs):
         MessagingModule.load_module(self, *args, **kwargs)
         self.queue = kwargs.get('queue')
+        # Store writer thread is started here and not in __init__,
+        #  messaging offload pool is forked after modules are constructed
+        if self._conf_params['config']['history']['persist']:
+            self.open_store(restore=True)
         self.start_webserver()
 
     def start_webserver(self):
         host = self._conf_params['host']
         port = self._conf_params['port']
         if socket_open(host, port):
-            self.s_thread = SocketThread(host, port, CONF_FOLDER,
+            if self._conf_params['config']['server'].get('backend') == BACKEND_EVENTED:
+                thread_class = EventedSocketThread
+            else:
+                thread_class = SocketThread
+            self.s_thread = thread_class(host, port, CONF_FOLDER,
                                          style_settings=self._conf_params['style_settings'],
-                                         modules=self._loaded_modules)
+                                         modules=self._loaded_modules,
+                                         history=self.history,
+                                         client_settings=self._conf_params['config']['clients'],
+                                         compression=self._conf_params['config']['compression'],
+                                         relay=self.relay_hub)
             self.s_thread.start()
 
-            for thread in range(WS_THREADS):
-                self.message_threads.append(MessagingThread(self._conf_params['style_settings']))
-                self.message_threads[thread].start()
+            # One sender keeps pipeline order, sending only queues frames for the clients
+            self.message_threads.append(MessagingThread(self._conf_params['style_settings'],
+                                                        self.s_thread.websocket))
+            self.message_threads[0].start()
+
+            upstream = self._conf_params['config']['relay']['upstream']
+            if upstream:
+                self.relay_client = RelayClient(upstream, self.relay_reset, self.relay_message)
+                self.relay_client.start()
         else:
             log.error("Port is already used, please change webchat port")
 
+    def relay_message(self, payload):
+        self.deliver([RelayedMessage(payload)])
+
+    def relay_reset(self, payloads):
+        self.history.replace([RelayedMessage(payload) for payload in payloads])
+        self.relay_hub.reset(self.s_thread.websocket.relay_snapshot)
+        # Clients reconnect and get new history
+        s_queue.put(CommandMessage('reload'))
+
+    def open_store(self, restore=False):
+        """
+        :param restore: load stored messages to history, otherwise current history is stored
+        """
+        store = HistoryStore(HISTORY_STORE_FILE, self.history.size, self.history.max_age)
+        try:
+            if restore:
+                messages = store.load(self.history.size, self.history.max_age)
+                self.history.restore(messages)
+                log.info("Loaded %s messages from history store", len(messages))
+            else:
+                for message in self.history.snapshot():
+                    store.add(message)
+        except sqlite3.Error as exc:
+            log.error("Unable to open history store: %s", exc)
+            return
+        store.start()
+        self.history.store = store
+
+    def close_store(self):
+        store, self.history.store = self.history.store, None
+        if store:
+            store.stop()
+
     @staticmethod
     def get_style_path(style):
         path = os.path.abspath(os.path.join(HTTP_FOLDER, style))
@@ -577,16 +1077,27 @@ class webchat(MessagingModule):
     def apply_settings(self, **kwargs):
         save_settings(self.conf_params(), ignored_sections=self._conf_params['gui'].get('ignored_sections', ()))
         if 'system_exit' in kwargs:
+            if self.relay_client:
+                self.relay_client.stop()
+            self.close_store()
             return
 
         style_changed = False
+        history_config = self._conf_params['config']['history']
+        self.history.resize(history_config['size'], history_config['max_age'])
+        if history_config['persist'] and not self.history.store:
+            self.open_store()
+        elif not history_config['persist'] and self.history.store:
+            self.close_store()
+        self.relay_hub.resize(self._conf_params['config']['relay']['log_size'])
+        if self.s_thread:
+            self.s_thread.websocket.configure_clients()
 
         chat_style = self._conf_params['config']['style']
         gui_style = self._conf_params['config']['style_gui']
         style_config = self._conf_params['style_settings']
 
         self.update_style_settings(chat_style, gui_style)
-        self.reload_chat()
 
         if chat_style != style_config['chat']['style_name']:
             log.info("changing chat style")
@@ -604,6 +1115,11 @@ class webchat(MessagingModule):
             self.s_thread.update_settings()
             self.s_thread.mount_dirs()
 
+        # Cached message frames are keyed by revision, so it's bumped after all new settings are in place
+        for style_type in ('chat', 'gui'):
+            style_config[style_type]['revision'] = style_config[style_type].get('revision', 0) + 1
+        self.reload_chat()
+
         if self._conf_params['dependencies']:
             for module in self._conf_params['dependencies']:
                 self._loaded_modules[module]['class'].apply_settings(from_depend='webchat')
@@ -616,27 +1132,110 @@ class webchat(MessagingModule):
         event.Skip()
 
     def process_message(self, message, **kwargs):
-        if not hasattr(message, 'hidden'):
-            s_queue.put(message)
+        if not message.get_extension('hidden'):
+            self.deliver([message])
         return message
 
+    def process_batch(self, messages, queue=None):
+        visible = [message for message in messages if message and not message.get_extension('hidden')]
+        if visible:
+            self.deliver(visible)
+        return messages
+
+    def deliver(self, messages):
+        """
+            Records messages and queues them for sending under one lock,
+              so history, relay sequence and delivery order are the same.
+              Handler threads keep channel order up to here
+        """
+        with self._deliver_lock:
+            for message in messages:
+                self.record(message)
+            s_queue.put(messages)
+
+    def record(self, message):
+        # History is changed here, in pipeline order, messaging thread only sends
+        if self.s_thread:
+            self.s_thread.websocket.record(message)
+
     def rest_get_style_settings(self, *args):
         return json.dumps(self._conf_params['style_settings'][args[0][0]]['keys'])
 
     def rest_get_history(self, *args, **kwargs):
-        return json.dumps(
-            [prepare_message(
-                message.json(),
-                self.style_settings['chat'],
-                type(message))
-                for message in cherrypy.engine.publish('get-history')[0]]
-        )
-
-    @staticmethod
-    def rest_delete_history(path, **kwargs):
-        cherrypy.engine.publish('del-history', path)
-        cherrypy.engine.publish('websocket-broadcast',
-                                RemoveMessageByID(list(path)).json())
+        """
+            Query parameters:
+              since - message id, only newer messages are returned
+              limit - maximum amount of messages
+            If since is not in history anymore newest messages are returned
+              with X-History-Reset: true header, client should replace its history with them
+        """
+        since = kwargs.get('since') or None
+        try:
+            limit = max(int(kwargs.get('limit', 0)), 0)
+        except ValueError:
+            raise RestApiException('limit should be a number')
+
+        tag = '{}-{}-{}'.format(self._history_epoch, self.history.version,
+                                self.style_settings['chat'].get('revision', 0))
+        reset, body = self._get_cached_history(tag, (since, limit), lambda: self.encode_history(since, limit))
+        if reset:
+            cherrypy.serving.response.headers['X-History-Reset'] = 'true'
+        compression = self._conf_params['config']['compression']
+        gzipped = wants_gzip(body, compression)
+        # Encodings of the same history are different representations, so they need different ETags
+        if etag_matches('"{}{}"'.format(tag, '-gzip' if gzipped else '')):
+            return ''
+        if gzipped:
+            return self._get_cached_history(tag, (since, limit, 'gzip'),
+                                            lambda: (reset, gzip_body(body, compression['level'])))[1]
+        return body
+
+    def _get_cached_history(self, etag, key, build):
+        with self._history_cache_lock:
+            if etag != self._history_cache_tag:
+                self._history_cache = {}
+                self._history_cache_tag = etag
+            if key not in self._history_cache:
+                if len(self._history_cache) >= HISTORY_CACHE_SIZE:
+                    self._history_cache.clear()
+                self._history_cache[key] = build()
+            return self._history_cache[key]
+
+    def encode_history(self, since=None, limit=0):
+        """
+        :return: (reset, body), reset is True when since is unknown and newest messages are returned
+        """
+        messages = self.history.after(since, limit)
+        reset = messages is None
+        if reset:
+            messages = self.history.after(None, limit)
+        # Messages are already encoded, so list is joined instead of dumped again
+        return reset, '[{}]'.format(','.join(
+            encode_message(message, self.style_settings['chat'], 'chat') for message in messages))
+
+    def rest_get_clients(self, *args, **kwargs):
+        if not self.s_thread:
+            return json.dumps([])
+        return json.dumps(self.s_thread.websocket.client_stats())
+
+    def rest_get_batching(self, *args, **kwargs):
+        if not self.s_thread or not self.s_thread.websocket.batcher:
+            return json.dumps({})
+        return json.dumps(self.s_thread.websocket.batcher.json())
+
+    def rest_get_relay(self, *args, **kwargs):
+        return json.dumps({'hub': self.relay_hub.json(),
+                           'upstream': self.relay_client.json() if self.relay_client else None})
+
+    def rest_delete_history(self, path, **kwargs):
+        # Command with text is remove_by_id, message is removed from overlays, history and relays
+        command = RemoveMessageByID(list(path), text=REMOVED_TRIGGER)
+        payload = encode_message(command, self.style_settings['chat'], 'chat')
+        if self.relay_hub.enabled:
+            self.relay_hub.publish(payload, lambda: cherrypy.engine.publish('del-history', path))
+        else:
+            cherrypy.engine.publish('del-history', path)
+        cherrypy.engine.publish('websocket-broadcast', payload)
 
     def get_style_from_file(self, style_name):
         file_path = os.path.join(self.get_style_path(style_name), 'settings.json')
@@ -705,7 +1304,26 @@ class webchat(MessagingModule):
                 'view': 'choose_single'
             },
             'style_settings': {},
-            'non_dynamic': ['server.*'],
+            'history': {
+                'size': {'view': 'spin', 'min': 1, 'max': 100000},
+                'max_age': {'view': 'spin', 'min': 0, 'max': 86400}
+            },
+            'clients': {
+                'queue_size': {'view': 'spin', 'min': 1, 'max': 100000},
+                'slow_policy': {'view': 'dropdown', 'choices': SEND_POLICIES},
+                'batch_tick': {'view': 'spin', 'min': BATCH_TICK_MIN, 'max': BATCH_TICK_MAX}
+            },
+            'compression': {
+                'level': {'view': 'spin', 'min': 1, 'max': 9},
+                'threshold': {'view': 'spin', 'min': 0, 'max': 1048576}
+            },
+            'server': {
+                'backend': {'view': 'dropdown', 'choices': BACKENDS}
+            },
+            'relay': {
+                'log_size': {'view': 'spin', 'min': 0, 'max': 100000}
+            },
+            'non_dynamic': ['server.*', 'relay.upstream'],
             'ignored_sections': ['style_settings', 'style_gui_settings'],
             'redraw': {
                 'style_settings': {
@@ -23,7 +23,10 @@ a = Analysis(['main.py'],
                             'requests',
                             'irc',
                             'ConfigParser',
+                            'modules.chat.beampro',
+                            'modules.chat.firehose',
                             'modules.chat.goodgame',
+                            'modules.chat.hitbox',
                             'modules.chat.sc2tv',
                             'modules.chat.twitch',
                             'modules.helper.parser',
@@ -0,0 +1,146 @@
+"""
+    Measures webchat delivery with many websocket clients, run against both server backends:
+
+      python src/scripts/webchat_bench.py --clients 1000 --messages 50 --chat twitch
+
+    Chat module has to be in test mode, messages are pushed with POST /rest/<chat>/push_message
+"""
+import argparse
+import base64
+import json
+import os
+import select
+import socket
+import time
+import urllib2
+
+MARKER = 'webchat-bench'
+# Webchat sends history to new clients after a short delay,
+#  messages pushed before that would be received twice
+HISTORY_WAIT = 1
+
+
+def connect(host, port, path):
+    sock = socket.create_connection((host, port))
+    sock.sendall('GET {} HTTP/1.1\r\nHost: {}:{}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n'.format(
+                     path, host, port, base64.b64encode(os.urandom(16))))
+    response = ''
+    while '\r\n\r\n' not in response:
+        data = sock.recv(1)
+        if not data:
+            raise socket.error('Connection closed during handshake')
+        response += data
+    if not response.startswith('HTTP/1.1 101'):
+        raise socket.error(response.split('\r\n')[0])
+    sock.setblocking(False)
+    return sock
+
+
+def read_frames(buf):
+    """
+        Parses unmasked server frames from the buffer
+    :return: (list of payloads, rest of buffer)
+    """
+    payloads = []
+    while len(buf) >= 2:
+        length = ord(buf[1]) & 0x7f
+        offset = 2
+        if length == 126:
+            length, offset = int(buf[2:4].encode('hex') or '0', 16), 4
+        elif length == 127:
+            length, offset = int(buf[2:10].encode('hex') or '0', 16), 10
+        if len(buf) < offset + length:
+            break
+        payloads.append(buf[offset:offset + length])
+        buf = buf[offset + length:]
+    return payloads, buf
+
+
+def push(host, port, chat, text):
+    request = urllib2.Request('http://{}:{}/rest/{}/push_message'.format(host, port, chat),
+                              json.dumps({'nickname': 'bench', 'text': text}),
+                              {'Content-Type': 'application/json'})
+    urllib2.urlopen(request).read()
+
+
+def get_poller(clients):
+    """
+        select is limited to 1024 sockets, epoll is used where available
+    :return: function(timeout) returning readable descriptors
+    """
+    if hasattr(select, 'epoll'):
+        epoll = select.epoll()
+        for fd in clients:
+            epoll.register(fd, select.EPOLLIN)
+        return lambda timeout: [fd for fd, _ in epoll.poll(timeout)]
+    return lambda timeout: select.select(clients.keys(), [], [], timeout)[0]
+
+
+def percentile(values, part):
+    return values[min(int(len(values) * part), len(values) - 1)] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webchat delivery benchmark')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--path', default='/ws')
+    parser.add_argument('--chat', default='twitch')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    clients = {}
+    failed = 0
+    for _ in range(args.clients):
+        try:
+            sock = connect(args.host, args.port, args.path)
+            clients[sock.fileno()] = [sock, '']
+        except socket.error as exc:
+            failed += 1
+            print('Unable to connect: {}'.format(exc))
+    print('Connected {} clients, {} failed'.format(len(clients), failed))
+    time.sleep(HISTORY_WAIT)
+
+    poll = get_poller(clients)
+    sent = {}
+    latencies = []
+    next_push = 0
+    deadline = None
+    while True:
+        now = time.time()
+        if len(sent) < args.messages and now >= next_push:
+            marker = '{}-{}.'.format(MARKER, len(sent))
+            sent[marker] = now
+            push(args.host, args.port, args.chat, marker)
+            next_push = now + args.interval
+            if len(sent) == args.messages:
+                deadline = now + 5
+        if deadline and (now > deadline or len(latencies) >= args.messages * len(clients)):
+            break
+        readable = poll(0.01)
+        received_at = time.time()
+        for fd in readable:
+            client = clients[fd]
+            try:
+                data = client[0].recv(65536)
+            except socket.error:
+                continue
+            payloads, client[1] = read_frames(client[1] + data)
+            for payload in payloads:
+                for marker, pushed_at in sent.items():
+                    if marker in payload:
+                        latencies.append(received_at - pushed_at)
+                        break
+
+    latencies.sort()
+    expected = args.messages * len(clients)
+    print('Delivered {} of {} messages'.format(len(latencies), expected))
+    print('Latency ms: p50 {:.2f} p90 {:.2f} p99 {:.2f} max {:.2f}'.format(
+        *[percentile(latencies, part) * 1000 for part in (0.5, 0.9, 0.99, 1.0)]))
+
+
+if __name__ == '__main__':
+    main()
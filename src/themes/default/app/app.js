@@ -122,7 +122,7 @@ const DOMPurify = require('dompurify');
             },
             replaceByIds: function (command) {
                 this.messages = this.messages.map(function (message) {
-                    var index = command.ids.indexOf(message.id);
+                    var index = command.message_ids.indexOf(message.id);
 
                     if (index >= 0) {
                         message.text = command.text;
@@ -144,7 +144,7 @@ const DOMPurify = require('dompurify');
                         this.removeByUsernames(message.user);
                         break;
                     case 'remove_by_id':
-                        this.removeByIds(message.ids);
+                        this.removeByIds(message.message_ids);
                         break;
                     case 'replace_by_id':
                         this.replaceByIds(message);
@@ -157,7 +157,15 @@ const DOMPurify = require('dompurify');
                 }
             },
             onmessage: function (event) {
-                var message = JSON.parse(event.data);
+                var data = JSON.parse(event.data);
+                // Batched connections (?batch=1) get arrays of messages
+                if (Array.isArray(data)) {
+                    data.forEach(this.dispatch);
+                } else {
+                    this.dispatch(data);
+                }
+            },
+            dispatch: function (message) {
                 if (!message.type)
                     return;
 
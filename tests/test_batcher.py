@@ -0,0 +1,87 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+import time
+import unittest
+
+from modules.helper.batcher import TickBatcher, BATCH_TICK_MIN, BATCH_TICK_MAX
+from tests.test_messaging import wait_for
+
+
+class RecordingFlush(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []
+
+    def __call__(self, key, items):
+        with self.lock:
+            self.batches.append((key, list(items), time.time()))
+
+
+class TickBatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.flush = RecordingFlush()
+        self.batcher = None
+
+    def tearDown(self):
+        if self.batcher:
+            self.batcher.stop()
+
+    def start(self, tick=BATCH_TICK_MAX):
+        self.batcher = TickBatcher(self.flush, tick=tick)
+        self.batcher.start()
+        return self.batcher
+
+    def test_tick_is_clamped(self):
+        self.assertEqual(TickBatcher(self.flush, tick=1).tick, BATCH_TICK_MIN)
+        self.assertEqual(TickBatcher(self.flush, tick=1000).tick, BATCH_TICK_MAX)
+
+    def test_items_are_flushed_together_per_key(self):
+        batcher = self.start()
+        # Batcher sleeps for the tick, items added right after start end up in the first flush
+        for index in range(5):
+            batcher.add('chat', index)
+        batcher.add('gui', 'gui')
+
+        self.assertTrue(wait_for(lambda: len(self.flush.batches) == 2))
+        self.assertEqual(sorted((key, items) for key, items, _ in self.flush.batches),
+                         [('chat', [0, 1, 2, 3, 4]), ('gui', ['gui'])])
+        self.assertTrue(wait_for(lambda: batcher.json()['size']['count'] == 2))
+
+    def test_flush_waits_for_tick(self):
+        batcher = self.start()
+        time.sleep(BATCH_TICK_MAX / 2000.0)
+        added = time.time()
+        batcher.add('chat', 'message')
+        self.assertEqual(self.flush.batches, [])
+
+        self.assertTrue(wait_for(lambda: self.flush.batches))
+        flushed = self.flush.batches[0][2] - added
+        self.assertLessEqual(flushed, BATCH_TICK_MAX * 4 / 1000.0)
+        self.assertEqual(len(self.flush.batches), 1)
+        self.assertEqual(batcher.json()['tick'], BATCH_TICK_MAX)
+
+    def test_next_tick_starts_new_batch(self):
+        batcher = self.start(BATCH_TICK_MIN)
+        batcher.add('chat', 1)
+        self.assertTrue(wait_for(lambda: self.flush.batches))
+        batcher.add('chat', 2)
+        self.assertTrue(wait_for(lambda: len(self.flush.batches) == 2))
+        self.assertEqual([items for _, items, _ in self.flush.batches], [[1], [2]])
+
+    def test_failed_flush_keeps_batcher_running(self):
+        def flush(key, items):
+            self.flush(key, items)
+            if items == ['bad']:
+                raise ValueError(key)
+
+        self.batcher = TickBatcher(flush, tick=BATCH_TICK_MIN)
+        self.batcher.start()
+        self.batcher.add('chat', 'bad')
+        self.assertTrue(wait_for(lambda: self.flush.batches))
+        self.batcher.add('chat', 'good')
+        self.assertTrue(wait_for(lambda: len(self.flush.batches) == 2))
+        self.assertTrue(self.batcher.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import unittest
+
+from modules.helper.bulk import push_bulk
+from modules.helper.system import RestApiException
+from tests.test_messaging import RecordingModule, start_pipeline, text_message
+
+
+class PushBulkTest(unittest.TestCase):
+    def test_waits_until_messages_are_processed(self):
+        module = RecordingModule(delay=0.001)
+        pipeline = start_pipeline(module, 2)
+        push = lambda data: pipeline.queue.put(text_message('tw', data['channel'], data['text']))
+        messages = [{'channel': 'channel_{}'.format(index % 4), 'text': str(index)} for index in range(100)]
+        stats = json.loads(push_bulk(push, [pipeline.queue], messages=messages, drain=5))
+        self.assertEqual(stats['pushed'], 100)
+        self.assertEqual(len(module.processed), 100)
+        self.assertTrue(stats['processed'] >= stats['elapsed'])
+        self.assertTrue(stats['pipeline_rate'] > 0)
+
+    def test_failed_messages(self):
+        def push(data):
+            if 'text' not in data:
+                raise KeyError('text')
+        stats = json.loads(push_bulk(push, messages=[{'text': '1'}, {}]))
+        self.assertEqual((stats['pushed'], stats['failed'], stats['processed']), (1, 1, None))
+        self.assertEqual(len(stats['errors']), 1)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(RestApiException, push_bulk, None, messages='text')
+        self.assertRaises(RestApiException, push_bulk, None, messages=[], rate=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import struct
+import zlib
+import unittest
+
+from modules.helper.compression import (negotiate_deflate, deflate_frame, gzip_body,
+                                        DEFLATE_RESPONSE, DEFLATE_TAIL)
+
+
+class NegotiateDeflateTest(unittest.TestCase):
+    def test_plain_offer(self):
+        self.assertEqual(negotiate_deflate('permessage-deflate'), DEFLATE_RESPONSE)
+        self.assertEqual(negotiate_deflate('permessage-deflate; client_max_window_bits'), DEFLATE_RESPONSE)
+        self.assertEqual(negotiate_deflate('permessage-deflate; client_no_context_takeover'), DEFLATE_RESPONSE)
+
+    def test_no_offer(self):
+        self.assertEqual(negotiate_deflate(None), None)
+        self.assertEqual(negotiate_deflate(''), None)
+        self.assertEqual(negotiate_deflate('x-webkit-deflate-frame'), None)
+
+    def test_full_server_window_is_echoed(self):
+        self.assertEqual(negotiate_deflate('permessage-deflate; server_max_window_bits=15'),
+                         DEFLATE_RESPONSE + '; server_max_window_bits=15')
+        self.assertEqual(negotiate_deflate('permessage-deflate; server_max_window_bits="15"'),
+                         DEFLATE_RESPONSE + '; server_max_window_bits=15')
+
+    def test_limited_server_window_falls_back_to_next_offer(self):
+        self.assertEqual(negotiate_deflate('permessage-deflate; server_max_window_bits=10'), None)
+        self.assertEqual(negotiate_deflate('permessage-deflate; server_max_window_bits=10, permessage-deflate'),
+                         DEFLATE_RESPONSE)
+
+    def test_invalid_offers_are_declined(self):
+        for offer in ('permessage-deflate; unknown',
+                      'permessage-deflate; server_no_context_takeover; server_no_context_takeover',
+                      'permessage-deflate; server_no_context_takeover=1',
+                      'permessage-deflate; server_max_window_bits',
+                      'permessage-deflate; server_max_window_bits=16',
+                      'permessage-deflate; client_max_window_bits=7'):
+            self.assertEqual(negotiate_deflate(offer), None, offer)
+
+
+class CompressTest(unittest.TestCase):
+    payload = u'{"type": "message", "text": "' + u'\u043b\u0430\u043b\u043a\u0430 ' * 100 + u'"}'
+
+    def test_deflate_frame_is_independent(self):
+        data = deflate_frame(self.payload)
+        # fin, rsv1 and text opcode, unmasked short body
+        self.assertEqual(data[:2], struct.pack('!BB', 0xc1, len(data) - 2))
+        body = zlib.decompressobj(-zlib.MAX_WBITS).decompress(data[2:] + DEFLATE_TAIL)
+        self.assertEqual(body.decode('utf-8'), self.payload)
+        self.assertEqual(deflate_frame(self.payload), data)
+
+    def test_gzip_body(self):
+        body = zlib.decompress(gzip_body(self.payload), 16 + zlib.MAX_WBITS)
+        self.assertEqual(body.decode('utf-8'), self.payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
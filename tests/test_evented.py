@@ -0,0 +1,267 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import base64
+import hashlib
+import os
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from ws4py.framing import Frame, OPCODE_TEXT, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+
+from modules.helper.evented import (EventedServer, EventedWebSocket, build_environ, parse_frame, build_frame,
+                                    WS_KEY, MAX_FRAME_SIZE)
+from tests.test_messaging import wait_for
+
+
+class FakeServer(object):
+    host = '127.0.0.1'
+    port = 8080
+
+
+def client_frame(opcode, payload):
+    return Frame(opcode=opcode, body=payload, fin=1, masking_key=os.urandom(4)).build()
+
+
+class Reader(object):
+    def __init__(self, sock):
+        """
+            Reads responses and server frames, data after them is kept for the next read
+        """
+        self.sock = sock
+        self.data = b''
+
+    def _read(self):
+        chunk = self.sock.recv(4096)
+        self.data += chunk
+        return chunk
+
+    def response(self):
+        """
+        :return: (head, body) of one response, body is read by Content-Length
+        """
+        while b'\r\n\r\n' not in self.data:
+            if not self._read():
+                break
+        head, _, self.data = self.data.partition(b'\r\n\r\n')
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.lower() == b'content-length':
+                length = int(value)
+        while len(self.data) < length and self._read():
+            pass
+        body, self.data = self.data[:length], self.data[length:]
+        return head, body
+
+    def frame(self):
+        """
+        :return: (opcode, payload), (None, None) if connection is closed
+        """
+        while True:
+            frame = parse_frame(self.data)
+            if frame:
+                opcode, payload, consumed = frame
+                self.data = self.data[consumed:]
+                return opcode, payload
+            if not self._read():
+                return None, None
+
+    def closed(self):
+        return not self.data and self.sock.recv(4096) == b''
+
+
+class ParserTest(unittest.TestCase):
+    def test_environ(self):
+        head = (b'POST /rest/chat%20name/push?a=1&b=2 HTTP/1.1\r\n'
+                b'Host: localhost\r\n'
+                b'Content-Type: application/json\r\n'
+                b'Content-Length: 12\r\n'
+                b'X-Forwarded-For: 10.0.0.1\r\n'
+                b'X-Forwarded-For: 10.0.0.2')
+        environ = build_environ(head, FakeServer(), ('127.0.0.1', 5000))
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/rest/chat name/push')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1&b=2')
+        self.assertEqual(environ['SERVER_PROTOCOL'], 'HTTP/1.1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['CONTENT_LENGTH'], '12')
+        self.assertEqual(environ['HTTP_HOST'], 'localhost')
+        self.assertEqual(environ['HTTP_X_FORWARDED_FOR'], '10.0.0.1,10.0.0.2')
+        self.assertEqual(environ['REMOTE_PORT'], '5000')
+
+    def test_malformed_request_line(self):
+        self.assertRaises(ValueError, build_environ, b'GARBAGE', FakeServer(), ('127.0.0.1', 5000))
+
+    def test_masked_frame(self):
+        data = client_frame(OPCODE_TEXT, b'hello')
+        self.assertEqual(parse_frame(data + b'next'), (OPCODE_TEXT, b'hello', len(data)))
+
+    def test_extended_length(self):
+        payload = b'x' * 300
+        data = client_frame(OPCODE_TEXT, payload)
+        self.assertEqual(parse_frame(data), (OPCODE_TEXT, payload, len(data)))
+
+    def test_partial_frame(self):
+        data = client_frame(OPCODE_TEXT, b'x' * 300)
+        for size in (0, 1, 3, 7, len(data) - 1):
+            self.assertEqual(parse_frame(data[:size]), None)
+
+    def test_too_big_frame(self):
+        data = b'\x81\xff' + struct.pack('!Q', MAX_FRAME_SIZE + 1)
+        self.assertRaises(ValueError, parse_frame, data)
+
+    def test_server_frame(self):
+        self.assertEqual(parse_frame(build_frame(OPCODE_PONG, b'pong')), (OPCODE_PONG, b'pong', 6))
+
+
+class RecordingWebSocket(EventedWebSocket):
+    def __init__(self, server, sock, peer_address, environ):
+        EventedWebSocket.__init__(self, server, sock, peer_address, environ)
+        self.messages = []
+        self.is_closed = threading.Event()
+        server.websockets.append(self)
+
+    def handshake_headers(self):
+        return [('X-Test', 'yes')]
+
+    def received(self, opcode, payload):
+        self.messages.append((opcode, payload))
+
+    def on_close(self):
+        self.is_closed.set()
+
+
+class EventedServerTest(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.server = EventedServer('127.0.0.1', 0, self.app, {'/ws': RecordingWebSocket}, workers=2)
+        self.server.websockets = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.assertTrue(wait_for(lambda: self.server.running))
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.server.stop()
+        self.thread.join(5)
+
+    def app(self, environ, start_response):
+        body = environ['wsgi.input'].read()
+        self.requests.append((environ['REQUEST_METHOD'], environ['PATH_INFO'], body))
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Connection', 'close')])
+        return [u'{} {}'.format(environ['PATH_INFO'], body)]
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.port), 5)
+        self.sockets.append(sock)
+        return sock, Reader(sock)
+
+    def upgrade(self, version='13'):
+        sock, reader = self.connect()
+        key = base64.b64encode(os.urandom(16))
+        sock.sendall(b'GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Key: ' + key + b'\r\nSec-WebSocket-Version: ' + version + b'\r\n\r\n')
+        return sock, reader, key
+
+    def test_request(self):
+        sock, reader = self.connect()
+        sock.sendall(b'POST /echo HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nhello')
+        head, body = reader.response()
+        self.assertTrue(head.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'Connection: keep-alive', head)
+        self.assertEqual(body, b'/echo hello')
+
+    def test_keep_alive_and_pipelining(self):
+        sock, reader = self.connect()
+        sock.sendall(b'GET /first HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'POST /second HTTP/1.1\r\nHost: localhost\r\nContent-Length: 2\r\n\r\nok')
+        self.assertEqual(reader.response()[1], b'/first ')
+        self.assertEqual(reader.response()[1], b'/second ok')
+        sock.sendall(b'GET /third HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        head, body = reader.response()
+        self.assertIn(b'Connection: close', head)
+        self.assertEqual(body, b'/third ')
+        self.assertTrue(reader.closed())
+
+    def test_http_10_is_closed(self):
+        sock, reader = self.connect()
+        sock.sendall(b'GET /old HTTP/1.0\r\n\r\n')
+        head, body = reader.response()
+        self.assertIn(b'Connection: close', head)
+        self.assertTrue(reader.closed())
+
+    def test_partial_reads(self):
+        sock, reader = self.connect()
+        request = b'POST /slow HTTP/1.1\r\nHost: localhost\r\nContent-Length: 10\r\n\r\n0123456789'
+        for index in range(0, len(request), 7):
+            sock.sendall(request[index:index + 7])
+            time.sleep(0.005)
+        self.assertEqual(reader.response()[1], b'/slow 0123456789')
+        self.assertEqual(self.requests, [('POST', '/slow', b'0123456789')])
+
+    def test_malformed_request_is_closed(self):
+        sock, reader = self.connect()
+        sock.sendall(b'GARBAGE\r\n\r\n')
+        head, _ = reader.response()
+        self.assertTrue(head.startswith(b'HTTP/1.1 400'))
+        self.assertTrue(reader.closed())
+        self.assertEqual(self.requests, [])
+
+    def test_bad_content_length_is_closed(self):
+        sock, reader = self.connect()
+        sock.sendall(b'POST / HTTP/1.1\r\nContent-Length: ten\r\n\r\n')
+        head, _ = reader.response()
+        self.assertTrue(head.startswith(b'HTTP/1.1 400'))
+        self.assertTrue(reader.closed())
+
+    def test_websocket_upgrade(self):
+        sock, reader, key = self.upgrade()
+        head, _ = reader.response()
+        self.assertTrue(head.startswith(b'HTTP/1.1 101'))
+        self.assertIn(b'Sec-WebSocket-Accept: ' + base64.b64encode(hashlib.sha1(key + WS_KEY).digest()), head)
+        self.assertIn(b'X-Test: yes', head)
+
+        self.assertTrue(wait_for(lambda: self.server.websockets))
+        websocket = self.server.websockets[0]
+        websocket.send_frame(build_frame(OPCODE_TEXT, b'from server'))
+        opcode, payload = reader.frame()
+        self.assertEqual((opcode, payload), (OPCODE_TEXT, b'from server'))
+
+        # Client frame split between reads
+        data = client_frame(OPCODE_TEXT, b'from client')
+        sock.sendall(data[:3])
+        time.sleep(0.02)
+        sock.sendall(data[3:] + client_frame(OPCODE_PING, b'ping'))
+        opcode, payload = reader.frame()
+        self.assertEqual((opcode, payload), (OPCODE_PONG, b'ping'))
+        self.assertEqual(websocket.messages, [(OPCODE_TEXT, b'from client')])
+
+        sock.sendall(client_frame(OPCODE_CLOSE, struct.pack('!H', 1000)))
+        opcode, payload = reader.frame()
+        self.assertEqual((opcode, payload), (OPCODE_CLOSE, struct.pack('!H', 1000)))
+        self.assertTrue(websocket.is_closed.wait(5))
+        self.assertTrue(reader.closed())
+
+    def test_websocket_bad_version(self):
+        sock, reader, _ = self.upgrade('8')
+        head, _ = reader.response()
+        self.assertTrue(head.startswith(b'HTTP/1.1 400'))
+        self.assertIn(b'Sec-WebSocket-Version: 13', head)
+        self.assertEqual(self.server.websockets, [])
+
+    def test_too_big_frame_is_closed(self):
+        sock, reader, _ = self.upgrade()
+        reader.response()
+        sock.sendall(b'\x81\xff' + struct.pack('!Q', MAX_FRAME_SIZE + 1) + os.urandom(4))
+        opcode, payload = reader.frame()
+        self.assertEqual((opcode, payload), (OPCODE_CLOSE, struct.pack('!H', 1009)))
+        self.assertTrue(reader.closed())
+
+
+if __name__ == '__main__':
+    unittest.main()
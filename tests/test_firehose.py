@@ -0,0 +1,43 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import unittest
+
+from modules.chat.firehose import FirehoseThread, GENERATOR_KEYS, COMMANDS, SOURCE
+from modules.helper.message import CommandMessage
+
+
+class FirehoseCommandTest(unittest.TestCase):
+    def setUp(self):
+        settings = dict.fromkeys(GENERATOR_KEYS, 10)
+        settings['command_percent'] = 0
+        self.generator = FirehoseThread(None, settings)
+        self.generator.random.seed(1)
+        self.messages = [self.generator.generate() for _ in range(20)]
+
+    def test_commands_target_channel_of_message(self):
+        self.generator.settings['command_percent'] = 100
+        commands = [self.generator.generate() for _ in range(200)]
+        recent = dict((message.id, message) for message in self.messages)
+        users = dict((message.user, message) for message in self.messages)
+        for command in commands:
+            self.assertTrue(isinstance(command, CommandMessage))
+            self.assertEqual(command.source, SOURCE)
+            if command.command.endswith('by_id'):
+                target = recent[command.message_ids[0]]
+                self.assertEqual(command.channel_name, target.channel_name)
+            else:
+                self.assertTrue(command.user[0] in users)
+                self.assertTrue(command.channel_name.startswith('channel_'))
+
+    def test_all_commands_are_sent(self):
+        self.generator.settings['command_percent'] = 100
+        commands = [self.generator.generate() for _ in range(200)]
+        self.assertEqual(set(command.command for command in commands), set(COMMANDS))
+        sent = self.generator.stats()['sent']
+        self.assertEqual(sent['message'], len(self.messages))
+        for command_type in COMMANDS:
+            self.assertEqual(sent[command_type], len([command for command in commands
+                                                      if command.command == command_type]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import time
+import unittest
+
+from modules.helper.history import MessageHistory
+from modules.helper.message import TextMessage
+
+
+def history_message(index):
+    return TextMessage('tw', None, 'user_{}'.format(index % 3), str(index), mid='tw_{}'.format(index))
+
+
+class HistoryCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.history = MessageHistory(5)
+        self.messages = [history_message(index) for index in range(8)]
+        for message in self.messages:
+            self.history.add(message)
+
+    def test_without_cursor(self):
+        self.assertEqual(self.history.after(), self.messages[3:])
+        self.assertEqual(self.history.after(limit=2), self.messages[6:])
+
+    def test_after_known_id(self):
+        self.assertEqual(self.history.after('tw_4'), self.messages[5:])
+        self.assertEqual(self.history.after('tw_4', 2), self.messages[5:7])
+        self.assertEqual(self.history.after('tw_7'), [])
+
+    def test_unknown_id_is_reset(self):
+        self.assertEqual(self.history.after('tw_1'), None)
+        self.history.remove(lambda message: message.id == 'tw_5')
+        self.assertEqual(self.history.after('tw_5'), None)
+
+    def test_version_changes(self):
+        version = self.history.version
+        self.history.touch()
+        self.assertNotEqual(self.history.version, version)
+
+
+class HistoryAgeTest(unittest.TestCase):
+    def aged_message(self, index, age):
+        message = history_message(index)
+        message._created = time.time() - age
+        return message
+
+    def test_out_of_order_messages_are_evicted(self):
+        history = MessageHistory(10, max_age=60)
+        fresh = self.aged_message(0, 0)
+        history.add(fresh)
+        # Delayed message is older than the one added before it
+        history.add(self.aged_message(1, 30))
+        history.add(self.aged_message(2, 120))
+        self.assertEqual([message.id for message in history.snapshot()], ['tw_0', 'tw_1'])
+        self.assertEqual([message.id for message in history.snapshot(max_age=10)], ['tw_0'])
+
+    def test_expired_message_in_the_middle(self):
+        history = MessageHistory(10)
+        history.restore([self.aged_message(0, 0), self.aged_message(1, 120), self.aged_message(2, 0)])
+        history.resize(10, max_age=60)
+        self.assertEqual([message.id for message in history.snapshot()], ['tw_0', 'tw_2'])
+        history.add(self.aged_message(3, 0))
+        self.assertEqual(len(history), 3)
+
+
+class RecordingStore(object):
+    def __init__(self):
+        self.ops = []
+
+    def add(self, message):
+        self.ops.append(('add', message.id))
+
+    def clear(self):
+        self.ops.append(('clear', None))
+
+
+class HistoryReplaceTest(unittest.TestCase):
+    def test_replace_is_stored(self):
+        history = MessageHistory(3)
+        history.add(history_message(0))
+        history.store = RecordingStore()
+        version = history.version
+
+        history.replace([history_message(index) for index in range(1, 5)])
+        self.assertEqual([message.id for message in history.snapshot()], ['tw_2', 'tw_3', 'tw_4'])
+        self.assertEqual(history.store.ops, [('clear', None), ('add', 'tw_2'), ('add', 'tw_3'), ('add', 'tw_4')])
+        self.assertNotEqual(history.version, version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import httplib
+import json
+import threading
+import time
+import unittest
+from cStringIO import StringIO
+
+import requests
+from requests.adapters import BaseAdapter
+
+from modules.helper.httpclient import HttpClient
+from tests.test_messaging import wait_for
+
+
+class FakeOriginalResponse(object):
+    def __init__(self, headers):
+        self.msg = httplib.HTTPMessage(StringIO(''.join('{}: {}\r\n'.format(*header) for header in headers) + '\r\n'))
+
+
+class FakeRaw(object):
+    def __init__(self, headers):
+        self._original_response = FakeOriginalResponse(headers)
+
+
+class FakeAdapter(BaseAdapter):
+    def __init__(self, status=200, headers=(), gate=None):
+        """
+            Transport adapter that answers without network
+        :param gate: threading.Event, requests wait for it before response
+        """
+        BaseAdapter.__init__(self)
+        self.status = status
+        self.headers = list(headers)
+        self.gate = gate
+        self.error = None
+        self.sent = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.sent.append((request.url, kwargs.get('timeout'), request.headers.get('Cookie')))
+        try:
+            if self.gate:
+                self.gate.wait(5)
+            if self.error:
+                raise self.error
+            response = requests.Response()
+            response.status_code = self.status
+            response.url = request.url
+            response.request = request
+            response.raw = FakeRaw(self.headers)
+            response._content = b'{}'
+            return response
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def close(self):
+        pass
+
+
+def fake_pool(client, url, adapter):
+    pool = client.pool(url)
+    pool.session.mount('http://', adapter)
+    return pool
+
+
+class HttpClientTest(unittest.TestCase):
+    def test_default_timeout(self):
+        client = HttpClient(timeout=(1, 2))
+        adapter = FakeAdapter()
+        fake_pool(client, 'http://api.test/', adapter)
+        client.get('http://api.test/default')
+        client.post('http://api.test/own', timeout=7)
+        self.assertEqual([(url, timeout) for url, timeout, _ in adapter.sent],
+                         [('http://api.test/default', (1, 2)), ('http://api.test/own', 7)])
+
+    def test_pool_per_host(self):
+        client = HttpClient(concurrency=3)
+        client.set_limit('limited.test', 1)
+        self.assertIs(client.pool('http://API.test/a'), client.pool('https://api.test/b'))
+        self.assertEqual(client.pool('http://api.test/').concurrency, 3)
+        self.assertEqual(client.pool('http://limited.test/').concurrency, 1)
+
+    def test_cookies_are_not_kept(self):
+        headers = [('Set-Cookie', 'session=1; Path=/')]
+        # Same adapter keeps cookies in plain session, so it is the policy that drops them
+        session = requests.Session()
+        plain = FakeAdapter(headers=headers)
+        session.mount('http://', plain)
+        session.get('http://cookie.test/')
+        session.get('http://cookie.test/')
+        self.assertEqual(plain.sent[1][2], 'session=1')
+
+        client = HttpClient()
+        adapter = FakeAdapter(headers=headers)
+        pool = fake_pool(client, 'http://cookie.test/', adapter)
+        client.get('http://cookie.test/')
+        client.get('http://cookie.test/')
+        self.assertEqual(adapter.sent[1][2], None)
+        self.assertEqual(len(pool.session.cookies), 0)
+
+    def test_host_limit(self):
+        client = HttpClient()
+        client.set_limit('slow.test', 2)
+        gate = threading.Event()
+        adapter = FakeAdapter(gate=gate)
+        pool = fake_pool(client, 'http://slow.test/', adapter)
+
+        threads = [threading.Thread(target=client.get, args=('http://slow.test/{}'.format(index),))
+                   for index in range(5)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(wait_for(lambda: adapter.active == 2))
+        time.sleep(0.05)
+        self.assertEqual(len(adapter.sent), 2)
+        self.assertEqual(pool.json()['active'], 2)
+
+        gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(adapter.sent), 5)
+        self.assertEqual(adapter.max_active, 2)
+        stats = pool.json()
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['wait']['count'], 5)
+        self.assertGreater(stats['wait']['max'], 0.04)
+
+    def test_metrics(self):
+        client = HttpClient()
+        adapter = FakeAdapter()
+        fake_pool(client, 'http://metrics.test/', adapter)
+        client.get('http://metrics.test/')
+        adapter.status = 503
+        client.get('http://metrics.test/')
+        adapter.error = requests.ConnectionError('refused')
+        self.assertRaises(requests.ConnectionError, client.get, 'http://metrics.test/')
+
+        stats = json.loads(client.rest_get_stats())['metrics.test']
+        self.assertEqual(stats['statuses'], {'2xx': 1, '5xx': 1})
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['requests']['calls'], 3)
+        self.assertEqual(stats['active'], 0)
+
+        stats = json.loads(client.rest_reset_stats())['metrics.test']
+        self.assertEqual(stats['statuses'], {})
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['requests']['calls'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
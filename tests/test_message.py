@@ -0,0 +1,34 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import unittest
+
+from modules.helper.message import TextMessage
+
+
+class FrameCacheTest(unittest.TestCase):
+    def test_frame_is_cached_until_invalidated(self):
+        message = TextMessage('tw', None, 'user', 'text')
+        encoded = []
+
+        def encode(item):
+            encoded.append(item.text)
+            return item.text
+
+        self.assertEqual(message.frame('key', encode), 'text')
+        self.assertEqual(message.frame('key', encode), 'text')
+        self.assertEqual(encoded, ['text'])
+        message.text = 'changed'
+        self.assertEqual(message.frame('key', encode), 'changed')
+        self.assertEqual(encoded, ['text', 'changed'])
+
+    def test_invalidate_while_encoding(self):
+        message = TextMessage('tw', None, 'user', 'text')
+
+        def encode(item):
+            item.invalidate()
+            return item.text
+
+        self.assertEqual(message.frame('key', encode), 'text')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+import time
+import unittest
+
+import messaging
+from modules.helper.message import TextMessage, SystemMessage, RemoveMessageByUser
+from modules.helper.stats import TimingStat
+
+
+def text_message(source, channel, text):
+    message = TextMessage(source, None, 'user', text)
+    message.channel_name = channel
+    return message
+
+
+class RecordingModule(object):
+    pure_transform = False
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def process_batch(self, messages, queue=None):
+        for message in messages:
+            if isinstance(message, TextMessage):
+                time.sleep(self.delay)
+            with self.lock:
+                self.processed.append(message)
+        return messages
+
+
+def start_pipeline(module, threads, queue=None):
+    pipeline = messaging.Message(queue if queue is not None else messaging.MessageQueue())
+    pipeline.threads_count = threads
+    pipeline.batch_timeout = 0
+    pipeline.modules = [module]
+    pipeline.module_stats[module] = TimingStat()
+    pipeline.start()
+    return pipeline
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class MessageQueueTest(unittest.TestCase):
+    def test_drop_oldest_keeps_newest_text(self):
+        queue = messaging.MessageQueue(3, messaging.QUEUE_DROP_OLDEST)
+        sent = [text_message('tw', 'a', str(index)) for index in range(5)]
+        for message in sent:
+            queue.put(message)
+        self.assertEqual(list(queue.queue), sent[2:])
+        self.assertEqual(queue.json()['dropped'], {'tw': 2})
+
+    def test_sample_refuses_new_text_when_full(self):
+        queue = messaging.MessageQueue(10, messaging.QUEUE_SAMPLE, 50)
+        sent = [text_message('tw', 'a', str(index)) for index in range(50)]
+        for message in sent:
+            queue.put(message)
+        self.assertEqual(list(queue.queue)[:5], sent[:5])
+        self.assertTrue(5 <= queue.qsize() <= 10)
+        self.assertEqual(queue.json()['dropped']['tw'], 50 - queue.qsize())
+
+    def test_protected_messages_are_never_dropped(self):
+        for policy in messaging.QUEUE_POLICIES:
+            queue = messaging.MessageQueue(2, policy, 50)
+            protected = [SystemMessage('connected'), RemoveMessageByUser('user')]
+            for message in protected + [text_message('tw', 'a', '1')] + protected:
+                queue.put(message)
+            self.assertEqual(list(queue.queue), protected * 2)
+
+    def test_shard_queue_sheds_timed_messages(self):
+        dropped = []
+        queue = messaging.ShardQueue(2, drop=dropped.append)
+        sent = [(0.0, text_message('tw', 'a', str(index))) for index in range(3)]
+        barrier = messaging.ShardBarrier(RemoveMessageByUser('user'), 1)
+        for item in [barrier] + sent + [messaging.STOP_HANDLER]:
+            queue.put(item)
+        self.assertEqual(list(queue.queue), [barrier, sent[2], messaging.STOP_HANDLER])
+        self.assertEqual(queue.json()['dropped'], {'tw': 2})
+        self.assertEqual(dropped, [sent[0][1], sent[1][1]])
+
+
+class ShardKeyTest(unittest.TestCase):
+    def test_same_channel_same_key(self):
+        self.assertEqual(messaging.shard_key(text_message('tw', 'a', '1')),
+                         messaging.shard_key(text_message('tw', 'a', '2')))
+        self.assertNotEqual(messaging.shard_key(text_message('tw', 'a', '1')),
+                            messaging.shard_key(text_message('gg', 'a', '1')))
+
+    def test_command_with_channel_shares_key(self):
+        command = RemoveMessageByUser('user')
+        command.source = 'tw'
+        command.channel_name = 'a'
+        self.assertEqual(messaging.shard_key(command), messaging.shard_key(text_message('tw', 'a', '1')))
+        self.assertFalse(messaging.is_barrier(command))
+
+    def test_command_without_channel_is_barrier(self):
+        self.assertTrue(messaging.is_barrier(RemoveMessageByUser('user')))
+        self.assertFalse(messaging.is_barrier(text_message('tw', None, '1')))
+        self.assertFalse(messaging.is_barrier(SystemMessage('connected')))
+
+
+class ShardOrderingTest(unittest.TestCase):
+    def test_channel_order_is_kept(self):
+        module = RecordingModule()
+        pipeline = start_pipeline(module, 4)
+        sent = [text_message('tw', 'channel_{}'.format(index % 5), str(index)) for index in range(500)]
+        for message in sent:
+            pipeline.queue.put(message)
+        self.assertTrue(wait_for(lambda: len(module.processed) == len(sent)))
+        for channel in range(5):
+            name = 'channel_{}'.format(channel)
+            self.assertEqual([message for message in module.processed if message.channel_name == name],
+                             [message for message in sent if message.channel_name == name])
+
+    def test_barrier_command_is_processed_after_earlier_messages(self):
+        module = RecordingModule(delay=0.002)
+        pipeline = start_pipeline(module, 4)
+        before = [text_message('tw', 'channel_{}'.format(index % 8), str(index)) for index in range(80)]
+        command = RemoveMessageByUser('user')
+        after = [text_message('tw', 'channel_{}'.format(index % 8), str(index)) for index in range(80)]
+        for message in before + [command] + after:
+            pipeline.queue.put(message)
+        self.assertTrue(wait_for(lambda: len(module.processed) == len(before) + len(after) + 1))
+        position = module.processed.index(command)
+        self.assertEqual(set(module.processed[:position]), set(before))
+        self.assertEqual(set(module.processed[position + 1:]), set(after))
+
+    def test_busy_shard_does_not_block_dispatch(self):
+        module = RecordingModule(delay=0.05)
+        pipeline = start_pipeline(module, 2, messaging.MessageQueue(100))
+        busy = [text_message('tw', 'busy', str(index)) for index in range(400)]
+        for message in busy:
+            pipeline.queue.put(message)
+        self.assertTrue(wait_for(lambda: pipeline.queue.empty()))
+        handler = pipeline.threads[hash(messaging.shard_key(busy[0])) % len(pipeline.threads)]
+        self.assertTrue(handler.queue.qsize() <= 50)
+        self.assertTrue(pipeline.dropped().get('tw'))
+
+    def test_handler_queues_share_main_queue_limits(self):
+        pipeline = start_pipeline(RecordingModule(), 4, messaging.MessageQueue(1000, messaging.QUEUE_SAMPLE, 50))
+        for handler in pipeline.threads:
+            self.assertEqual((handler.queue.max_size, handler.queue.high_water, handler.queue.policy),
+                             (250, 125, messaging.QUEUE_SAMPLE))
+        pipeline.resize(2)
+        self.assertEqual([handler.queue.max_size for handler in pipeline.threads], [500, 500])
+
+    def test_pending_counts_until_processed(self):
+        module = RecordingModule(delay=0.01)
+        pipeline = start_pipeline(module, 2)
+        sent = [text_message('tw', 'channel_{}'.format(index % 2), str(index)) for index in range(20)]
+        for message in sent[:10] + [RemoveMessageByUser('user')] + sent[10:]:
+            pipeline.queue.put(message)
+        self.assertTrue(wait_for(lambda: pipeline.queue.empty()))
+        self.assertTrue(pipeline.queue.pending() > 0)
+        self.assertTrue(wait_for(lambda: pipeline.queue.pending() == 0))
+        self.assertEqual(len(module.processed), len(sent) + 1)
+
+    def test_pending_counts_shard_drops(self):
+        module = RecordingModule(delay=0.001)
+        # Main queue can hold all messages, one busy handler queue holds 100
+        pipeline = start_pipeline(module, 4, messaging.MessageQueue(400))
+        for index in range(300):
+            pipeline.queue.put(text_message('tw', 'a', str(index)))
+        self.assertTrue(wait_for(lambda: pipeline.queue.pending() == 0))
+        self.assertTrue(pipeline.shard_dropped.get('tw'))
+        # Main and handler queue drops are reported together
+        self.assertEqual(len(module.processed) + pipeline.dropped()['tw'], 300)
+
+    def test_barrier_survives_resize(self):
+        module = RecordingModule()
+        pipeline = start_pipeline(module, 2)
+        pipeline.queue.put(RemoveMessageByUser('user'))
+        self.assertTrue(wait_for(lambda: len(module.processed) == 1))
+        pipeline.resize(3)
+        pipeline.queue.put(RemoveMessageByUser('user'))
+        pipeline.queue.put(text_message('tw', 'a', '1'))
+        self.assertTrue(wait_for(lambda: len(module.processed) == 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
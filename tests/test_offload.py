@@ -0,0 +1,101 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import unittest
+
+import messaging
+from modules.helper.message import TextMessage, SystemMessage, RemoveMessageByUser, Emote, Badge, dump_message
+from modules.helper.stats import TimingStat
+from modules.messaging.blacklist import blacklist
+from modules.messaging.c2b import c2b
+from modules.messaging.mentions import mentions
+from tests.test_messaging import RecordingModule
+
+
+def transform_modules():
+    return [
+        c2b(conf_params={'config': {'config': {'kappa': 'keepo'}}}),
+        blacklist(conf_params={'config': {'main': {'message': 'blocked'}, 'users_hide': ['hidden_user'],
+                                          'users_block': ['blocked_user'], 'words_hide': ['secret'],
+                                          'words_block': ['spam']}}),
+        mentions(conf_params={'config': {'mentions': ['streamer'], 'address': ['^@streamer']}})
+    ]
+
+
+def sample_messages():
+    with_extension = TextMessage('tw', '/tw.png', 'user', u'kappa \u043b\u043e\u043b', emotes=[Emote('Kappa', '/k.png')],
+                                 badges=[Badge('mod', '/mod.png')], mid='tw_0')
+    with_extension.set_extension('levels', {'level': 3})
+    return [
+        with_extension,
+        TextMessage('gg', None, 'hidden_user', 'hello', mid='gg_1'),
+        TextMessage('gg', None, 'blocked_user', 'hello', mid='gg_2'),
+        TextMessage('tw', None, 'user', 'buy spam now', mid='tw_3'),
+        TextMessage('tw', None, 'user', 'tell me a secret', mid='tw_4'),
+        RemoveMessageByUser('user'),
+        TextMessage('tw', None, 'user', 'hi streamer kappa', mid='tw_5'),
+        TextMessage('tw', None, 'user', '@streamer hi', mid='tw_6', pm=False),
+        SystemMessage('connected', source='tw'),
+    ]
+
+
+def pipeline(offload):
+    message = messaging.Message(messaging.MessageQueue())
+    recorder = RecordingModule()
+    message.modules = transform_modules() + [recorder]
+    for m_module in message.modules:
+        message.module_stats[m_module] = TimingStat()
+    message.offload = offload
+    message.offload_processes = 2
+    message.start_offload()
+    return message, recorder
+
+
+def state(message):
+    if not isinstance(message, TextMessage):
+        return message.json()
+    data = dump_message(message)
+    # Messages of two runs are created at different time, system messages get random ids
+    del data['created']
+    if isinstance(message, SystemMessage):
+        del data['id']
+    return data, sorted(message.iter_extensions())
+
+
+class OffloadTest(unittest.TestCase):
+    def setUp(self):
+        self.offloaded, self.offloaded_result = pipeline(True)
+        self.local, self.local_result = pipeline(False)
+
+    def tearDown(self):
+        self.offloaded.offload_pool.terminate()
+        self.offloaded.offload_pool.join()
+
+    def test_pool_matches_in_process(self):
+        self.assertTrue(self.offloaded.offload_pool)
+        self.assertFalse(self.local.offload_pool)
+        offloaded = sample_messages()
+        local = sample_messages()
+        self.offloaded.msg_process(offloaded)
+        self.local.msg_process(local)
+
+        self.assertEqual([state(message) for message in self.offloaded_result.processed],
+                         [state(message) for message in self.local_result.processed])
+        # Commands are not sent to workers, messages keep their objects and order
+        self.assertEqual(len(self.offloaded_result.processed), len(offloaded))
+        for original, processed in zip(offloaded, self.offloaded_result.processed):
+            self.assertTrue(original is processed)
+        self.assertTrue(self.offloaded_result.processed[0].text.startswith('keepo'))
+        self.assertEqual(self.offloaded_result.processed[0].get_extension('levels'), {'level': 3})
+        self.assertTrue(self.offloaded_result.processed[1].get_extension('hidden'))
+        self.assertEqual(self.offloaded_result.processed[2].text, 'blocked')
+        self.assertTrue(self.offloaded_result.processed[6].get_extension('mention'))
+        self.assertTrue(self.offloaded_result.processed[7].pm)
+
+    def test_config_changes_reach_workers(self):
+        self.offloaded.modules[0].conf_params()['config']['config'] = {'hello': 'bye'}
+        message = TextMessage('tw', None, 'user', 'hello there')
+        self.offloaded.msg_process([message])
+        self.assertTrue(message.text.startswith('bye'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import os
+import unittest
+
+from modules.helper.plugins import PluginRegistry
+
+MESSAGING_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules', 'messaging')
+
+
+class MessagingLoadOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = PluginRegistry('modules.messaging', MESSAGING_FOLDER, cache_file=None)
+
+    def test_priorities(self):
+        priorities = dict((name, self.registry.priority(name))
+                          for name in ['c2b', 'logger', 'blacklist', 'webchat'])
+        self.assertEqual(priorities, {'c2b': 10, 'logger': 20, 'blacklist': 30, 'webchat': 9001})
+
+    def test_webchat_is_processed_last(self):
+        names = list(self.registry.discover())
+        self.assertEqual(max(names, key=self.registry.priority), 'webchat')
+
+    def test_levels_is_constructed_after_webchat(self):
+        waves = self.registry._waves(['levels', 'c2b', 'webchat', 'logger'])
+        wave_of = dict((name, index) for index, wave in enumerate(waves) for name in wave)
+        self.assertTrue(wave_of['levels'] > wave_of['webchat'])
+        self.assertEqual(wave_of['c2b'], wave_of['webchat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
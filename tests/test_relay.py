@@ -0,0 +1,248 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from modules.helper.evented import EventedServer, EventedWebSocket
+from modules.helper.history import MessageHistory
+from modules.helper.message import TextMessage, RelayedMessage
+from modules.helper import relay
+from modules.helper.relay import RelayHub, RelayClient, apply_relayed_command
+
+
+def frame_data(frame):
+    """
+        Payload of unmasked server frame
+    """
+    length = ord(frame[1]) & 0x7f
+    if length == 126:
+        return frame[4:4 + struct.unpack('!H', frame[2:4])[0]]
+    if length == 127:
+        return frame[10:10 + struct.unpack('!Q', frame[2:10])[0]]
+    return frame[2:2 + length]
+
+
+class RecordingRelay(object):
+    def __init__(self):
+        self.envelopes = []
+
+    def send_frame(self, frame):
+        self.envelopes.append(json.loads(frame_data(frame)))
+
+
+def payload(number):
+    return json.dumps({'n': number})
+
+
+class RelayHubTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = RelayHub(3)
+        self.history = []
+
+    def publish(self, count):
+        for _ in range(count):
+            item = payload(len(self.history))
+            self.hub.publish(item, lambda: self.history.append(item))
+
+    def attach(self, cursor):
+        client = RecordingRelay()
+        self.hub.attach(client, cursor, lambda: list(self.history))
+        return client
+
+    def test_new_relay_gets_history(self):
+        self.publish(5)
+        client = self.attach('')
+        self.assertEqual(client.envelopes, [{'epoch': self.hub.epoch, 'seq': 5, 'reset': True,
+                                             'history': [{'n': number} for number in range(5)]}])
+        self.publish(1)
+        self.assertEqual(client.envelopes[1:], [{'seq': 6, 'message': {'n': 5}}])
+
+    def test_resume_sends_missed_messages(self):
+        self.publish(5)
+        client = self.attach('{}:3'.format(self.hub.epoch))
+        self.assertEqual(client.envelopes, [{'epoch': self.hub.epoch, 'seq': 3, 'reset': False},
+                                            {'seq': 4, 'message': {'n': 3}},
+                                            {'seq': 5, 'message': {'n': 4}}])
+
+    def test_resume_at_head(self):
+        self.publish(5)
+        client = self.attach('{}:5'.format(self.hub.epoch))
+        self.assertEqual(client.envelopes, [{'epoch': self.hub.epoch, 'seq': 5, 'reset': False}])
+
+    def test_gap_older_than_log_is_reset(self):
+        self.publish(5)
+        for cursor in ('{}:1'.format(self.hub.epoch), '{}:9'.format(self.hub.epoch), 'old:5', 'invalid'):
+            envelope = self.attach(cursor).envelopes[0]
+            self.assertTrue(envelope['reset'], cursor)
+            self.assertEqual(len(envelope['history']), 5)
+
+    def test_reset_and_detach(self):
+        self.publish(2)
+        client = self.attach('')
+        epoch = self.hub.epoch
+        time.sleep(0.002)
+        self.history = [payload(10)]
+        self.hub.reset(lambda: list(self.history))
+        self.assertNotEqual(self.hub.epoch, epoch)
+        self.assertEqual(client.envelopes[-1], {'epoch': self.hub.epoch, 'seq': 0, 'reset': True,
+                                                'history': [{'n': 10}]})
+        self.hub.detach(client)
+        self.publish(1)
+        self.assertEqual(len(client.envelopes), 2)
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class RelayClientTest(unittest.TestCase):
+    def setUp(self):
+        self.resets = []
+        self.messages = []
+        self.client = RelayClient('ws://127.0.0.1/ws', self.resets.append, self.messages.append)
+        self.client.connection = FakeConnection()
+
+    def process(self, envelope):
+        self.client.process(json.dumps(envelope))
+
+    def test_sequence(self):
+        self.process({'epoch': 'a', 'seq': 1, 'reset': True, 'history': [{'n': 0}]})
+        self.process({'seq': 2, 'message': {'n': 1}})
+        self.process({'seq': 2, 'message': {'n': 1}})
+        self.process({'seq': 3, 'message': {'n': 2}})
+        self.assertEqual(self.resets, [[payload(0)]])
+        self.assertEqual(self.messages, [payload(1), payload(2)])
+        self.assertEqual(self.client.url(), 'ws://127.0.0.1/ws?relay=a%3A3')
+
+    def test_gap_reconnects(self):
+        self.process({'epoch': 'a', 'seq': 1, 'reset': False})
+        self.process({'seq': 3, 'message': {'n': 2}})
+        self.assertTrue(self.client.connection.closed)
+        self.assertEqual(self.messages, [])
+        self.assertEqual(self.client.seq, 1)
+
+    def test_invalid_envelopes_are_ignored(self):
+        self.process({'epoch': 'a', 'seq': 1, 'reset': False})
+        self.client.process('not json')
+        self.process({'message': {'n': 1}})
+        self.process({'seq': 'x', 'message': {'n': 1}})
+        self.process({'seq': 2})
+        self.process({'epoch': 'b', 'reset': True})
+        self.process([1])
+        self.assertEqual((self.client.epoch, self.client.seq), ('a', 1))
+        self.assertEqual(self.messages, [])
+        self.assertFalse(self.client.connection.closed)
+
+
+class ApplyRelayedCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.history = MessageHistory()
+        self.local = TextMessage('tw', None, 'user', 'local', mid='tw_1')
+        self.relayed = RelayedMessage(json.dumps({'type': 'message', 'id': 'up_1', 'user': 'user', 'text': 'up'}))
+        self.other = RelayedMessage(json.dumps({'type': 'message', 'id': 'up_2', 'user': 'other', 'text': 'up'}))
+        for message in (self.local, self.relayed, self.other):
+            self.history.add(message)
+
+    def test_replace_local_and_relayed_messages(self):
+        version = self.history.version
+        apply_relayed_command(self.history, RelayedMessage(json.dumps(
+            {'type': 'command', 'command': 'replace_by_user', 'user': ['user'], 'text': 'removed'})))
+        self.assertEqual([message.json()['text'] for message in self.history.snapshot()],
+                         ['removed', 'removed', 'up'])
+        self.assertNotEqual(self.history.version, version)
+
+    def test_remove_by_id(self):
+        apply_relayed_command(self.history, RelayedMessage(json.dumps(
+            {'type': 'command', 'command': 'remove_by_id', 'message_ids': ['up_1', 'tw_1'], 'text': 'x'})))
+        self.assertEqual(self.history.snapshot(), [self.other])
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class RelayStreamTest(unittest.TestCase):
+    """
+        Upstream hub served by evented server and relay client over localhost,
+          connections are dropped while messages are published
+    """
+    def setUp(self):
+        self.reconnect_delay = relay.RECONNECT_DELAY
+        relay.RECONNECT_DELAY = 0.05
+        self.hub = RelayHub(1000)
+        self.history = []
+        self.sockets = []
+        hub, history, sockets = self.hub, self.history, self.sockets
+
+        class RelaySocket(EventedWebSocket):
+            def opened(self):
+                sockets.append(self)
+                cursor = self.environ.get('QUERY_STRING', '').partition('relay=')[2]
+                hub.attach(self, relay.urllib.unquote(cursor), lambda: list(history))
+
+            def on_close(self):
+                hub.detach(self)
+
+        port = free_port()
+        self.server = EventedServer('127.0.0.1', port, lambda environ, start: [], {'/ws': RelaySocket})
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        self.received = []
+        self.resets = []
+        self.client = RelayClient('ws://127.0.0.1:{}/ws'.format(port), self.on_reset, self.on_message)
+
+    def tearDown(self):
+        self.client.stop()
+        self.server.stop()
+        relay.RECONNECT_DELAY = self.reconnect_delay
+
+    def on_reset(self, payloads):
+        self.resets.append(len(payloads))
+        self.received[:] = [json.loads(item)['n'] for item in payloads]
+
+    def on_message(self, item):
+        self.received.append(json.loads(item)['n'])
+
+    def publish(self, count):
+        for _ in range(count):
+            item = payload(len(self.history))
+            self.hub.publish(item, lambda: self.history.append(item))
+
+    def test_resume_after_disconnects(self):
+        self.publish(10)
+        self.client.start()
+        self.assertTrue(wait_for(lambda: self.received == range(10)))
+        for _ in range(3):
+            for websocket in list(self.sockets):
+                if not websocket.terminated:
+                    websocket.close_with()
+            self.publish(100)
+        self.assertTrue(wait_for(lambda: len(self.received) == 310))
+        self.assertEqual(self.received, range(310))
+        self.assertEqual(self.resets, [10])
+        self.assertEqual(self.client.seq, 310)
+        self.assertTrue(self.client.reconnects >= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
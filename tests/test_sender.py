@@ -0,0 +1,104 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+import unittest
+
+from modules.helper.sender import ClientSender, POLICY_DROP_OLDEST, POLICY_DISCONNECT
+from tests.test_messaging import wait_for
+
+
+class BlockingClient(object):
+    def __init__(self):
+        """
+            Client socket that blocks on write until it is released
+        """
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+        self.frames = []
+        self.disconnected = 0
+
+    def write(self, frame):
+        self.writing.set()
+        self.gate.wait(5)
+        self.frames.append(frame)
+
+    def disconnect(self):
+        self.disconnected += 1
+
+
+class ClientSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.client = BlockingClient()
+        self.sender = None
+
+    def tearDown(self):
+        self.client.gate.set()
+        self.sender.stop()
+
+    def start(self, max_size, policy):
+        self.sender = ClientSender(self.client.write, self.client.disconnect, max_size, policy, name='test')
+        self.sender.start()
+        # First frame is taken by writer thread and blocks it, rest stays queued
+        self.sender.put('blocking')
+        self.assertTrue(self.client.writing.wait(5))
+        return self.sender
+
+    def test_frames_are_written_in_order(self):
+        sender = self.start(10, POLICY_DROP_OLDEST)
+        for index in range(5):
+            self.assertTrue(sender.put(index))
+        self.client.gate.set()
+        self.assertTrue(wait_for(lambda: len(self.client.frames) == 6))
+        self.assertEqual(self.client.frames, ['blocking', 0, 1, 2, 3, 4])
+        self.assertTrue(wait_for(lambda: sender.json()['sent'] == 6))
+        self.assertEqual(sender.json()['lag']['count'], 6)
+
+    def test_overflow_drops_oldest(self):
+        sender = self.start(3, POLICY_DROP_OLDEST)
+        for index in range(5):
+            self.assertTrue(sender.put(index))
+        stats = sender.json()
+        self.assertEqual((stats['queued'], stats['dropped']), (3, 2))
+        self.assertGreater(stats['writing_for'], 0)
+
+        self.client.gate.set()
+        self.assertTrue(wait_for(lambda: len(self.client.frames) == 4))
+        self.assertEqual(self.client.frames, ['blocking', 2, 3, 4])
+        self.assertEqual(self.client.disconnected, 0)
+
+    def test_overflow_disconnects(self):
+        sender = self.start(3, POLICY_DISCONNECT)
+        for index in range(3):
+            self.assertTrue(sender.put(index))
+        self.assertFalse(sender.put(3))
+        self.assertEqual(self.client.disconnected, 1)
+        self.assertEqual(sender.json()['queued'], 0)
+        # Sender is stopped, nothing else is queued or disconnected again
+        self.assertFalse(sender.put(4))
+        self.assertEqual(self.client.disconnected, 1)
+
+        self.client.gate.set()
+        self.assertTrue(wait_for(lambda: not sender.is_alive()))
+        self.assertEqual(self.client.frames, ['blocking'])
+
+    def test_configure(self):
+        sender = self.start(10, POLICY_DROP_OLDEST)
+        sender.configure(2, POLICY_DISCONNECT)
+        sender.configure(policy='unknown')
+        self.assertEqual((sender.max_size, sender.policy), (2, POLICY_DISCONNECT))
+        sender.put(0)
+        sender.put(1)
+        self.assertFalse(sender.put(2))
+        self.assertEqual(self.client.disconnected, 1)
+
+    def test_write_error_stops_sender(self):
+        def write(frame):
+            raise IOError('closed')
+        self.sender = ClientSender(write, self.client.disconnect, name='test')
+        self.sender.start()
+        self.sender.put('frame')
+        self.assertTrue(wait_for(lambda: not self.sender.is_alive()))
+        self.assertFalse(self.sender.put('frame'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from modules.helper.message import TextMessage, SystemMessage, RelayedMessage, Emote, Badge, dump_message
+from modules.helper.store import HistoryStore
+
+
+def stored_message(index, **kwargs):
+    message = TextMessage('tw', '/img/tw.png', 'user_{}'.format(index), 'text {}'.format(index),
+                          mid='tw_{}'.format(index), **kwargs)
+    message.channel_name = 'channel'
+    return message
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'history.db')
+        self.store = self.start_store()
+
+    def tearDown(self):
+        self.store.stop()
+        shutil.rmtree(self.folder)
+
+    def start_store(self, keep=10, max_age=0):
+        store = HistoryStore(self.path, keep, max_age, flush_interval=0.01)
+        store.start()
+        return store
+
+    def reload(self, limit=10, max_age=0):
+        self.store.stop()
+        messages = self.store.load(limit, max_age)
+        self.store = self.start_store(self.store.keep, self.store.max_age)
+        return messages
+
+    def test_round_trip(self):
+        message = stored_message(1, emotes=[Emote('Kappa', '/kappa.png')], badges=[Badge('mod', '/mod.png')])
+        message.set_extension('levels', {'level': 2})
+        system = SystemMessage('connected', 'tw', '/img/tw.png', category='connection')
+        self.store.add(message)
+        self.store.add(system)
+        loaded, loaded_system = self.reload()
+        self.assertEqual(dump_message(loaded), dump_message(message))
+        self.assertEqual(loaded.get_extension('levels'), {'level': 2})
+        self.assertTrue(isinstance(loaded_system, SystemMessage))
+        self.assertEqual(loaded_system.category, 'connection')
+        self.assertEqual(dump_message(loaded_system), dump_message(system))
+
+    def test_update_remove_clear(self):
+        messages = [stored_message(index) for index in range(3)]
+        for message in messages:
+            self.store.add(message)
+        messages[0].text = 'replaced'
+        self.store.update([messages[0]])
+        self.store.remove([messages[1]])
+        loaded = self.reload()
+        self.assertEqual([message.id for message in loaded], ['tw_0', 'tw_2'])
+        self.assertEqual(loaded[0].text, 'replaced')
+        self.store.clear()
+        self.assertEqual(self.reload(), [])
+
+    def test_keep_and_max_age(self):
+        self.store.configure(3, 60)
+        old = stored_message(0)
+        old._created = time.time() - 120
+        self.store.add(old)
+        for index in range(1, 6):
+            self.store.add(stored_message(index))
+        self.assertEqual([message.id for message in self.reload()], ['tw_3', 'tw_4', 'tw_5'])
+        self.assertEqual([message.id for message in self.reload(limit=2)], ['tw_4', 'tw_5'])
+
+    def test_keep_after_remove(self):
+        self.store.configure(5)
+        messages = [stored_message(index) for index in range(6)]
+        for message in messages:
+            self.store.add(message)
+        self.assertEqual([message.id for message in self.reload()], ['tw_1', 'tw_2', 'tw_3', 'tw_4', 'tw_5'])
+        # Removed rows leave gaps in seq, trim still keeps newest 5 rows
+        self.store.remove(messages[3:5])
+        for index in range(6, 8):
+            self.store.add(stored_message(index))
+        self.assertEqual([message.id for message in self.reload()], ['tw_1', 'tw_2', 'tw_5', 'tw_6', 'tw_7'])
+        self.store.add(stored_message(8))
+        self.assertEqual([message.id for message in self.reload()], ['tw_2', 'tw_5', 'tw_6', 'tw_7', 'tw_8'])
+
+    def test_relayed_message(self):
+        payload = json.dumps({'type': 'message', 'id': 'up_1', 'user': 'user', 'text': 'relayed'})
+        message = RelayedMessage(payload)
+        self.store.add(message)
+        loaded, = self.reload()
+        self.assertTrue(isinstance(loaded, RelayedMessage))
+        self.assertEqual(loaded.payload, payload)
+        self.assertEqual(loaded.id, 'up_1')
+        self.assertEqual(loaded.created, message.created)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cherrypy
+
+from modules.helper.clients import ClientRegistry
+from modules.helper.message import RemoveMessageByID, RelayedMessage
+from modules.helper.relay import RelayHub
+from modules.messaging import webchat
+from tests.test_messaging import start_pipeline, text_message, wait_for
+from tests.test_relay import frame_data
+
+
+def style_settings():
+    return {chat_type: {'style_name': 'default', 'keys': {'remove_text': 'removed'}, 'revision': 0}
+            for chat_type in ('chat', 'gui')}
+
+
+class RecordingSocket(object):
+    compression = None
+
+    def __init__(self):
+        self.payloads = []
+
+    def send_frame(self, frame):
+        self.payloads.append(json.loads(frame_data(frame)))
+
+
+class FakePlugin(object):
+    def __init__(self):
+        self.clients = ClientRegistry()
+        self.batcher = None
+
+
+class DeliveryModule(webchat.webchat):
+    def __init__(self):
+        # Only delivery part of the module, without config and web server
+        self.s_thread = None
+        self._deliver_lock = threading.Lock()
+
+
+class DeliveryOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.plugin = FakePlugin()
+        self.socket = RecordingSocket()
+        self.plugin.clients.add(self.socket, 'chat')
+        self.sender = webchat.MessagingThread(style_settings(), self.plugin)
+        self.sender.start()
+
+        self.module = DeliveryModule()
+
+    def tearDown(self):
+        self.sender.stop()
+        webchat.s_queue.put([])
+
+    def test_channel_order_is_kept_until_client(self):
+        pipeline = start_pipeline(self.module, 4)
+        pipeline.batch_size = 5
+        sent = [text_message('tw', 'channel_{}'.format(index % 8), str(index)) for index in range(400)]
+        for message in sent:
+            pipeline.queue.put(message)
+        self.assertTrue(wait_for(lambda: len(self.socket.payloads) == len(sent)))
+        for channel in range(8):
+            name = 'channel_{}'.format(channel)
+            self.assertEqual([payload['text'] for payload in self.socket.payloads if payload['channel_name'] == name],
+                             [message.text for message in sent if message.channel_name == name])
+
+
+class RelayedGuiTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = style_settings()
+        self.settings['gui'].update(style_name='gui_style', keys={'remove_text': 'gui removed'})
+        self.plugin = FakePlugin()
+        self.chat = RecordingSocket()
+        self.gui = RecordingSocket()
+        self.plugin.clients.add(self.chat, 'chat')
+        self.plugin.clients.add(self.gui, 'gui')
+        self.sender = webchat.MessagingThread(self.settings, self.plugin)
+        self.sender.start()
+
+    def tearDown(self):
+        self.sender.stop()
+        webchat.s_queue.put([])
+
+    def test_gui_gets_local_style(self):
+        message = {'type': 'message', 'id': 'up_1', 'user': 'user', 'text': 'relayed',
+                   'levels': {'level': 2, 'url': '/img/levels/2.png?default'}}
+        command = {'type': 'command', 'command': 'replace_by_id', 'message_ids': ['up_1'], 'text': 'removed'}
+        payloads = [json.dumps(message), json.dumps(command)]
+        webchat.s_queue.put([RelayedMessage(payload) for payload in payloads])
+
+        self.assertTrue(wait_for(lambda: len(self.gui.payloads) == 2 and len(self.chat.payloads) == 2))
+        self.assertEqual(self.chat.payloads, [message, command])
+        gui_message, gui_command = self.gui.payloads
+        self.assertEqual(gui_message['levels'], {'level': 2, 'url': '/img/levels/2.png?gui_style'})
+        self.assertEqual(gui_message['text'], 'relayed')
+        self.assertEqual(gui_command['text'], 'gui removed')
+        self.assertEqual(gui_command['message_ids'], ['up_1'])
+
+
+class RemoveCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+        self.listeners = [(channel, self._listener(channel)) for channel in ('websocket-broadcast', 'del-history')]
+        for channel, listener in self.listeners:
+            cherrypy.engine.subscribe(channel, listener)
+
+    def tearDown(self):
+        for channel, listener in self.listeners:
+            cherrypy.engine.unsubscribe(channel, listener)
+
+    def _listener(self, channel):
+        return lambda value: self.published.append((channel, value))
+
+    def test_replace_command_payload(self):
+        payload = json.loads(webchat.encode_message(RemoveMessageByID(['1', '2']), style_settings()['chat'], 'chat'))
+        self.assertEqual(payload, {'type': 'command', 'command': 'replace_by_id',
+                                   'message_ids': ['1', '2'], 'text': 'removed'})
+
+    def test_remove_command_payload(self):
+        payload = json.loads(webchat.encode_message(RemoveMessageByID(['1'], text='removed'),
+                                                    style_settings()['chat'], 'chat'))
+        self.assertEqual(payload['command'], 'remove_by_id')
+        self.assertEqual(payload['message_ids'], ['1'])
+        self.assertEqual(payload['type'], 'command')
+
+    def test_rest_delete_broadcasts_removal(self):
+        module = DeliveryModule()
+        module.style_settings = style_settings()
+        module.relay_hub = RelayHub(0)
+        module.rest_delete_history(('1', '2'))
+
+        self.assertEqual(self.published[0], ('del-history', ('1', '2')))
+        channel, payload = self.published[1]
+        self.assertEqual(channel, 'websocket-broadcast')
+        payload = json.loads(payload)
+        self.assertEqual(payload['type'], 'command')
+        self.assertEqual(payload['command'], 'remove_by_id')
+        self.assertEqual(payload['message_ids'], ['1', '2'])
+
+
+class CountingCssRoot(webchat.CssRoot):
+    def __init__(self, settings):
+        webchat.CssRoot.__init__(self, settings)
+        self.compiled = 0
+
+    def compile_scss(self, file_path):
+        self.compiled += 1
+        return webchat.CssRoot.compile_scss(self, file_path)
+
+
+class CssCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.folder, 'css'))
+        with open(os.path.join(self.folder, 'css', 'style.scss'), 'w') as scss:
+            scss.write('.message { color: $text_color; }\n')
+        self.settings = {'style_name': 'default', 'location': self.folder,
+                         'keys': {'text_color': '#123456'}, 'revision': 0}
+        self.root = CountingCssRoot(self.settings)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compiled_once_per_revision(self):
+        first = self.root.style_scss('css', 'style.scss')
+        self.assertIn('#123456', first)
+        self.assertEqual(self.root.style_scss('css', 'style.scss'), first)
+        self.assertEqual(self.root.compiled, 1)
+
+        # Applying style settings bumps revision, cache is dropped even if keys are the same
+        self.settings['revision'] += 1
+        self.assertEqual(self.root.style_scss('css', 'style.scss'), first)
+        self.assertEqual(self.root.compiled, 2)
+
+        self.settings['keys'] = {'text_color': '#654321'}
+        self.settings['revision'] += 1
+        self.assertIn('#654321', self.root.style_scss('css', 'style.scss'))
+        self.assertEqual(self.root.compiled, 3)
+
+    def test_failed_build_is_not_cached(self):
+        self.assertEqual(self.root.get_cached('key', lambda: None), None)
+        etag, content = self.root.get_cached('key', lambda: u'.a {}')
+        self.assertEqual(content, u'.a {}')
+        self.assertEqual(self.root.get_cached('key', lambda: u'other'), (etag, content))
+
+    def test_build_does_not_block_other_keys(self):
+        gate = threading.Event()
+        building = threading.Event()
+        builds = []
+
+        def slow_build():
+            builds.append('slow')
+            building.set()
+            gate.wait(5)
+            return 'slow'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.root.get_cached('slow', slow_build)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(building.wait(5))
+        # Other file is served while slow one is compiled
+        fast = threading.Thread(target=lambda: results.append(self.root.get_cached('fast', lambda: 'fast')))
+        fast.start()
+        fast.join(1)
+        self.assertFalse(fast.is_alive())
+        self.assertEqual(results.pop()[1], 'fast')
+
+        gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(builds, ['slow'])
+        self.assertEqual([content for _, content in results], ['slow'] * 3)
+
+    def test_build_for_old_revision_is_not_cached(self):
+        def build():
+            self.settings['revision'] += 1
+            return 'old'
+        self.assertEqual(self.root.get_cached('key', build)[1], 'old')
+        self.assertEqual(self.root.get_cached('key', lambda: 'new')[1], 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()